@@ -0,0 +1,4 @@
+import time
+
+#When the app package started importing; main.py reports the import time from it (metrics.startup_seconds).
+IMPORT_STARTED = time.perf_counter()
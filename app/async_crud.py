@@ -0,0 +1,101 @@
+#Async versions of the functions in crud.py, used by the async route handlers in main.py.
+#Every function accepts either kind of session that database.get_db can hand out:
+# -> AsyncSession (DB_ASYNC=true): the crud function runs through AsyncSession.run_sync(), which drives the
+#    async driver (asyncpg / aiosqlite) from the event loop. No threadpool worker is held while waiting on the DB.
+# -> Session (the default sync mode, also used by the tests): the crud function runs in the threadpool,
+#    exactly like a plain "def" route handler would.
+#This way the SQL lives in one place (crud.py) and both modes always behave the same.
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from . import cache, crud, schemas, utils
+
+#Run fn(session, *args, **kwargs) without blocking the event loop.
+async def run(db, fn, *args, **kwargs):
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(lambda session: fn(session, *args, **kwargs))
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def get_tasks(db, owner_id: int, **filters):
+    return await run(db, crud.get_tasks, owner_id, **filters)
+
+async def search_tasks(db, owner_id: int, q: str, limit: int = crud.DEFAULT_PAGE_SIZE, offset: int = 0):
+    return await run(db, crud.search_tasks, owner_id, q, limit, offset)
+
+async def get_task_stats(db, owner_id: int):
+    return await run(db, crud.get_task_stats, owner_id)
+
+async def get_task_changes(db, owner_id: int, since: int, limit: int):
+    return await run(db, crud.get_task_changes, owner_id, since, limit)
+
+async def get_change_marker(db, owner_id: int):
+    return await run(db, crud.get_change_marker, owner_id)
+
+async def get_change_bounds(db):
+    return await run(db, crud.get_change_bounds)
+
+async def get_task(db, task_id: int, owner_id: int):
+    return await run(db, crud.get_task, task_id, owner_id)
+
+async def get_archived_task(db, task_id: int, owner_id: int):
+    return await run(db, crud.get_archived_task, task_id, owner_id)
+
+async def get_task_cached(db, task_id: int, owner_id: int):
+    #Cache hits don't need the DB (or a threadpool hop) at all
+    entry = cache.task_cache.get(task_id)
+    if entry is not None:
+        return entry if entry["owner_id"] == owner_id else None
+    return await run(db, crud.load_task_entry, task_id, owner_id)
+
+async def create_task(db, task: schemas.TaskCreate, owner_id: int):
+    return await run(db, crud.create_task, task, owner_id)
+
+async def create_task_idempotent(db, task: schemas.TaskCreate, owner_id: int, key: str):
+    #A retry of a recent request is answered from cache.idempotency_cache, without the DB
+    entry = cache.idempotency_cache.get(f"{owner_id}:{key}")
+    if entry is not None:
+        return crud.replay_idempotent(entry, crud.idempotency_hash(task)), True
+    return await run(db, crud.create_task_idempotent, task, owner_id, key)
+
+async def update_task(db, task_id: int, task: schemas.TaskUpdate, owner_id: int):
+    return await run(db, crud.update_task, task_id, task, owner_id)
+
+async def patch_task(db, task_id: int, patch: schemas.TaskPatch, owner_id: int):
+    return await run(db, crud.patch_task, task_id, patch, owner_id)
+
+async def delete_task(db, task_id: int, owner_id: int):
+    return await run(db, crud.delete_task, task_id, owner_id)
+
+async def bulk_create_tasks(db, items: list, owner_id: int):
+    return await run(db, crud.bulk_create_tasks, items, owner_id)
+
+async def bulk_update_tasks(db, items: list, owner_id: int):
+    return await run(db, crud.bulk_update_tasks, items, owner_id)
+
+async def bulk_delete_tasks(db, task_ids: list, owner_id: int):
+    return await run(db, crud.bulk_delete_tasks, task_ids, owner_id)
+
+#Async version of crud.stream_tasks.
+#With an AsyncSession the rows come from AsyncSession.stream() (a server-side cursor on PostgreSQL),
+#otherwise the sync generator is iterated in the threadpool one batch at a time.
+async def stream_tasks(db, owner_id: int, batch_size: int = 1000, **filters):
+    if isinstance(db, AsyncSession):
+        stmt = crud.export_statement(owner_id, **filters)
+        result = await db.stream(stmt, execution_options={"yield_per": batch_size})
+        async for batch in result.partitions():
+            yield batch
+    else:
+        async for batch in iterate_in_threadpool(crud.stream_tasks(db, owner_id, batch_size, **filters)):
+            yield batch
+
+#The user functions take the session as their last argument.
+#The password is hashed in the bounded password hashing pool first (utils.hash_password_async),
+#so bcrypt never runs on the event loop or in the shared threadpool.
+async def create_user(user: schemas.UserCreate, db):
+    hashed_password = await utils.hash_password_async(user.password)
+    return await run(db, lambda session: crud.create_user(user, session, hashed_password))
+
+async def get_user_by_username(username: str, db):
+    return await run(db, lambda session: crud.get_user_by_username(username, session))
+
+async def revoke_token(db, jti: str, token_type: str, expires_at):
+    return await run(db, crud.revoke_token, jti, token_type, expires_at)
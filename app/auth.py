@@ -1,5 +1,9 @@
 #set token expiration times.
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import threading
+import uuid
 #jwt is used to encode/decode JWT tokens.
 #JWTError helps catch token-related exceptions
 from jose import JWTError, jwt
@@ -10,57 +14,212 @@ from fastapi import Depends, HTTPException, status
 #Provides a token-based dependency to extract the Authorization: Bearer <token> from requests.
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from app import database, crud, utils, schemas
+from starlette.concurrency import run_in_threadpool
+from app import database, async_crud, cache, crud, utils, schemas
 import os
 
+logger = logging.getLogger("app.auth")
+
+#Tokens
+#Login hands out two tokens:
+# -> an access token, sent with every request. Short-lived (ACCESS_TOKEN_EXPIRE_MINUTES) and checked without
+#    any DB query: signature, expiry, and the in-memory list of revoked token ids (revoked_tokens below).
+# -> a refresh token, only sent to POST /token/refresh to get a new pair. Long-lived (REFRESH_TOKEN_EXPIRE_DAYS),
+#    checked against the DB, and single use: every refresh revokes the refresh token it was given.
+#Every token has a unique id ("jti") so it can be revoked, and a "type" so one kind can't be used as the other.
+
 #These define how the JWT token will be signed, which algorithm to use, and how long it will last
 SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
-#Token extractor: 
+ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+
+#Signing keys, by key id ("kid"). The kid goes in each token's header, so verification picks the right key.
+#JWT_KEYS="2024-11:secret-a,2025-05:secret-b"; SECRET_KEY alone still works (kid "default").
+#New tokens are signed with JWT_ACTIVE_KID (default: the first key).
+#To rotate: add the new key everywhere, then make it the active one, and drop the old key once the last
+#tokens signed with it have expired (REFRESH_TOKEN_EXPIRE_DAYS later).
+DEFAULT_KID = "default"
+
+def load_signing_keys() -> dict:
+    keys = {}
+    for entry in filter(None, (part.strip() for part in os.getenv("JWT_KEYS", "").split(","))):
+        kid, _, secret = entry.partition(":")
+        keys[kid] = secret
+    if SECRET_KEY:
+        keys.setdefault(DEFAULT_KID, SECRET_KEY)
+    return keys
+
+SIGNING_KEYS = load_signing_keys()
+ACTIVE_KID = os.getenv("JWT_ACTIVE_KID") or next(iter(SIGNING_KEYS), None)
+
+#Token extractor:
 #his creates a dependency that expects the client to send a token in the Authorization header.It’s used to automatically pull tokens from requests for protected routes.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
-#Token generator: 
-def create_access_token(data: dict):
+#Token generator:
+#Signs the claims in data with the active key, adding type, a fresh jti, iat and exp.
+def create_token(data: dict, token_type: str, expires_delta: timedelta):
     #Starts by copying the user's info (data)
     to_encode = data.copy()
-    #Sets the expiry time by adding x minutes to the current time
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    #Sets the expiry time by adding expires_delta to the current time
+    now = datetime.now(timezone.utc)
     #Adds the expiry to the payload, which will be encoded in the toke
-    to_encode.update({"exp": expire})
-    #Returns the final JWT token, signed with your secret key
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({"type": token_type, "jti": uuid.uuid4().hex, "iat": now, "exp": now + expires_delta})
+    #Returns the final JWT token, signed with the active key (its kid in the header)
+    return jwt.encode(to_encode, SIGNING_KEYS[ACTIVE_KID], algorithm=ALGORITHM, headers={"kid": ACTIVE_KID})
+
+def create_access_token(data: dict):
+    return create_token(data, "access", timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+def create_refresh_token(data: dict):
+    return create_token(data, "refresh", timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+#The /login and /token/refresh response: a new access + refresh token pair for this username.
+def issue_tokens(username: str) -> dict:
+    return {
+        "access_token": create_access_token({"sub": username}),
+        "refresh_token": create_refresh_token({"sub": username}),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+#Verifies a token's signature (with the key named by its kid), expiry and type.
+#Returns its claims; raises a 401 for anything invalid.
+def decode_token(token: str, token_type: str) -> dict:
+    try:
+        kid = jwt.get_unverified_header(token).get("kid", DEFAULT_KID)
+        key = SIGNING_KEYS.get(kid)
+        if key is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        ##Decodes the token using the key and algorithm.
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
+    #If decoding fails (expired or tampered), return an error.
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("type") != token_type or not payload.get("jti") or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+#Expiry of a token's claims as naive UTC, the way revoked_tokens stores it.
+def token_expiry(payload: dict) -> datetime:
+    return datetime.fromtimestamp(payload["exp"], timezone.utc).replace(tzinfo=None)
+
+#Revocation list
+#In-memory copy of the revoked access tokens, so checking an access token is a set lookup, not a query.
+#Revocations made by this process are added right away; those of other processes arrive with the next
+#sync (every REVOCATION_SYNC_SECONDS), which only reads rows revoked since the previous one.
+#So a token revoked elsewhere stays usable for at most that long, and never past its own (short) expiry.
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", 10))
+#Re-read a little before the last sync, in case another process's clock or commit lagged behind
+REVOCATION_SYNC_OVERLAP = timedelta(seconds=5)
+
+class RevocationList:
+    def __init__(self):
+        #jti -> token expiry; entries are dropped once the token has expired anyway
+        self.revoked = {}
+        self.synced_at = None
+        self.lock = threading.Lock()
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self.revoked
+
+    def add(self, jti: str, expires_at: datetime):
+        with self.lock:
+            self.revoked[jti] = expires_at
+
+    def clear(self):
+        with self.lock:
+            self.revoked.clear()
+            self.synced_at = None
+
+    #Pull revocations from the DB (all on the first call, then only new ones) and forget expired ones.
+    def sync(self, db: Session):
+        started = utils.utcnow()
+        since = self.synced_at - REVOCATION_SYNC_OVERLAP if self.synced_at else None
+        rows = crud.get_revoked_tokens(db, since)
+        with self.lock:
+            for row in rows:
+                self.revoked[row.jti] = row.expires_at
+            for jti in [jti for jti, expires_at in self.revoked.items() if expires_at <= started]:
+                del self.revoked[jti]
+            self.synced_at = started
+        return len(rows)
+
+    #Background loop started by main.py's lifespan: sync, purge expired rows, sleep, repeat.
+    async def run(self, session_factory=None):
+        session_factory = session_factory or database.SessionLocal
+        def sync_once():
+            db = session_factory()
+            try:
+                self.sync(db)
+                crud.purge_revoked_tokens(db)
+            finally:
+                db.close()
+        while True:
+            try:
+                await run_in_threadpool(sync_once)
+            except Exception:
+                logger.exception("revoked token sync failed")
+            await asyncio.sleep(REVOCATION_SYNC_SECONDS)
+
+revoked_tokens = RevocationList()
+
+#Revoke a token from its verified claims: in the DB for every process and, for an access token,
+#in this process's list right away. Returns False if it was already revoked.
+async def revoke(payload: dict, db) -> bool:
+    expires_at = token_expiry(payload)
+    if payload["type"] == "access":
+        revoked_tokens.add(payload["jti"], expires_at)
+    return await async_crud.revoke_token(db, payload["jti"], payload["type"], expires_at)
 
 #User authenticator
 #This function checks if a user exists and the password is correct
-def authenticate_user(username: str, password: str, db: Session = Depends(database.get_db)):
+async def authenticate_user(username: str, password: str, db: Session = Depends(database.get_db)):
     #Tries to fetch the user from the DB
-    user = crud.get_user_by_username(username, db)
+    user = await async_crud.get_user_by_username(username, db)
     #Returns error if the user doesn’t exist or the password is wrong
-    if not user or not utils.verify_password(password, user.hashed_password):
+    #bcrypt is slow on purpose, so it runs in the bounded password hashing pool (503 when saturated)
+    if not user or not await utils.verify_password_async(password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    #If valid, generates a JWT token with sub (subject) set to username
-    access_token = create_access_token(data={"sub": user.username})
-    #Returns the token to the client
-    return {"access_token": access_token, "token_type": "bearer"}
+    #If valid, returns an access + refresh token pair with sub (subject) set to username
+    return issue_tokens(user.username)
+
+#Token refresher
+#Exchanges a valid, unused refresh token for a new access + refresh token pair (rotation).
+#The refresh token is revoked in the same step; presenting it again is a 401, and of two concurrent
+#refreshes with the same token only one succeeds (revoke_token's primary key).
+async def refresh_tokens(refresh_token: str, db):
+    payload = decode_token(refresh_token, "refresh")
+    if not await revoke(payload, db):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    #The user may have been deleted since the refresh token was issued
+    if await async_crud.get_user_by_username(payload["sub"], db) is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return issue_tokens(payload["sub"])
+
+#Access token verifier (no DB query): the verified claims of the request's access token.
+async def get_token_payload(token: str = Depends(oauth2_scheme)) -> dict:
+    payload = decode_token(token, "access")
+    if payload["jti"] in revoked_tokens:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return payload
 
 #Token verifier
 #This function is used by protected routes to extract and verify the current user from the token
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    try:
-        ##Decodes the token using your secret key and algorithm.
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        #Extracts username from the token’s sub claim. If missing, it’s invalid.
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    #If decoding fails (expired or tampered), return an error.
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    user = crud.get_user_by_username(username, db)
+async def get_current_user(payload: dict = Depends(get_token_payload), db: Session = Depends(database.get_db)):
+    #Extracts username from the token’s sub claim (decode_token made sure it's there).
+    username: str = payload["sub"]
+    #Users are cached by username (cache.user_cache), so most requests never touch the users table.
+    #The session is only opened lazily by SQLAlchemy, so a cache hit costs no DB round trip at all.
+    cached = cache.user_cache.get(username)
+    if cached is not None:
+        return schemas.User(**cached)
+    user = await async_crud.get_user_by_username(username, db)
     #Makes sure the user still exists in the DB.
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    #Returns the authenticated user object to the protected route
-    return user
\ No newline at end of file
+    current_user = schemas.User(id=user.id, username=user.username)
+    cache.user_cache.set(username, current_user.model_dump())
+    #Returns the authenticated user (id and username) to the protected route
+    return current_user
@@ -0,0 +1,125 @@
+#Small caching layer shared by the app.
+#Two interchangeable backends with the same get/set/delete API:
+# -> TTLCache: in-process, bounded LRU with a time-to-live per entry. Fast, but every uvicorn worker has its own copy.
+# -> RedisCache: stores entries in a Redis-compatible server so all workers share them.
+#Values must be JSON-friendly (dicts, lists, strings, numbers) so both backends can store them.
+#CACHE_BACKEND=memory (default) or redis; REDIS_URL points at the server for the redis backend.
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+#In-process LRU cache with a TTL.
+#maxsize: at most this many entries; the least recently used one is evicted first.
+#ttl: seconds an entry stays valid.
+#hits / misses count lookups, for the metrics endpoints.
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    #Returns the cached value, or None if missing/expired.
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.data[key]
+                self.misses += 1
+                return None
+            #Mark as most recently used
+            self.data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "size": len(self.data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+#Shared cache on a Redis-compatible server.
+#client: anything with get(key), set(key, value, ex=seconds) and delete(key), e.g. redis.Redis.
+#prefix: namespaces the keys of one cache ("user:", "task:", ...).
+#Values are stored as JSON and expire on the server after ttl seconds.
+class RedisCache:
+    def __init__(self, client, prefix: str, ttl: float = 60):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self.client.get(f"{self.prefix}{key}")
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(f"{self.prefix}{key}", json.dumps(value, default=str), ex=max(1, int(self.ttl)))
+
+    def delete(self, key):
+        self.client.delete(f"{self.prefix}{key}")
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+#Creates a cache for the configured backend.
+#name: key prefix for the shared backend.
+def make_cache(name: str, maxsize: int, ttl: float):
+    if CACHE_BACKEND == "redis":
+        #redis is optional (only needed with CACHE_BACKEND=redis), so it is only imported here
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        return RedisCache(redis.Redis.from_url(REDIS_URL), prefix=f"{name}:", ttl=ttl)
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+#Authenticated users, keyed by username (the token's "sub" claim).
+#Lets auth.get_current_user skip the users table on every request.
+#Entries are {"id": ..., "username": ...} — never the password hash.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10_000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+user_cache = make_cache("user", USER_CACHE_SIZE, USER_CACHE_TTL)
+
+#Single tasks, keyed by task id: {"task": {...TaskResponse fields...}, "etag": "..."}.
+#Read through by crud.get_task_cached, invalidated by every crud function that writes tasks.
+#Keep the TTL short: it bounds how long a read that raced with a write can serve the old version.
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", 10_000))
+TASK_CACHE_TTL = float(os.getenv("TASK_CACHE_TTL", 30))
+task_cache = make_cache("task", TASK_CACHE_SIZE, TASK_CACHE_TTL)
+
+#Idempotency keys of POST /tasks/, keyed by "<owner_id>:<key>": {"request_hash": ..., "response": {...}}.
+#Front of the idempotency_keys table (crud.create_task_idempotent): a retry hitting the same process is
+#answered without a DB query. Entries never change, so they can live as long as the cache has room.
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10_000))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", 3600))
+idempotency_cache = make_cache("idempotency", IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL)
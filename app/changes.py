@@ -0,0 +1,204 @@
+#Real-time task change feed: GET /tasks/changes (Server-Sent Events) and WebSocket /tasks/changes/ws.
+#Clients follow their own task changes instead of polling GET /tasks/:
+# -> crud writes one task_changes row per created/updated/deleted task, in the same transaction as the change
+#    (crud.record_task_changes), and calls broker.notify(owner_id) after the commit.
+# -> Each open feed waits on the broker, and on a wakeup reads the user's log rows after the last seq it sent
+#    (crud.get_task_changes, one indexed query), with the tasks' current state joined in.
+#Since the feed always reads from the log, events are never lost or reordered, whatever happens to wakeups,
+#and resuming after a reconnect is the same query: "changes after seq N" (?since=N or the Last-Event-ID header).
+#The broker is per process. With several workers (CHANGES_BACKEND=postgres), crud also sends a NOTIFY
+#in the write transaction and every process LISTENs (PostgresListener), so each one wakes its own feeds.
+import asyncio
+from datetime import timedelta
+import json
+import logging
+import os
+import threading
+
+from sqlalchemy import delete, func, make_url, select
+from sqlalchemy.orm import Session, aliased
+from starlette.concurrency import run_in_threadpool
+
+from . import database, models
+from .utils import utcnow
+
+logger = logging.getLogger("app.changes")
+
+#memory: wakeups only reach feeds in the same process. postgres: also via LISTEN/NOTIFY, for multi-worker deployments.
+CHANGES_BACKEND = os.getenv("CHANGES_BACKEND", "memory")
+NOTIFY_CHANNEL = "task_changes"
+#Seconds between keep-alive comments on an idle SSE stream (stops proxies from closing it)
+CHANGES_HEARTBEAT = float(os.getenv("CHANGES_HEARTBEAT", 15))
+#Log rows read per query; a feed that is further behind catches up in several batches
+CHANGES_BATCH_SIZE = database.env_int("CHANGES_BATCH_SIZE", 500)
+#How long changes are kept, i.e. how long a client can be away and still resume
+CHANGES_RETENTION_HOURS = float(os.getenv("CHANGES_RETENTION_HOURS", 24))
+CHANGES_PURGE_INTERVAL = float(os.getenv("CHANGES_PURGE_INTERVAL", 300))
+
+#In-process fan-out: owner_id -> the open feeds of that user.
+#A subscription is just an asyncio.Event (plus the loop it belongs to): notify() sets it, the feed clears it
+#before reading the log. Several notifications before the feed gets to run collapse into one read.
+class Subscription:
+    def __init__(self, owner_id: int):
+        self.owner_id = owner_id
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+class ChangeBroker:
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, owner_id: int) -> Subscription:
+        subscription = Subscription(owner_id)
+        with self.lock:
+            self.subscribers.setdefault(owner_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.owner_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscribers.pop(subscription.owner_id, None)
+
+    #Wake the user's feeds. Safe to call from any thread (crud runs in the threadpool); a no-op without feeds.
+    def notify(self, owner_id: int):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(owner_id, ()))
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.event.set)
+
+    #Wake every feed, e.g. after the LISTEN connection was down and notifications may have been missed.
+    def notify_all(self):
+        with self.lock:
+            owner_ids = list(self.subscribers)
+        for owner_id in owner_ids:
+            self.notify(owner_id)
+
+    def count(self) -> int:
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+broker = ChangeBroker()
+
+#The events of one feed, from after seq `since` (None: only changes from now on), forever:
+# -> {"type": "ready", "seq": N} first: the position the feed starts from,
+# -> {"type": "reset", "seq": N} instead, if the changes after `since` were already purged:
+#    the client must reload its task list, then carries on from N,
+# -> {"type": "change", "seq": ..., "op": "created" | "updated" | "deleted" | "archived", "task_id": ...,
+#    "task": {...} | None} (an archived task, see crud.sweep_tasks, has left the task list like a deleted one),
+# -> None when nothing happened for `heartbeat` seconds (the SSE endpoint sends a keep-alive).
+#fetch(since, limit) and bounds() are async callables around crud.get_task_changes / crud.get_change_bounds.
+async def follow(owner_id: int, since, fetch, bounds, heartbeat: float = CHANGES_HEARTBEAT):
+    #Subscribe before reading anything, so a change committed in between still wakes us up
+    subscription = broker.subscribe(owner_id)
+    try:
+        oldest, newest = await bounds()
+        if since is None or since > newest:
+            since = newest
+            yield {"type": "ready", "seq": since}
+        elif oldest is not None and since < oldest - 1:
+            since = newest
+            yield {"type": "reset", "seq": since}
+        else:
+            yield {"type": "ready", "seq": since}
+        while True:
+            #Cleared before reading, so a notify() during the read isn't lost
+            subscription.event.clear()
+            changes = await fetch(since, CHANGES_BATCH_SIZE)
+            for change in changes:
+                yield {"type": "change", **change}
+                since = change["seq"]
+            if len(changes) == CHANGES_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(subscription.event.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+    finally:
+        broker.unsubscribe(subscription)
+
+#One Server-Sent Event. The seq goes in "id:", so a reconnecting EventSource sends it back as Last-Event-ID.
+def format_sse(event) -> str:
+    if event is None:
+        return ": keep-alive\n\n"
+    name = event["op"] if event["type"] == "change" else event["type"]
+    return f"id: {event['seq']}\nevent: {name}\ndata: {json.dumps(event, default=str)}\n\n"
+
+#Housekeeping: delete log rows older than CHANGES_RETENTION_HOURS. Each user's newest row is always kept:
+# -> it is the user's change marker (crud.get_change_marker) behind the collection ETags. Without it the marker
+#    would fall back to 0 and an old ETag from before the user's first change could match again.
+# -> the seq a feed starts from (and the "too old to resume" check) survives a quiet period.
+#The newest seq per user is one backward step on the (owner_id, seq) index.
+def purge_task_changes(db: Session):
+    change = models.TaskChange
+    newer = aliased(change)
+    cutoff = utcnow() - timedelta(hours=CHANGES_RETENTION_HOURS)
+    newest_of_owner = select(func.max(newer.seq)).where(newer.owner_id == change.owner_id).scalar_subquery()
+    result = db.execute(delete(change).where(change.created_at < cutoff, change.seq < newest_of_owner))
+    db.commit()
+    return result.rowcount
+
+#Cross-process wakeups on PostgreSQL: one LISTEN connection per process (asyncpg), turning every
+#NOTIFY task_changes, '<owner_id>' (sent by crud when the write commits) into broker.notify(owner_id).
+#Reconnects after a failure and then wakes every feed, in case notifications were missed meanwhile.
+class PostgresListener:
+    RECONNECT_DELAY = 5
+
+    def __init__(self, url: str = None):
+        self.url = url or database.DATABASE_URL
+
+    #asyncpg wants a plain postgresql:// URL, without a SQLAlchemy driver name
+    def dsn(self) -> str:
+        return make_url(self.url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+    def on_notify(self, connection, pid, channel, payload):
+        try:
+            broker.notify(int(payload))
+        except ValueError:
+            logger.warning("ignoring %s notification %r", channel, payload)
+
+    async def run(self):
+        import asyncpg
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn())
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(NOTIFY_CHANNEL, self.on_notify)
+                broker.notify_all()
+                await closed.wait()
+                logger.warning("LISTEN connection closed, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN %s failed", NOTIFY_CHANNEL)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+#Background loop started by main.py's lifespan: the PostgreSQL listener (if enabled) and the log purge.
+async def run(session_factory=None):
+    session_factory = session_factory or database.SessionLocal
+    listener = None
+    if CHANGES_BACKEND == "postgres":
+        listener = asyncio.create_task(PostgresListener().run())
+    def purge_once():
+        db = session_factory()
+        try:
+            purge_task_changes(db)
+        finally:
+            db.close()
+    try:
+        while True:
+            try:
+                await run_in_threadpool(purge_once)
+            except Exception:
+                logger.exception("task change purge failed")
+            await asyncio.sleep(CHANGES_PURGE_INTERVAL)
+    finally:
+        if listener is not None:
+            listener.cancel()
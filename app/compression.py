@@ -0,0 +1,141 @@
+#Response compression, negotiated per request from Accept-Encoding.
+#A full task list page or an export is highly repetitive JSON/CSV and shrinks 5-10x, which matters far more
+#for dashboards on slow links than the few milliseconds of CPU it costs.
+# -> br (Brotli): smaller than gzip at similar speed; used when the client accepts it and the optional
+#    'brotli' (or 'brotlicffi') package is installed.
+# -> gzip: understood by every client; the fallback.
+#Only bodies of at least COMPRESSION_MIN_SIZE bytes are compressed: below that, the headers outweigh the savings.
+#Streaming responses (GET /tasks/export) are compressed chunk by chunk; the SSE change feed is never compressed,
+#since a compressor would hold back its events.
+#A plain ASGI middleware that wraps `send`: it only uses Starlette's public Headers helpers.
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from . import database
+
+#brotli is optional: without it, clients get gzip
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+COMPRESSION_ENABLED = database.env_bool("COMPRESSION_ENABLED", True)
+COMPRESSION_MIN_SIZE = database.env_int("COMPRESSION_MIN_SIZE", 1024)
+#Moderate levels: most of the size reduction for a fraction of the CPU of the maximum levels
+GZIP_LEVEL = database.env_int("GZIP_LEVEL", 5)
+BROTLI_QUALITY = database.env_int("BROTLI_QUALITY", 4)
+
+#Which encoding to use for an Accept-Encoding header: "br", "gzip" or None (send it as is).
+#Honors q-values ("gzip;q=0" refuses gzip) and "*"; on a tie Brotli wins.
+def choose_encoding(accept_encoding: str):
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name.strip().lower()] = weight
+    available = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = None
+    for encoding in available:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best[0] if best else None
+
+#Compressors with one method: compress(data, final) -> the compressed bytes to send now.
+#Before the final chunk they flush, so every streamed chunk reaches the client right away.
+class GzipCompressor:
+    def __init__(self, level: int = GZIP_LEVEL):
+        #wbits 16 + MAX_WBITS: gzip framing (header and checksum) around the deflate stream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class BrotliCompressor:
+    def __init__(self, quality: int = BROTLI_QUALITY):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self.compressor.process(data) + (self.compressor.finish() if final else self.compressor.flush())
+
+#Never compressed: a compressor would hold back the change feed's events
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+#ASGI middleware; registered in main.py with app.add_middleware(CompressionMiddleware).
+#The response start message is held back until the first body chunk shows whether to compress:
+# -> a complete body (no more_body) is compressed if it has at least minimum_size bytes,
+# -> a streamed body is always compressed, chunk by chunk (its size isn't known up front),
+# -> responses that already have a Content-Encoding, or an excluded content type, are passed through.
+#A strong ETag is made weak (W/"...") on a compressed response: the gzip and br bodies differ byte for byte
+#from the identity one, so they must not share its strong validator (RFC 9110, 8.8.1). If-None-Match
+#uses the weak comparison (utils.etag_matches), so conditional requests keep working.
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, gzip_level: int = GZIP_LEVEL,
+                 brotli_quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if ("content-encoding" in headers or headers.get("content-type", "").startswith(EXCLUDED_CONTENT_TYPES)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                if encoding == "br":
+                    compressor = BrotliCompressor(self.brotli_quality)
+                else:
+                    compressor = GzipCompressor(self.gzip_level)
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                headers.add_vary_header("Accept-Encoding")
+                body = compressor.compress(body, final=not more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+            await send({"type": "http.response.body", "body": compressor.compress(body, final=not more_body),
+                        "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
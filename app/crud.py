@@ -1,15 +1,197 @@
 #Session: SQLAlchemy’s session object to talk to the database.
 #.models: Your database models (like Task).
 #.schemas: Your Pydantic schemas (like TaskCreate, TaskUpdate) used for validation.
+from collections import Counter
+from datetime import date, timedelta
+import hashlib
+from itertools import groupby
+import json
+import os
+import re
+from sqlalchemy import bindparam, column, delete, func, insert, literal, literal_column, or_, select, table, tuple_, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import Session
-from . import models, schemas, utils, database
+from . import models, schemas, utils, database, cache, changes, jobs
 from fastapi import Depends, HTTPException
 
-#Return a list of all tasks.
-#db.query(models.Task): Ask the DB for all Task entries.
-#.all(): Convert the query into a list of actual results.
-def get_tasks(db: Session):
-    return db.query(models.Task).all()
+#Page size limits for list endpoints.
+#Every page is bounded so a single request can never load the whole table.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+#Fields returned for a task (schemas.TaskResponse).
+TASK_FIELDS = ("id", "title", "description", "due_date", "status", "version")
+
+#Sort keys a task list can be ordered by. id is always added as a tie-breaker so the order is stable.
+TASK_SORT_KEYS = {"id": ("id",), "due_date": ("due_date", "id")}
+
+#Tasks that haven't been deleted (soft delete, see models.Task.deleted_at). Every query on the tasks table
+#includes it: deleted rows stay in the table until crud.sweep_tasks removes them, and the per-user
+#indexes are partial indexes that only the queries with this condition can use.
+ACTIVE = models.Task.deleted_at.is_(None)
+
+#Builds the filtered (but not yet ordered/paginated) task query.
+#owner_id: only tasks of this user. Always applied, and the leading column of every task index,
+#so each query only ever touches one user's rows.
+#status: exact match, e.g. "pending".
+#due_from / due_to: inclusive due_date range.
+#title_prefix: "Learn" matches "Learn SQLAlchemy" (LIKE 'Learn%', so the title index can be used).
+#source: models.Task (active tasks only) or models.ArchivedTask.
+def filter_tasks(query, owner_id, status=None, due_from=None, due_to=None, title_prefix=None, source=models.Task):
+    query = query.filter(source.owner_id == owner_id)
+    if source is models.Task:
+        query = query.filter(ACTIVE)
+    if status is not None:
+        query = query.filter(source.status == status)
+    if due_from is not None:
+        query = query.filter(source.due_date >= due_from)
+    if due_to is not None:
+        query = query.filter(source.due_date <= due_to)
+    if title_prefix:
+        #autoescape=True makes "%" and "_" in the prefix match literally
+        query = query.filter(source.title.startswith(title_prefix, autoescape=True))
+    return query
+
+#Return one page of the user's tasks using keyset (cursor) pagination.
+#Instead of OFFSET (which makes the DB walk over every skipped row), we remember the sort key of
+#the last row we returned and ask for rows "after" it:
+#   WHERE owner_id = 7 AND (due_date, id) > ('2025-05-17', 42) ORDER BY due_date, id LIMIT 51
+#With the composite indexes on models.Task this is an index range scan, so page 1000 costs the same as page 1.
+#We fetch limit + 1 rows: if the extra row exists there is a next page.
+#Only the response columns are selected, as plain rows: no ORM objects or identity map for a page that is
+#serialized and thrown away.
+#include_archived: also list archived tasks (models.ArchivedTask), each row with an "archived" flag.
+#The same page query runs on both tables (each one an index range scan of at most limit + 1 rows),
+#and the two results are merged by the sort key.
+#Returns (tasks as dicts, next_cursor). next_cursor is None on the last page.
+#Raises ValueError for a cursor that doesn't belong to this sort order.
+def get_tasks(db: Session, owner_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None, sort: str = "id",
+              order: str = "asc", status: str = None, due_from: date = None, due_to: date = None,
+              title_prefix: str = None, include_archived: bool = False):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    descending = order == "desc"
+    #Sort key: (due_date, id) or just (id,)
+    key_names = TASK_SORT_KEYS[sort]
+    last_key = None
+    if cursor:
+        data = utils.decode_cursor(cursor)
+        if not isinstance(data.get("k"), list):
+            raise ValueError("Invalid cursor")
+        if data.get("s") != sort or data.get("o") != order or len(data["k"]) != len(key_names):
+            raise ValueError("Cursor does not match the requested sort order")
+        try:
+            last_key = [int(data["k"][-1])]
+            if sort == "due_date":
+                last_key.insert(0, date.fromisoformat(data["k"][0]))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+
+    #The page query over one table (or the merged subquery)
+    def page(source, query):
+        key_columns = [getattr(source, name) for name in key_names]
+        if last_key is not None:
+            #Row-value comparison: (due_date, id) > (:due_date, :id)
+            position = tuple_(*key_columns) if len(key_columns) > 1 else key_columns[0]
+            last = tuple_(*last_key) if len(key_columns) > 1 else last_key[0]
+            query = query.filter(position < last if descending else position > last)
+        return query.order_by(*[c.desc() if descending else c.asc() for c in key_columns]).limit(limit + 1)
+
+    filters = (owner_id, status, due_from, due_to, title_prefix)
+    def table_page(source):
+        #"archived" is selected too, so the rows are complete responses even when sent without validation (FAST_JSON)
+        columns = [getattr(source, field) for field in TASK_FIELDS]
+        archived = literal(source is models.ArchivedTask, literal_execute=True).label("archived")
+        return page(source, filter_tasks(select(*columns, archived), *filters, source=source))
+
+    if include_archived:
+        parts = [table_page(models.Task).subquery(), table_page(models.ArchivedTask).subquery()]
+        merged = union_all(*[select(*part.c) for part in parts]).subquery("all_tasks")
+        query = page(merged.c, select(*merged.c))
+    else:
+        query = table_page(models.Task)
+    tasks = db.execute(query).all()
+
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        last_task = tasks[-1]
+        next_cursor = utils.encode_cursor({
+            "s": sort,
+            "o": order,
+            "k": [getattr(last_task, name) for name in key_names],
+        })
+    return [task._asdict() for task in tasks], next_cursor
+
+#Columns included in task exports, in output order.
+EXPORT_COLUMNS = ("id", "title", "description", "due_date", "status")
+
+#The SELECT used by exports: the user's tasks as plain columns, filtered, in id order.
+#select(...) of columns: rows are lightweight tuples, no identity map, no Pydantic.
+def export_statement(owner_id: int, status: str = None, due_from: date = None, due_to: date = None,
+                     title_prefix: str = None):
+    columns = [getattr(models.Task, name) for name in EXPORT_COLUMNS]
+    return filter_tasks(select(*columns), owner_id, status, due_from, due_to, title_prefix).order_by(models.Task.id)
+
+#Stream every (filtered) task as plain tuples, without building ORM objects or a full list.
+#yield_per: fetch batch_size rows at a time. On PostgreSQL this also turns on a server-side
+#cursor (stream_results), so memory stays flat no matter how many rows the table has.
+def stream_tasks(db: Session, owner_id: int, batch_size: int = 1000, **filters):
+    result = db.execute(export_statement(owner_id, **filters), execution_options={"yield_per": batch_size})
+    #partitions() hands rows over one batch at a time
+    for batch in result.partitions():
+        yield batch
+
+#Full-text search
+#Turns free text into an FTS5 query: every word must match, each one quoted so that
+#characters like - * " : ( ) are taken literally instead of as FTS5 syntax.
+def fts5_query(text: str) -> str:
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", text))
+
+#Search the user's tasks by keyword in title and description, best matches first.
+#Uses the text index created with the tasks table (models.TASK_SEARCH_DDL):
+# -> PostgreSQL: search_vector @@ websearch_to_tsquery(q), ranked with ts_rank (title matches weigh more).
+#    websearch_to_tsquery understands "quoted phrases", OR and -excluded words.
+# -> SQLite: FTS5 MATCH, ranked with bm25.
+# -> anything else: a plain LIKE scan, unranked.
+#Pagination is limit/offset over the ranked results; we fetch limit + 1 rows to know if there's a next page.
+#Returns (list of task dicts with a "score", next_offset or None).
+def search_tasks(db: Session, owner_id: int, q: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    columns = [getattr(models.Task, field) for field in TASK_FIELDS] + [literal(False, literal_execute=True).label("archived")]
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        search_vector = literal_column("tasks.search_vector")
+        tsquery = func.websearch_to_tsquery("english", q)
+        score = func.ts_rank(search_vector, tsquery)
+        stmt = select(*columns, score.label("score")).where(search_vector.op("@@")(tsquery)).order_by(score.desc(), models.Task.id)
+    elif dialect == "sqlite":
+        match = fts5_query(q)
+        if not match:
+            return [], None
+        fts = table("tasks_fts", column("rowid"))
+        #bm25() is "lower is better", so negate it for a score where higher is better
+        score = -func.bm25(literal_column("tasks_fts"))
+        stmt = (
+            select(*columns, score.label("score"))
+            .join(fts, fts.c.rowid == models.Task.id)
+            .where(literal_column("tasks_fts").op("MATCH")(match))
+            .order_by(score.desc(), models.Task.id)
+        )
+    else:
+        pattern = f"%{q}%"
+        stmt = (
+            select(*columns, literal_column("0.0").label("score"))
+            .where(or_(models.Task.title.ilike(pattern), models.Task.description.ilike(pattern)))
+            .order_by(models.Task.id)
+        )
+    stmt = stmt.where(models.Task.owner_id == owner_id, ACTIVE).limit(limit + 1).offset(offset)
+    rows = [dict(row._mapping) for row in db.execute(stmt)]
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    return rows, next_offset
 
 # Fetch one task by ID.
 #.filter(...): Add condition (where id == task_id).
@@ -20,20 +202,179 @@ def get_tasks(db: Session):
 #If task_id = 3, this line:
 #db.query(models.Task).filter(models.Task.id == 3).first()
 #will fetch the task with ID 3 from the tasks table.
+#owner_id: tasks of other users are treated as not found.
+#for_update: lock the row (SELECT ... FOR UPDATE) until commit, for read-modify-write updates.
+
+def get_task(db: Session, task_id: int, owner_id: int, for_update: bool = False):
+    query = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == owner_id, ACTIVE)
+    if for_update:
+        query = query.with_for_update()
+    return query.first()
+
+#One archived task of the user (GET /tasks/{id}?include_archived=true) as a dict with "archived": True, or None.
+def get_archived_task(db: Session, task_id: int, owner_id: int):
+    columns = [getattr(models.ArchivedTask, field) for field in TASK_FIELDS]
+    row = db.execute(
+        select(*columns).where(models.ArchivedTask.id == task_id, models.ArchivedTask.owner_id == owner_id)
+    ).first()
+    return {**row._mapping, "archived": True} if row else None
+
+#Plain dict of a task's response fields.
+def task_to_dict(task) -> dict:
+    return {field: getattr(task, field) for field in TASK_FIELDS}
+
+#Strong ETag for a task: a hash of its response fields, so it changes whenever the task does.
+def task_etag(data: dict) -> str:
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest[:20]}"'
 
-def get_task(db: Session, task_id: int):
-    return db.query(models.Task).filter(models.Task.id == task_id).first()
+#Read-through cache around get_task.
+#Returns {"task": {...}, "etag": "...", "owner_id": ...} or None if the user has no such task.
+#Hot tasks are served from cache.task_cache without touching the DB; writes invalidate the entry.
+def get_task_cached(db: Session, task_id: int, owner_id: int):
+    entry = cache.task_cache.get(task_id)
+    if entry is not None:
+        return entry if entry["owner_id"] == owner_id else None
+    return load_task_entry(db, task_id, owner_id)
+
+#The miss path of get_task_cached: read the task from the DB and put it in the cache.
+#Doesn't look in the cache itself, so a miss is only counted once (async_crud checks the cache first).
+def load_task_entry(db: Session, task_id: int, owner_id: int):
+    db_task = get_task(db, task_id, owner_id)
+    if db_task is None:
+        return None
+    data = task_to_dict(db_task)
+    entry = {"task": data, "etag": task_etag(data), "owner_id": owner_id}
+    cache.task_cache.set(task_id, entry)
+    return entry
+
+#Drop cached copies of tasks that were just changed or deleted.
+#Called after commit, so the next read goes to the DB and sees the new state.
+def invalidate_tasks(task_ids):
+    for task_id in task_ids:
+        cache.task_cache.delete(task_id)
+
+#Task statistics (GET /tasks/stats)
+#Counts live in the task_stats summary table (models.TaskStat), one row per (owner, status, due_date).
+#Every function below that writes tasks also adds its +1/-1 changes to that table in the same transaction,
+#so the stats are always consistent with the tasks and reading them never scans the tasks table.
+#Tasks with this status are finished; any other status counts as open (and can be overdue).
+DONE_STATUS = "done"
+#Stand-ins for NULL in task_stats' primary key.
+NO_STATUS = ""
+NO_DUE_DATE = date.min
+
+#The task_stats key of a task with this status and due date.
+def stats_key(status, due_date):
+    return (NO_STATUS if status is None else status, NO_DUE_DATE if due_date is None else due_date)
+
+#Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+#Add counter changes to task_stats for one user. Doesn't commit: the caller commits them together with its write.
+#deltas: {stats_key(...): change}, e.g. {("pending", date(2025, 5, 1)): -1, ("done", date(2025, 5, 1)): 1}.
+#One upsert for all keys (... ON CONFLICT DO UPDATE SET count = task_stats.count + excluded.count):
+#the increment happens in the DB, so concurrent writers never overwrite each other's counts.
+#Keys are sorted so concurrent transactions lock the summary rows in the same order (no deadlocks).
+def apply_stats_deltas(db: Session, owner_id: int, deltas: dict):
+    rows = [
+        {"owner_id": owner_id, "status": status, "due_date": due_date, "count": change}
+        for (status, due_date), change in sorted(deltas.items())
+        if change
+    ]
+    if not rows:
+        return
+    stats = models.TaskStat.__table__
+    make_insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if make_insert is not None:
+        stmt = make_insert(stats)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[stats.c.owner_id, stats.c.status, stats.c.due_date],
+            set_={"count": stats.c.count + stmt.excluded["count"]},
+        )
+        db.execute(stmt, rows)
+        return
+    #Other dialects: update the row, insert it if it wasn't there yet
+    for row in rows:
+        result = db.execute(
+            update(stats)
+            .where(stats.c.owner_id == owner_id, stats.c.status == row["status"], stats.c.due_date == row["due_date"])
+            .values(count=stats.c.count + row["count"])
+        )
+        if result.rowcount == 0:
+            db.execute(insert(stats).values(**row))
+
+#Recompute task_stats from the tasks (one GROUP BY scan), for all users or only owner_id.
+#Active and archived tasks are counted; deleted ones aren't.
+#Only needed to fill the table for tasks written before it existed, or to repair it after manual SQL changes.
+def rebuild_task_stats(db: Session, owner_id: int = None):
+    stats = models.TaskStat.__table__
+    parts = [
+        select(source.owner_id, source.status, source.due_date).where(source.owner_id.is_not(None))
+        for source in (models.Task, models.ArchivedTask)
+    ]
+    parts[0] = parts[0].where(ACTIVE)
+    clear = delete(stats)
+    if owner_id is not None:
+        parts = [part.where(part.selected_columns.owner_id == owner_id) for part in parts]
+        clear = clear.where(stats.c.owner_id == owner_id)
+    tasks = union_all(*parts).subquery()
+    status = func.coalesce(tasks.c.status, NO_STATUS)
+    due_date = func.coalesce(tasks.c.due_date, NO_DUE_DATE)
+    counts = select(tasks.c.owner_id, status, due_date, func.count()).group_by(tasks.c.owner_id, status, due_date)
+    db.execute(clear)
+    db.execute(insert(stats).from_select(["owner_id", "status", "due_date", "count"], counts))
+    db.commit()
+
+#Task statistics of one user, computed from their task_stats rows only:
+#cost depends on the number of distinct (status, due_date) pairs, not on the number of tasks.
+#today: reference date for "overdue" (defaults to date.today()).
+#Returns a dict matching schemas.TaskStats.
+def get_task_stats(db: Session, owner_id: int, today: date = None):
+    today = today or date.today()
+    week_end = today + timedelta(days=7)
+    rows = db.execute(
+        select(models.TaskStat.status, models.TaskStat.due_date, models.TaskStat.count)
+        .where(models.TaskStat.owner_id == owner_id, models.TaskStat.count != 0)
+    )
+    by_status, by_due_month = Counter(), Counter()
+    due = dict.fromkeys(("overdue", "today", "next_7_days", "later", "no_due_date"), 0)
+    total = 0
+    for status, due_date, count in rows:
+        total += count
+        by_status[status] += count
+        if due_date != NO_DUE_DATE:
+            by_due_month[due_date.strftime("%Y-%m")] += count
+        if status == DONE_STATUS:
+            continue
+        if due_date == NO_DUE_DATE:
+            due["no_due_date"] += count
+        elif due_date < today:
+            due["overdue"] += count
+        elif due_date == today:
+            due["today"] += count
+        elif due_date <= week_end:
+            due["next_7_days"] += count
+        else:
+            due["later"] += count
+    return {
+        "total": total,
+        "by_status": dict(by_status),
+        "overdue": due["overdue"],
+        "due": due,
+        "by_due_month": dict(sorted(by_due_month.items())),
+    }
 
 #Create a new task in the database.
-#task.dict(): Converts the Pydantic object into a dictionary.
+#task.model_dump(): Converts the Pydantic object into a dictionary.
 #Why do we do this conversion?
 #Pydantic models are not plain dicts:
 #They are special classes with extra validation, parsing, and type-checking features.
 #SQLAlchemy models expect keyword arguments:
 #When you create a SQLAlchemy model instance like models.Task(...), it expects its fields as regular Python keyword arguments or a dictionary unpacked into keyword arguments.
-#task.dict() gives you a clean dictionary of field names and values:
-#So **task.dict() unpacks that dictionary into named arguments for the SQLAlchemy model constructor.
-#**task.dict(): Unpacks it into models.Task(...).
+#task.model_dump() gives you a clean dictionary of field names and values:
+#So **task.model_dump() unpacks that dictionary into named arguments for the SQLAlchemy model constructor.
+#**task.model_dump(): Unpacks it into models.Task(...).
 
 # Say task has this data:
 #task.title = "Learn SQLAlchemy"
@@ -41,7 +382,7 @@ def get_task(db: Session, task_id: int):
 #task.due_date = date(2025, 5, 17)
 #task.status = "pending"
 
-#task.dict() returns:
+#task.model_dump() returns:
 #{
 #  "title": "Learn SQLAlchemy",
 #  "description": "Understand how to integrate Pydantic with SQLAlchemy",
@@ -49,7 +390,7 @@ def get_task(db: Session, task_id: int):
 #  "status": "pending"
 #}
 #Then:
-#models.Task(**task.dict())
+#models.Task(**task.model_dump())
 
 #Is equivalent to:
 #models.Task(
@@ -60,58 +401,518 @@ def get_task(db: Session, task_id: int):
 #)
 
 
+#Task change log (the real-time feed, see app/changes.py)
+#Every function below that writes tasks also calls record_task_changes() before its commit, and
+#changes.broker.notify(owner_id) after it, so open feeds pick the change up right away.
+#op: "created", "updated" or "deleted"; one row per task id.
+def record_task_changes(db: Session, owner_id: int, op: str, task_ids):
+    rows = [{"owner_id": owner_id, "task_id": task_id, "op": op, "created_at": utils.utcnow()} for task_id in task_ids]
+    if not rows:
+        return
+    db.execute(insert(models.TaskChange), rows)
+    #Other processes' feeds hear about it through LISTEN/NOTIFY; PostgreSQL delivers it only if we commit
+    if changes.CHANGES_BACKEND == "postgres" and db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_notify(changes.NOTIFY_CHANNEL, str(owner_id))))
+
+#A user's changes after seq `since`, oldest first, with each task's current state (None once it's deleted or archived).
+#Ends the read transaction (commit), so the feed doesn't hold a pooled connection while it waits for the next change.
+def get_task_changes(db: Session, owner_id: int, since: int, limit: int = changes.CHANGES_BATCH_SIZE):
+    change = models.TaskChange
+    task_columns = [getattr(models.Task, field).label(f"current_{field}") for field in TASK_FIELDS]
+    rows = db.execute(
+        select(change.seq, change.op, change.task_id, *task_columns)
+        .outerjoin(models.Task, (models.Task.id == change.task_id) & ACTIVE)
+        .where(change.owner_id == owner_id, change.seq > since)
+        .order_by(change.seq)
+        .limit(limit)
+    ).all()
+    db.commit()
+    return [
+        {
+            "seq": row.seq, "op": row.op, "task_id": row.task_id,
+            "task": {field: getattr(row, f"current_{field}") for field in TASK_FIELDS} if row.current_id is not None else None,
+        }
+        for row in rows
+    ]
+
+#Change marker of a user's tasks, for collection ETags (GET /tasks/, /tasks/stats, /tasks/export):
+#(seq, created_at) of the user's newest change-log row, or (0, None) if there is none.
+#Every task write adds a row with a higher seq, so an unchanged marker means unchanged tasks.
+#One backward step on the (owner_id, seq) index: no task is read.
+def get_change_marker(db: Session, owner_id: int):
+    row = db.execute(
+        select(models.TaskChange.seq, models.TaskChange.created_at)
+        .where(models.TaskChange.owner_id == owner_id)
+        .order_by(models.TaskChange.seq.desc())
+        .limit(1)
+    ).first()
+    return (row.seq, row.created_at) if row else (0, None)
+
+#(oldest, newest) seq still in the change log; newest is 0 for an empty log.
+def get_change_bounds(db: Session):
+    oldest, newest = db.execute(select(func.min(models.TaskChange.seq), func.max(models.TaskChange.seq))).one()
+    db.commit()
+    return oldest, newest or 0
+
 #db.add(): Adds the task to the session.
 #db.commit(): Saves the changes to the DB.
 #db.refresh(): Updates the object with its final DB state (like the auto-generated id).
 #return db_task: Return the created task.
-def create_task(db: Session, task: schemas.TaskCreate):
-    db_task = models.Task(**task.dict())
-    db.add(db_task)
+#owner_id: the task belongs to this user.
+#The "created" notification is only queued here (saved in the same commit); the job worker sends it later.
+def create_task(db: Session, task: schemas.TaskCreate, owner_id: int):
+    db_task = add_task(db, task, owner_id)
     db.commit()
+    jobs.worker.wake()
+    changes.broker.notify(owner_id)
     db.refresh(db_task)
     return db_task
 
+#Everything create_task writes, without the commit: the task, its task_stats count, the notification job
+#and the change-log row. The caller commits (and then wakes the job worker and the change feed).
+def add_task(db: Session, task: schemas.TaskCreate, owner_id: int):
+    db_task = models.Task(**task.model_dump(), owner_id=owner_id)
+    db.add(db_task)
+    apply_stats_deltas(db, owner_id, {stats_key(db_task.status, db_task.due_date): 1})
+    #flush() sends the INSERT now so the notification job knows the new id
+    db.flush()
+    enqueue_task_notification(db, db_task.id, owner_id, "created")
+    record_task_changes(db, owner_id, "created", [db_task.id])
+    return db_task
+
+#Idempotent task creation (POST /tasks/ with an Idempotency-Key header)
+#Clients retry a create that timed out with the same key; only the first request creates the task:
+# -> A key seen before (cache.idempotency_cache, else the idempotency_keys table) returns the stored response,
+#    without touching the tasks table.
+# -> Otherwise the key row is inserted first (in a savepoint), then the task, and the task's response is saved
+#    on the key row in the same commit. Two concurrent requests with one key can't both insert the key row
+#    (primary key): the loser waits for the winner's commit, gets an IntegrityError, and replays the winner's response.
+#Keys expire after IDEMPOTENCY_TTL_HOURS; an expired key can be used again.
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+
+#Raised when a key comes back with a different request body: it can't be a retry of the same create.
+class IdempotencyKeyReused(Exception):
+    pass
+
+#Fingerprint of a create request, stored with its key.
+def idempotency_hash(task: schemas.TaskCreate) -> str:
+    return hashlib.sha256(json.dumps(task.model_dump(), sort_keys=True, default=str).encode()).hexdigest()
+
+#The stored response for a key, checking it was made for the same request. Raises IdempotencyKeyReused otherwise.
+def replay_idempotent(entry: dict, request_hash: str) -> dict:
+    if entry["request_hash"] != request_hash:
+        raise IdempotencyKeyReused()
+    return entry["response"]
+
+#The unexpired key row of this user as {"request_hash": ..., "response": ...}, or None.
+def get_idempotency_key(db: Session, owner_id: int, key: str):
+    row = db.execute(
+        select(models.IdempotencyKey.request_hash, models.IdempotencyKey.response)
+        .where(models.IdempotencyKey.owner_id == owner_id, models.IdempotencyKey.key == key,
+               models.IdempotencyKey.expires_at > utils.utcnow())
+    ).first()
+    return {"request_hash": row.request_hash, "response": row.response} if row else None
+
+#Returns (task response dict, replayed), where replayed is True if the task was created by an earlier request.
+def create_task_idempotent(db: Session, task: schemas.TaskCreate, owner_id: int, key: str):
+    request_hash = idempotency_hash(task)
+    cache_key = f"{owner_id}:{key}"
+    entry = get_idempotency_key(db, owner_id, key)
+    if entry is None:
+        now = utils.utcnow()
+        try:
+            with db.begin_nested():
+                #An expired row would still hold the primary key
+                db.execute(delete(models.IdempotencyKey).where(
+                    models.IdempotencyKey.owner_id == owner_id, models.IdempotencyKey.key == key,
+                    models.IdempotencyKey.expires_at <= now,
+                ))
+                record = models.IdempotencyKey(
+                    owner_id=owner_id, key=key, request_hash=request_hash, created_at=now,
+                    expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+                )
+                db.add(record)
+        except IntegrityError:
+            #A concurrent request with the same key got there first and has committed by now
+            entry = get_idempotency_key(db, owner_id, key)
+            if entry is None:
+                raise
+    if entry is not None:
+        cache.idempotency_cache.set(cache_key, entry)
+        return replay_idempotent(entry, request_hash), True
+    db_task = add_task(db, task, owner_id)
+    #Stored as JSON, so dates become strings (what the client received anyway)
+    record.response = json.loads(json.dumps(task_to_dict(db_task), default=str))
+    db.commit()
+    jobs.worker.wake()
+    changes.broker.notify(owner_id)
+    cache.idempotency_cache.set(cache_key, {"request_hash": request_hash, "response": record.response})
+    return record.response, False
+
+#Housekeeping (run by the job worker's scheduler pass): delete expired keys.
+@jobs.housekeeping
+def purge_idempotency_keys(db: Session):
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= utils.utcnow()))
+    db.commit()
+
+#Queue a notification about a task (see jobs.notify_task_change), inside the caller's transaction.
+#event: what happened, e.g. "created" or "status changed to done".
+def enqueue_task_notification(db: Session, task_id: int, owner_id: int, event: str):
+    jobs.enqueue(db, "task_notification", {"task_id": task_id, "owner_id": owner_id, "event": event})
+
+#The same for many tasks of one user (bulk writes). events: [(task_id, event), ...].
+def enqueue_task_notifications(db: Session, owner_id: int, events):
+    jobs.enqueue_many(db, "task_notification", [
+        {"task_id": task_id, "owner_id": owner_id, "event": event} for task_id, event in events
+    ])
+
 #Update a task’s fields if it exists.
 
 #get_task(...): Find the task first.
-#task.dict().items(): Loop over all fields provided in the update.
+#task.model_dump().items(): Loop over all fields provided in the update.
 #setattr(...): Update each field dynamically.
+#version: bumped in SQL (version = version + 1) so concurrent PATCHes can detect the change.
+#The row is locked while we read it, so the task_stats change (old status/due date -1, new +1) is exact.
 #db.commit(): Save the updates.
 #db.refresh(): Refresh from DB.
 #Return updated task, or None if not found.
-def update_task(db: Session, task_id: int, task: schemas.TaskUpdate):
-    db_task = get_task(db, task_id)
+def update_task(db: Session, task_id: int, task: schemas.TaskUpdate, owner_id: int):
+    db_task = get_task(db, task_id, owner_id, for_update=True)
     if db_task:
-        for key, value in task.dict().items():
+        old_status = db_task.status
+        deltas = Counter({stats_key(db_task.status, db_task.due_date): -1})
+        for key, value in task.model_dump().items():
             setattr(db_task, key, value)
+        db_task.version = models.Task.version + 1
+        deltas[stats_key(db_task.status, db_task.due_date)] += 1
+        apply_stats_deltas(db, owner_id, deltas)
+        if db_task.status != old_status:
+            enqueue_task_notification(db, task_id, owner_id, f"status changed to {db_task.status}")
+        record_task_changes(db, owner_id, "updated", [task_id])
         db.commit()
+        jobs.worker.wake()
+        changes.broker.notify(owner_id)
+        invalidate_tasks([task_id])
         db.refresh(db_task)
     return db_task
 
+#Raised by patch_task when the task's version is not the one the client last saw.
+class VersionConflict(Exception):
+    pass
+
+#Partially update a task in a single round trip.
+#Only the fields the client actually sent are written (exclude_unset), in one
+#   UPDATE tasks SET status = 'done', version = version + 1 WHERE id = 3 [AND version = 7] RETURNING ...
+#No SELECT before, no refresh() after: RETURNING hands back the updated row.
+#patch.version (optional): optimistic concurrency. The update only applies if the task is still at that
+#version; otherwise VersionConflict is raised (someone else changed it in the meantime).
+#Changing status or due_date also moves the task in task_stats; only then the old values are read first
+#(SELECT ... FOR UPDATE, so nobody changes them before our UPDATE).
+#Returns the updated task as a dict, or None if not found.
+def patch_task(db: Session, task_id: int, patch: schemas.TaskPatch, owner_id: int):
+    values = patch.model_dump(exclude_unset=True)
+    expected_version = values.pop("version", None)
+    conditions = [models.Task.id == task_id, models.Task.owner_id == owner_id, ACTIVE]
+    if expected_version is not None:
+        conditions.append(models.Task.version == expected_version)
+    columns = [getattr(models.Task, field) for field in TASK_FIELDS]
+    if not values:
+        #Nothing to change: just report the current state (still checking the version)
+        row = db.execute(select(*columns).where(*conditions)).first()
+    else:
+        old = None
+        if "status" in values or "due_date" in values:
+            old = db.execute(select(models.Task.status, models.Task.due_date).where(*conditions).with_for_update()).first()
+        stmt = update(models.Task).where(*conditions).values(**values, version=models.Task.version + 1)
+        row = db.execute(stmt.returning(*columns)).first()
+        if row is not None and old is not None:
+            deltas = Counter({stats_key(old.status, old.due_date): -1})
+            deltas[stats_key(row.status, row.due_date)] += 1
+            apply_stats_deltas(db, owner_id, deltas)
+            if row.status != old.status:
+                enqueue_task_notification(db, task_id, owner_id, f"status changed to {row.status}")
+        if row is not None:
+            record_task_changes(db, owner_id, "updated", [task_id])
+        db.commit()
+        jobs.worker.wake()
+        if row is not None:
+            changes.broker.notify(owner_id)
+    if row is None:
+        #Only on the failure path: find out whether the task is missing or just changed
+        if expected_version is not None and get_task(db, task_id, owner_id) is not None:
+            raise VersionConflict()
+        return None
+    invalidate_tasks([task_id])
+    return dict(row._mapping)
+
 #Delete a task if it exists.
 #get_task(...): Find it first.
-#db.delete(...): Mark for deletion.
+#deleted_at: soft delete. The task disappears from every query right away, but the row is only removed
+#by the next sweep (sweep_tasks), in a batch, off the request path.
 #db.commit(): Apply changes.
 #Return the deleted task (or None if not found).
-def delete_task(db: Session, task_id: int):
-    db_task = get_task(db, task_id)
+def delete_task(db: Session, task_id: int, owner_id: int):
+    db_task = get_task(db, task_id, owner_id, for_update=True)
     if db_task:
-        db.delete(db_task)
+        apply_stats_deltas(db, owner_id, {stats_key(db_task.status, db_task.due_date): -1})
+        db_task.deleted_at = utils.utcnow()
+        record_task_changes(db, owner_id, "deleted", [task_id])
         db.commit()
+        changes.broker.notify(owner_id)
+        invalidate_tasks([task_id])
+        db.refresh(db_task)
     return db_task
 
+#Bulk operations
+#Instead of one INSERT/UPDATE/DELETE + commit (+ refresh SELECT) per task, rows are sent in chunks:
+#each chunk is a single executemany statement inside a single transaction.
+#If a chunk fails in the DB, only that chunk is rolled back and its items are reported as errors.
+BULK_CHUNK_SIZE = 500
+
+#Short, client-safe description of a DB error (the driver message, without the SQL statement).
+def db_error_detail(exc: SQLAlchemyError) -> str:
+    return str(getattr(exc, "orig", None) or exc)
+
+#Split a list into lists of at most size items.
+def chunked(items: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+#Create many tasks for one user.
+#items: list of (index in the request, schemas.TaskCreate).
+#insert(...).returning(id): one multi-row INSERT per chunk that also hands back the new ids,
+#so there is no refresh() round trip per row.
+#Like create_task, every new task gets a "created" notification job (one multi-row INSERT per chunk too).
+#Returns (created ids, errors) where errors is a list of schemas.BulkItemError.
+def bulk_create_tasks(db: Session, items: list, owner_id: int):
+    ids, errors = [], []
+    stmt = insert(models.Task).returning(models.Task.id, sort_by_parameter_order=True)
+    for chunk in chunked(items):
+        try:
+            new_ids = db.scalars(stmt, [{**task.model_dump(), "owner_id": owner_id} for _, task in chunk]).all()
+            apply_stats_deltas(db, owner_id, Counter(stats_key(task.status, task.due_date) for _, task in chunk))
+            enqueue_task_notifications(db, owner_id, [(task_id, "created") for task_id in new_ids])
+            record_task_changes(db, owner_id, "created", new_ids)
+            db.commit()
+            jobs.worker.wake()
+            changes.broker.notify(owner_id)
+        except SQLAlchemyError as exc:
+            db.rollback()
+            errors.extend(schemas.BulkItemError(index=index, detail=db_error_detail(exc)) for index, _ in chunk)
+            continue
+        ids.extend(new_ids)
+    return ids, errors
+
+#Update many of one user's tasks.
+#items: list of (index in the request, schemas.TaskBulkUpdate). Only the fields present in each item are written;
+#an item with nothing but an id is reported as updated without touching the row.
+#Ids of other users' tasks are reported as not found.
+#One SELECT per chunk finds which ids exist (and locks them, with their current status/due date for task_stats),
+#then executemany UPDATE ... WHERE id = ? statements write them, in request order.
+#Like update_task, a task whose status changes gets a "status changed to ..." notification job.
+#Returns (updated ids, errors).
+def bulk_update_tasks(db: Session, items: list, owner_id: int):
+    ids, errors = [], []
+    for chunk in chunked(items):
+        wanted = {task.id for _, task in chunk}
+        existing = {
+            row.id: stats_key(row.status, row.due_date)
+            for row in db.execute(
+                select(models.Task.id, models.Task.status, models.Task.due_date)
+                .where(models.Task.owner_id == owner_id, models.Task.id.in_(wanted), ACTIVE)
+                .with_for_update()
+            )
+        }
+        rows = []
+        deltas = Counter()
+        notifications = []
+        for index, task in chunk:
+            if task.id not in existing:
+                errors.append(schemas.BulkItemError(index=index, id=task.id, detail="Task not found"))
+                continue
+            values = task.model_dump(exclude_unset=True)
+            if values.keys() == {"id"}:
+                #Nothing to change: no UPDATE, so no new version, change log entry or cache invalidation
+                ids.append(task.id)
+                continue
+            rows.append((index, values))
+            if "status" in values or "due_date" in values:
+                #existing[] tracks the latest state, in case the same id appears twice in the request
+                old_status, old_due_date = existing[task.id]
+                new_key = stats_key(values.get("status", old_status), values.get("due_date", old_due_date))
+                deltas[existing[task.id]] -= 1
+                deltas[new_key] += 1
+                existing[task.id] = new_key
+                if "status" in values and values["status"] != old_status:
+                    notifications.append((task.id, f"status changed to {values['status']}"))
+        if not rows:
+            continue
+        try:
+            #Consecutive items that set the same fields share one executemany UPDATE.
+            #Only consecutive ones: the UPDATEs run in request order, so when an id appears more than once
+            #the last item wins, the same as the task_stats deltas above assume.
+            for fields, group in groupby((values for _, values in rows), key=lambda values: tuple(sorted(values))):
+                stmt = (
+                    update(models.Task.__table__)
+                    .where(models.Task.id == bindparam("b_id"), models.Task.owner_id == owner_id, ACTIVE)
+                    .values({field: bindparam(f"b_{field}") for field in fields if field != "id"})
+                    .values(version=models.Task.version + 1)
+                )
+                db.execute(stmt, [{f"b_{field}": value for field, value in values.items()} for values in group])
+            apply_stats_deltas(db, owner_id, deltas)
+            enqueue_task_notifications(db, owner_id, notifications)
+            record_task_changes(db, owner_id, "updated", [values["id"] for _, values in rows])
+            db.commit()
+            jobs.worker.wake()
+            changes.broker.notify(owner_id)
+            invalidate_tasks(values["id"] for _, values in rows)
+        except SQLAlchemyError as exc:
+            db.rollback()
+            errors.extend(schemas.BulkItemError(index=index, id=values["id"], detail=db_error_detail(exc)) for index, values in rows)
+            continue
+        ids.extend(values["id"] for _, values in rows)
+    return ids, errors
+
+#Delete many of one user's tasks by id (soft delete, like delete_task).
+#One UPDATE ... SET deleted_at = now WHERE id IN (...) RETURNING id per chunk; ids that weren't deleted didn't exist.
+#RETURNING also hands back each deleted row's status and due date for task_stats.
+#Returns (deleted ids, errors).
+def bulk_delete_tasks(db: Session, task_ids: list, owner_id: int):
+    ids, errors = [], []
+    for chunk in chunked(list(enumerate(task_ids))):
+        stmt = (
+            update(models.Task)
+            .where(models.Task.owner_id == owner_id, models.Task.id.in_([task_id for _, task_id in chunk]), ACTIVE)
+            .values(deleted_at=utils.utcnow())
+            .returning(models.Task.id, models.Task.status, models.Task.due_date)
+        )
+        try:
+            deleted_rows = db.execute(stmt).all()
+            deleted = {row.id for row in deleted_rows}
+            deltas = Counter()
+            for row in deleted_rows:
+                deltas[stats_key(row.status, row.due_date)] -= 1
+            apply_stats_deltas(db, owner_id, deltas)
+            record_task_changes(db, owner_id, "deleted", [row.id for row in deleted_rows])
+            db.commit()
+            changes.broker.notify(owner_id)
+            invalidate_tasks(deleted)
+        except SQLAlchemyError as exc:
+            db.rollback()
+            errors.extend(schemas.BulkItemError(index=index, id=task_id, detail=db_error_detail(exc)) for index, task_id in chunk)
+            continue
+        for index, task_id in chunk:
+            if task_id in deleted:
+                ids.append(task_id)
+            else:
+                errors.append(schemas.BulkItemError(index=index, id=task_id, detail="Task not found"))
+    return ids, errors
+
+#Archive sweep (run by the job worker's scheduler pass, with the other housekeeping)
+#Keeps the tasks table down to the working set, so get_tasks / get_task and every index stay small:
+# -> done tasks due more than ARCHIVE_AFTER_DAYS ago are moved to archived_tasks (models.ArchivedTask).
+#    That's a visible change (they leave the default task list), so it is recorded in the change log as
+#    "archived": the feeds hear about it and the collection ETags change.
+#    task_stats is left alone: archived tasks still count.
+# -> soft-deleted tasks are removed for good. Already recorded (and subtracted from task_stats) when deleted.
+#Works in batches of ARCHIVE_BATCH_SIZE rows, one transaction each, up to ARCHIVE_MAX_BATCHES per pass,
+#so a big backlog is worked off over several passes without long transactions.
+#Both queries match a partial index (ix_tasks_done_due_date, ix_tasks_deleted): a pass with nothing to do is cheap.
+#The task with the highest id is never swept: SQLite hands out max(id) + 1 to the next task, and an id must
+#not be reused while it is in the archive (or in the change log).
+ARCHIVE_ENABLED = database.env_bool("ARCHIVE_ENABLED", True)
+ARCHIVE_AFTER_DAYS = database.env_int("ARCHIVE_AFTER_DAYS", 30)
+ARCHIVE_BATCH_SIZE = database.env_int("ARCHIVE_BATCH_SIZE", 500)
+ARCHIVE_MAX_BATCHES = database.env_int("ARCHIVE_MAX_BATCHES", 20)
+
+#Move one batch of done tasks due before cutoff to archived_tasks. Returns how many were moved.
+def archive_task_batch(db: Session, cutoff: date, newest: int, batch_size: int = ARCHIVE_BATCH_SIZE):
+    task = models.Task
+    rows = db.execute(
+        select(task.id, task.owner_id)
+        #The literal 'done' (instead of a bound parameter) lets SQLite match the partial index
+        .where(task.status == literal(DONE_STATUS, literal_execute=True), ACTIVE, task.due_date < cutoff,
+               task.owner_id.is_not(None), task.id < newest)
+        .order_by(task.due_date)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not rows:
+        db.commit()
+        return 0
+    ids = [row.id for row in rows]
+    fields = list(TASK_FIELDS) + ["owner_id"]
+    db.execute(
+        insert(models.ArchivedTask).from_select(
+            fields + ["archived_at"],
+            select(*[getattr(task, field) for field in fields], literal(utils.utcnow())).where(task.id.in_(ids)),
+        )
+    )
+    db.execute(delete(task).where(task.id.in_(ids)))
+    by_owner = {}
+    for row in rows:
+        by_owner.setdefault(row.owner_id, []).append(row.id)
+    for owner_id, task_ids in by_owner.items():
+        record_task_changes(db, owner_id, "archived", task_ids)
+    db.commit()
+    for owner_id in by_owner:
+        changes.broker.notify(owner_id)
+    invalidate_tasks(ids)
+    return len(ids)
+
+#Remove one batch of soft-deleted tasks. Returns how many were removed.
+def purge_task_batch(db: Session, newest: int, batch_size: int = ARCHIVE_BATCH_SIZE):
+    ids = db.scalars(
+        select(models.Task.id)
+        .where(models.Task.deleted_at.is_not(None), models.Task.id < newest)
+        .order_by(models.Task.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if ids:
+        db.execute(delete(models.Task).where(models.Task.id.in_(ids)))
+    db.commit()
+    return len(ids)
+
+#One sweep pass. Returns (archived, purged) counts.
+@jobs.housekeeping
+def sweep_tasks(db: Session, today: date = None, batch_size: int = ARCHIVE_BATCH_SIZE,
+                max_batches: int = ARCHIVE_MAX_BATCHES):
+    if not ARCHIVE_ENABLED:
+        return 0, 0
+    cutoff = (today or date.today()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    newest = db.scalar(select(func.max(models.Task.id)))
+    archived = purged = 0
+    if newest is None:
+        return archived, purged
+    for _ in range(max_batches):
+        moved = archive_task_batch(db, cutoff, newest, batch_size)
+        archived += moved
+        if moved < batch_size:
+            break
+    for _ in range(max_batches):
+        removed = purge_task_batch(db, newest, batch_size)
+        purged += removed
+        if removed < batch_size:
+            break
+    return archived, purged
+
 #Register a New User
 #A function that creates a new user in the database.
 #user: schemas.UserCreate → Takes a Pydantic object containing username & password.
-def create_user(user: schemas.UserCreate, db: Session):
+#hashed_password → optional, when the caller already hashed user.password (e.g. in the password hashing pool).
+def create_user(user: schemas.UserCreate, db: Session, hashed_password: str = None):
     #Hashes the plain password before storing it
-    hashed_pw = utils.hash_password(user.password)
+    hashed_pw = hashed_password or utils.hash_password(user.password)
     #Creates a new SQLAlchemy User model instance
     db_user = models.User(username=user.username, hashed_password=hashed_pw)
     #Adds user to DB session.
     db.add(db_user)
     #commit() saves the change in the DB.
     db.commit()
+    #Drops any cached entry for this username so auth.get_current_user sees the new record.
+    #Any future function that changes or deletes a user must do the same.
+    cache.user_cache.delete(db_user.username)
 #refresh() updates the object with any DB-generated fields (like id, created_at)
     db.refresh(db_user)
     #Returns the user object 
@@ -124,4 +925,34 @@ def get_user_by_username(username: str, db: Session = Depends(database.get_db)):
     #Queries the User table.
     #Filters where the username matches the provided input.
     #Returns the first match or None if no user is found.
-    return db.query(models.User).filter(models.User.username == username).first()
\ No newline at end of file
+    return db.query(models.User).filter(models.User.username == username).first()
+
+#Revoked tokens
+#Record that the token with this jti is revoked.
+#token_type: "access" or "refresh". expires_at: the token's own expiry (naive UTC).
+#Returns False if it was already revoked: for refresh tokens that means a second use of the same token,
+#and the primary key makes sure only one of two concurrent refreshes wins.
+#The insert runs in a savepoint, so a duplicate only undoes the insert itself.
+def revoke_token(db: Session, jti: str, token_type: str, expires_at):
+    try:
+        with db.begin_nested():
+            db.add(models.RevokedToken(jti=jti, token_type=token_type, expires_at=expires_at, revoked_at=utils.utcnow()))
+    except IntegrityError:
+        return False
+    db.commit()
+    return True
+
+#Revoked tokens of one type that haven't expired yet, optionally only those revoked at or after since.
+#Returns (jti, expires_at, revoked_at) rows.
+def get_revoked_tokens(db: Session, since=None, token_type: str = "access"):
+    stmt = select(models.RevokedToken.jti, models.RevokedToken.expires_at, models.RevokedToken.revoked_at).where(
+        models.RevokedToken.token_type == token_type, models.RevokedToken.expires_at > utils.utcnow()
+    )
+    if since is not None:
+        stmt = stmt.where(models.RevokedToken.revoked_at >= since)
+    return db.execute(stmt).all()
+
+#Forget revocations of tokens that have expired anyway.
+def purge_revoked_tokens(db: Session):
+    db.execute(delete(models.RevokedToken).where(models.RevokedToken.expires_at <= utils.utcnow()))
+    db.commit()
@@ -10,13 +10,18 @@
 #sessionmaker: a factory function that creates new database sessions (used to interact with the DB).
 #declarative_base: a base class from which all your ORM models will inherit. It keeps track of tables and classes for SQLAlchemy.
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 #os lets you access environment variables.
 #load_dotenv() loads the .env file so environment variables like DATABASE_URL can be used
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 
 #Loads variables from .env into your environment so os.getenv("DATABASE_URL") will work
 load_dotenv()
@@ -37,34 +42,257 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///.tasks.db")
 #connect_args={"check_same_thread": False} is specific to SQLite:It disables SQLite's "single-thread rule" (SQLite is usually restricted to one thread).This is needed when using the database in web frameworks like FastAPI, which uses multiple threads.
 #engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread":False})
 
-#Establishes the connection to the database.
-#The engine is the low-level component that talks to the DB.
-#Use with docker: 
-#engine = create_engine(SQLALCHEMY_DATABASE_URL)
+#Connection pool settings (all optional, read from the environment / .env).
+#Every uvicorn worker has its own pool, so the DB sees up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+#DB_POOL_SIZE: connections kept open per worker.
+#DB_MAX_OVERFLOW: extra connections allowed during bursts (closed again when returned).
+#DB_POOL_TIMEOUT: seconds a request waits for a free connection before failing.
+#DB_POOL_RECYCLE: seconds after which a connection is replaced (avoids connections killed by the server/proxy).
+#DB_POOL_PRE_PING: test each connection before use, so stale connections after a DB failover are replaced transparently.
+#DB_STATEMENT_TIMEOUT_MS: PostgreSQL statement_timeout; 0 disables it.
+def env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+def env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+POOL_SIZE = env_int("DB_POOL_SIZE", 5)
+MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 10)
+POOL_TIMEOUT = env_int("DB_POOL_TIMEOUT", 30)
+POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 1800)
+POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+STATEMENT_TIMEOUT_MS = env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+
+#Pool metrics
+#Counts checkouts and how long callers waited for a connection (the time spent in pool.connect()).
+#A growing average/max wait means the pool is too small for the load (or connections are held too long).
+#Kept per engine ("sync", "async"): in async mode both engines exist and have a pool of their own.
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+pool_stats = {"sync": PoolStats(), "async": PoolStats()}
+
+#Times every checkout from the pool it is mixed into, in the PoolStats of its engine.
+class TimedPoolMixin:
+    engine_label = "sync"
+
+    def connect(self):
+        stats = pool_stats[self.engine_label]
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            stats.record_timeout()
+            raise
+        stats.record(time.perf_counter() - start)
+        return connection
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    engine_label = "async"
+
+#True for "sqlite:///tasks.db", False for in-memory SQLite ("sqlite://", "sqlite:///:memory:").
+def is_sqlite_file(url: str) -> bool:
+    return make_url(url).database not in (None, "", ":memory:")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+#SQLite tuning for local runs, applied to every new connection:
+#journal_mode=WAL: readers don't block the writer (and vice versa). File databases only.
+#synchronous=NORMAL: safe with WAL and much faster than FULL.
+#busy_timeout: wait up to 5s for a lock instead of failing with "database is locked".
+#foreign_keys=ON: SQLite ignores foreign keys unless asked.
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if is_sqlite_file(DATABASE_URL):
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+#Builds the create_engine()/create_async_engine() keyword arguments for a DB URL.
+def engine_options(url: str, is_async: bool = False) -> dict:
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        options = {"connect_args": {"check_same_thread": False}}
+        #In-memory databases live inside a single connection, so they keep SQLAlchemy's default pool
+        if is_sqlite_file(url):
+            options["poolclass"] = TimedAsyncQueuePool if is_async else TimedQueuePool
+        return options
+    options = {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+    if backend == "postgresql" and STATEMENT_TIMEOUT_MS:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+    return options
 
 #Creates a local session factory. Every time you need a DB session, you'll call SessionLocal().
 #Parameters:
 #autocommit=False: You must explicitly commit transactions.
 #autoflush=False: SQLAlchemy won’t automatically flush changes to the DB until you commit.
-#bind=engine: Binds this session factory to the engine created above.
+#It starts unbound: init_engines() binds it to the engine once that exists.
 
-SessionLocal = sessionmaker(autocommit = False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit = False, autoflush=False)
 
 #Creates a base class Base that all your ORM models will inherit from. It tells SQLAlchemy: "Any class that inherits from me is a table in the database."
 Base = declarative_base()
 
+#Async mode
+#DB_ASYNC=true switches the request path to SQLAlchemy's asyncio engine:
+#the route handlers then wait on the database without holding a threadpool worker.
+#The sync engine stays available (migrations, background jobs, scripts).
+ASYNC_DB = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+#Maps a sync DB URL to the matching async driver:
+#postgresql://... -> postgresql+asyncpg://...
+#sqlite:///...    -> sqlite+aiosqlite:///...
+def async_database_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+", 1)[0]
+    drivers = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+    return f"{drivers.get(dialect, scheme)}://{rest}"
+
+#expire_on_commit=False: objects stay readable after commit. Reloading expired attributes would need
+#another await, which can't happen while FastAPI serializes the response.
+#Bound by init_engines(), like SessionLocal.
+AsyncSessionLocal = None
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+#Engines
+#Nothing connects to the database at import time: the engines are built by init_engines(), which main.py's
+#lifespan calls on startup (and get_db() calls as a fallback, for apps served without a lifespan, e.g. in tests).
+#So importing the app is fast and doesn't need the DB to be up; a new worker only pays for the engine once it starts.
+#engine: the low-level component that talks to the DB. async_engine: only built in async mode,
+#so asyncpg/aiosqlite are only needed when DB_ASYNC is on.
+engine = None
+async_engine = None
+#Functions called with every engine init_engines() builds (sync engines, or AsyncEngine.sync_engine),
+#e.g. metrics.instrument_engine. Registered by main.py.
+ENGINE_HOOKS = []
+engine_lock = threading.Lock()
+
+def init_engines():
+    global engine, async_engine
+    if engine is not None:
+        return engine
+    with engine_lock:
+        if engine is not None:
+            return engine
+        sync_engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+        engines = [sync_engine]
+        if ASYNC_DB:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            async_engine = create_async_engine(async_database_url(DATABASE_URL), **engine_options(DATABASE_URL, is_async=True))
+            AsyncSessionLocal.configure(bind=async_engine)
+            engines.append(async_engine.sync_engine)
+        for each in engines:
+            if each.dialect.name == "sqlite":
+                event.listen(each, "connect", set_sqlite_pragmas)
+            for hook in ENGINE_HOOKS:
+                hook(each)
+        SessionLocal.configure(bind=sync_engine)
+        engine = sync_engine
+    return engine
+
+#Closes every pooled connection (on shutdown). The next init_engines() builds fresh engines.
+async def dispose_engines():
+    global engine, async_engine
+    if async_engine is not None:
+        await async_engine.dispose()
+        async_engine = None
+    if engine is not None:
+        engine.dispose()
+        engine = None
+
+#Migrations
+#The schema is managed by Alembic (alembic.ini, migrations/versions/), not created by the app:
+#run "alembic upgrade head" before starting the server (the Docker image does it for you).
+#MIGRATE_ON_STARTUP=true runs it from the lifespan instead, handy for a local SQLite file.
+MIGRATE_ON_STARTUP = env_bool("MIGRATE_ON_STARTUP", False)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Upgrade the database at url (default DATABASE_URL) to the latest migration.
+#Alembic is imported here, so the server only loads it when it actually migrates.
+def migrate(url: str = None):
+    from alembic import command
+    from alembic.config import Config
+    config = Config(os.path.join(ROOT_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT_DIR, "migrations"))
+    config.set_main_option("sqlalchemy.url", (url or DATABASE_URL).replace("%", "%%"))
+    #Keep the app's own logging setup
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, "head")
+
 #This function is a FastAPI dependency (used with Depends(get_db)).
 #It:
-#Creates a DB session.
-#yields it to the route handler or function that needs it.
+#Creates a DB session: an AsyncSession in async mode, a regular Session otherwise.
+#yields it to the route handler or function that needs it (they go through app/async_crud.py, which accepts both).
 #Closes the session afterward — avoids DB leaks or uncommitted connections.
 #The try/finally ensures the database session is always closed — even if there's an error or exception.
 #Prevents connection leaks that can happen if you forget to close the session manually.
-def get_db():
+async def get_db():
+    if engine is None:
+        init_engines()
+    if ASYNC_DB:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        #close() may roll back and return the connection to the pool, so keep it off the event loop
+        await run_in_threadpool(db.close)
+
+#Readout of one engine's pool: live pool state plus its checkout counters.
+def engine_pool_metrics(current, stats: PoolStats) -> dict:
+    pool = current.pool if current is not None else None
+    with stats.lock:
+        metrics = {
+            "pool": pool.__class__.__name__ if pool is not None else None,
+            "checkouts": stats.checkouts,
+            "timeouts": stats.timeouts,
+            "wait_seconds_total": round(stats.wait_seconds_total, 6),
+            "wait_seconds_max": round(stats.wait_seconds_max, 6),
+            "wait_seconds_avg": round(stats.wait_seconds_total / stats.checkouts, 6) if stats.checkouts else 0.0,
+        }
+    #Only QueuePool-style pools know their size/overflow
+    if isinstance(pool, QueuePool):
+        metrics.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(), overflow=pool.overflow())
+    return metrics
+
+#Readout for GET /metrics/db.
+#The top level is the engine that serves requests (the async one in async mode);
+#"engines" has each engine of the current mode by label: "sync", plus "async" in async mode.
+def pool_metrics() -> dict:
+    engines = {"sync": engine, "async": async_engine} if ASYNC_DB else {"sync": engine}
+    readouts = {label: engine_pool_metrics(current, pool_stats[label]) for label, current in engines.items()}
+    metrics = dict(readouts["async" if ASYNC_DB else "sync"])
+    metrics["engines"] = readouts
+    return metrics
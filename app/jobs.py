@@ -0,0 +1,292 @@
+#Background jobs: deferred side effects of task writes (notifications, due-date reminders).
+#Request handlers never do this work themselves, they only enqueue():
+# -> enqueue() adds a row to the jobs table inside the caller's transaction, so a job exists if and only if
+#    the write that caused it was committed, and queued work survives restarts.
+# -> JobWorker runs in the app's event loop (started by main.py's lifespan). It claims due jobs in batches,
+#    runs their handlers concurrently and retries failures with exponential backoff.
+# -> The worker also runs the reminder scheduler every REMINDER_SCAN_INTERVAL seconds: it enqueues one
+#    "task_reminder" job per open task due within REMINDER_DAYS, using the partial index on open tasks' due_date.
+#Several app processes can run workers against the same DB: on PostgreSQL jobs are claimed with
+#SELECT ... FOR UPDATE SKIP LOCKED, and the claim UPDATE re-checks the status, so a job runs once per attempt.
+import asyncio
+from datetime import date, timedelta
+import logging
+import os
+
+from sqlalchemy import insert, literal, select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import database, metrics, models
+from .utils import utcnow
+
+logger = logging.getLogger("app.jobs")
+
+JOBS_ENABLED = database.env_bool("JOBS_ENABLED", True)
+#Jobs claimed (and run concurrently) per batch
+JOB_CONCURRENCY = database.env_int("JOB_CONCURRENCY", 10)
+#Seconds between checks for due jobs when the worker isn't woken up by enqueue()
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+#Seconds a handler may run; also the lease after which a crashed worker's job is retried
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", 60))
+JOB_MAX_ATTEMPTS = database.env_int("JOB_MAX_ATTEMPTS", 5)
+#First retry after this many seconds, then doubling: 5s, 10s, 20s, ...
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 5))
+#Finished jobs are deleted after this many days. Keep it longer than REMINDER_DAYS:
+#the done reminder jobs are what stops the scheduler from reminding twice.
+JOB_RETENTION_DAYS = database.env_int("JOB_RETENTION_DAYS", 7)
+#Remind about open tasks due within this many days (0 = due today)
+REMINDER_DAYS = database.env_int("REMINDER_DAYS", 1)
+REMINDER_SCAN_INTERVAL = float(os.getenv("REMINDER_SCAN_INTERVAL", 60))
+
+jobs_processed_total = metrics.Counter("jobs_processed_total", "Background jobs run, by outcome.", ("kind", "outcome"))
+metrics.REGISTRY.append(jobs_processed_total)
+
+#Queue a job. Doesn't commit: the job is saved together with the caller's own changes.
+#Call worker.wake() after the commit to have it picked up right away instead of at the next poll.
+def enqueue(db: Session, kind: str, payload: dict, delay: float = 0, dedupe_key: str = None):
+    now = utcnow()
+    job = models.Job(
+        kind=kind, payload=payload, status="queued", attempts=0, max_attempts=JOB_MAX_ATTEMPTS,
+        run_at=now + timedelta(seconds=delay), dedupe_key=dedupe_key, created_at=now,
+    )
+    db.add(job)
+    return job
+
+#Queue many jobs of one kind at once (bulk writes): one multi-row INSERT instead of an ORM object per job.
+#Doesn't commit, like enqueue().
+def enqueue_many(db: Session, kind: str, payloads: list):
+    if not payloads:
+        return
+    now = utcnow()
+    db.execute(insert(models.Job), [
+        {"kind": kind, "payload": payload, "status": "queued", "attempts": 0, "max_attempts": JOB_MAX_ATTEMPTS,
+         "run_at": now, "created_at": now}
+        for payload in payloads
+    ])
+
+#Handlers by job kind: async def handler(payload, run_db).
+#run_db(fn, *args) runs fn(session, *args) in the threadpool with a fresh session, for handlers that need the DB.
+#A handler that raises is retried; it must be safe to run more than once for the same job.
+HANDLERS = {}
+
+def handler(kind: str):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+#Where notifications go. Only logged for now; replace with e-mail / push / webhook delivery.
+async def send_notification(owner_id: int, message: str):
+    logger.info("notify user %s: %s", owner_id, message)
+
+#Sent after a task is created or its status changes (enqueued by crud).
+@handler("task_notification")
+async def notify_task_change(payload: dict, run_db):
+    await send_notification(payload["owner_id"], f"task {payload['task_id']} {payload['event']}")
+
+#Reminder that a task is due soon (enqueued by schedule_reminders).
+#Skipped if the task was deleted, finished or moved to another date in the meantime.
+@handler("task_reminder")
+async def remind_task(payload: dict, run_db):
+    def load(db: Session):
+        return db.execute(
+            select(models.Task.title, models.Task.status, models.Task.due_date)
+            .where(models.Task.id == payload["task_id"], models.Task.owner_id == payload["owner_id"],
+                   models.Task.deleted_at.is_(None))
+        ).first()
+    task = await run_db(load)
+    if task is None or task.status == "done" or str(task.due_date) != payload["due_date"]:
+        return
+    await send_notification(payload["owner_id"], f"task {payload['task_id']} ({task.title}) is due {payload['due_date']}")
+
+#Claim up to limit due jobs: mark them running with a lease of JOB_TIMEOUT seconds, count the attempt.
+#Returns the claimed jobs as rows (id, kind, payload, attempts, max_attempts).
+def claim_jobs(db: Session, limit: int):
+    now = utcnow()
+    job = models.Job
+    ids = db.scalars(
+        select(job.id)
+        .where(job.status == "queued", job.run_at <= now)
+        .order_by(job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        db.rollback()
+        return []
+    claimed = db.execute(
+        update(job)
+        .where(job.id.in_(ids), job.status == "queued")
+        .values(status="running", attempts=job.attempts + 1, locked_until=now + timedelta(seconds=JOB_TIMEOUT))
+        .returning(job.id, job.kind, job.payload, job.attempts, job.max_attempts)
+    ).all()
+    db.commit()
+    return claimed
+
+def complete_job(db: Session, job_id: int):
+    db.execute(update(models.Job).where(models.Job.id == job_id).values(status="done", locked_until=None, last_error=None))
+    db.commit()
+
+#A failed attempt: queue the job again after a backoff, or give up after max_attempts.
+def fail_job(db: Session, job_id: int, attempts: int, max_attempts: int, error: str):
+    values = {"locked_until": None, "last_error": error[:1000]}
+    if attempts >= max_attempts:
+        values["status"] = "failed"
+    else:
+        values["status"] = "queued"
+        values["run_at"] = utcnow() + timedelta(seconds=JOB_RETRY_DELAY * 2 ** (attempts - 1))
+    db.execute(update(models.Job).where(models.Job.id == job_id).values(**values))
+    db.commit()
+
+#Housekeeping functions fn(db), run in the threadpool with every scheduler pass (run_once).
+#Other modules add their own periodic cleanup with @housekeeping (e.g. crud.purge_idempotency_keys).
+HOUSEKEEPING = []
+
+def housekeeping(fn):
+    HOUSEKEEPING.append(fn)
+    return fn
+
+#Job housekeeping:
+# -> jobs left "running" past their lease (the worker died) are queued again, or failed if out of attempts,
+# -> finished jobs older than JOB_RETENTION_DAYS are deleted.
+@housekeeping
+def recover_jobs(db: Session):
+    now = utcnow()
+    job = models.Job
+    expired = (job.status == "running", job.locked_until < now)
+    db.execute(update(job).where(*expired, job.attempts >= job.max_attempts).values(status="failed", last_error="lease expired"))
+    db.execute(update(job).where(*expired).values(status="queued", locked_until=None, run_at=now))
+    db.execute(delete(job).where(job.status == "done", job.created_at < now - timedelta(days=JOB_RETENTION_DAYS)))
+    db.commit()
+
+#Dialects with INSERT ... ON CONFLICT DO NOTHING
+INSERT_IGNORE = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+#Enqueue a reminder for every open task due between today and today + REMINDER_DAYS.
+#The WHERE clause matches the partial index ix_tasks_open_due_date, so only open tasks in the window are read
+#('done' is inlined rather than a bound parameter: SQLite only matches a partial index against literal values).
+#Each reminder has the dedupe key "reminder:<task id>:<due date>": tasks that already got one are skipped by
+#the unique index, and a task moved to a new date gets a new reminder.
+#Returns how many tasks were in the window.
+def schedule_reminders(db: Session, today: date = None):
+    today = today or date.today()
+    tasks = db.execute(
+        select(models.Task.id, models.Task.owner_id, models.Task.due_date)
+        .where(models.Task.status != literal("done", literal_execute=True), models.Task.deleted_at.is_(None),
+               models.Task.due_date >= today, models.Task.due_date <= today + timedelta(days=REMINDER_DAYS))
+    ).all()
+    if not tasks:
+        return 0
+    now = utcnow()
+    rows = [
+        {
+            "kind": "task_reminder",
+            "payload": {"task_id": task.id, "owner_id": task.owner_id, "due_date": str(task.due_date)},
+            "status": "queued", "attempts": 0, "max_attempts": JOB_MAX_ATTEMPTS, "run_at": now,
+            "dedupe_key": f"reminder:{task.id}:{task.due_date}", "created_at": now,
+        }
+        for task in tasks
+    ]
+    make_insert = INSERT_IGNORE.get(db.get_bind().dialect.name)
+    if make_insert is not None:
+        db.execute(make_insert(models.Job).on_conflict_do_nothing(index_elements=["dedupe_key"]), rows)
+    else:
+        existing = set(db.scalars(select(models.Job.dedupe_key).where(models.Job.dedupe_key.in_([row["dedupe_key"] for row in rows]))))
+        rows = [row for row in rows if row["dedupe_key"] not in existing]
+        if rows:
+            db.execute(insert(models.Job), rows)
+    db.commit()
+    return len(tasks)
+
+#Runs queued jobs inside the app's event loop.
+#session_factory: makes the DB sessions for claiming jobs and for handlers (database.SessionLocal).
+class JobWorker:
+    def __init__(self, session_factory=None, concurrency: int = JOB_CONCURRENCY, poll_interval: float = JOB_POLL_INTERVAL,
+                 scan_interval: float = REMINDER_SCAN_INTERVAL):
+        self.session_factory = session_factory or database.SessionLocal
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.scan_interval = scan_interval
+        self.next_scan = 0.0
+        self.loop = None
+        self.wakeup = None
+        self.runner = None
+
+    #Run fn(session, *args) in the threadpool with its own session.
+    async def run_db(self, fn, *args):
+        def call():
+            db = self.session_factory()
+            try:
+                return fn(db, *args)
+            finally:
+                db.close()
+        return await run_in_threadpool(call)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.runner = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.runner is not None:
+            self.runner.cancel()
+            try:
+                await self.runner
+            except asyncio.CancelledError:
+                pass
+            self.runner = None
+
+    #Tell the worker new jobs were committed. Safe to call from any thread, and a no-op when it isn't running.
+    def wake(self):
+        if self.runner is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def execute(self, job):
+        handler_fn = HANDLERS.get(job.kind)
+        try:
+            if handler_fn is None:
+                raise LookupError(f"no handler for job kind {job.kind!r}")
+            await asyncio.wait_for(handler_fn(job.payload, self.run_db), timeout=JOB_TIMEOUT)
+        except Exception as exc:
+            logger.warning("job %s (%s) attempt %s failed: %r", job.id, job.kind, job.attempts, exc)
+            await self.run_db(fail_job, job.id, job.attempts, job.max_attempts, repr(exc))
+            jobs_processed_total.inc(kind=job.kind, outcome="failed" if job.attempts >= job.max_attempts else "retry")
+        else:
+            await self.run_db(complete_job, job.id)
+            jobs_processed_total.inc(kind=job.kind, outcome="done")
+
+    #One round: the scheduler (when it's due), then one batch of jobs. Returns how many jobs ran.
+    async def run_once(self) -> int:
+        if self.loop is None or self.loop.time() >= self.next_scan:
+            for cleanup in HOUSEKEEPING:
+                try:
+                    await self.run_db(cleanup)
+                except Exception:
+                    logger.exception("housekeeping %s failed", cleanup.__name__)
+            await self.run_db(schedule_reminders)
+            if self.loop is not None:
+                self.next_scan = self.loop.time() + self.scan_interval
+        claimed = await self.run_db(claim_jobs, self.concurrency)
+        await asyncio.gather(*(self.execute(job) for job in claimed))
+        return len(claimed)
+
+    async def run(self):
+        while True:
+            #Cleared before looking for jobs, so a wake() during the round isn't lost
+            self.wakeup.clear()
+            try:
+                ran = await self.run_once()
+            except Exception:
+                logger.exception("job worker round failed")
+                ran = 0
+            if ran:
+                continue
+            #Idle: sleep until enqueue() wakes us up or the next poll
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+worker = JobWorker()
@@ -2,90 +2,457 @@
 #Depends is used for dependency injection — automatically providing required dependencies (like database sessions) to path operations.
 #HTTPException lets you raise HTTP errors with custom status codes and messages.
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Body, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import time
+from datetime import date, timedelta
+from typing import Literal, Optional
 
 #Import the SQLAlchemy Session class, which is used to interact with the database.
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 #Import my own app modules:
 # ->models contains your SQLAlchemy ORM models (DB tables).
 # ->schemas contains your Pydantic models (data validation/serialization).
 # ->crud contains functions that handle DB operations (Create, Read, Update, Delete).
-from . import models, schemas, crud, auth, database
-#SessionLocal is a SQLAlchemy session factory to create DB sessions.
-#engine is the SQLAlchemy engine connected to your database.
-#Base is the base class for your ORM models.
-from .database import SessionLocal, engine, Base
+from . import IMPORT_STARTED
+from . import models, schemas, crud, async_crud, auth, cache, changes, compression, database, jobs, metrics, ratelimit, responses, utils
+#get_db is the shared per-request session dependency (an AsyncSession when DB_ASYNC=true).
+from .database import get_db
 from .schemas import UserCreate, User
-#Creates all tables in the database that are defined by my ORM models if they don’t exist yet.
-#Uses the engine (DB connection) to execute this.
-Base.metadata.create_all(bind=engine)
+
+logger = logging.getLogger("app.main")
+
+#No schema work and no DB connection at import time: the tables are created by the Alembic migrations
+#(alembic upgrade head, see migrations/), and the engines are built by the lifespan below.
+#Importing the app (what every new uvicorn worker does first) therefore stays fast and works while the DB is down.
+
+#Runs once around the app's life: code before yield on startup, after yield on shutdown.
+#Startup builds the DB engines (database.init_engines), runs the migrations if MIGRATE_ON_STARTUP=true,
+#and starts the background job worker (app/jobs.py) in this process, unless JOBS_ENABLED=false.
+#How long the import and the startup took is logged and exported at GET /metrics (app_startup_seconds).
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    if database.MIGRATE_ON_STARTUP:
+        await run_in_threadpool(database.migrate)
+    database.init_engines()
+    if jobs.JOBS_ENABLED:
+        await jobs.worker.start()
+    #Keeps auth.revoked_tokens in sync with the revoked_tokens table
+    revocation_sync = asyncio.create_task(auth.revoked_tokens.run())
+    #Change feed housekeeping, and LISTEN for other processes' changes with CHANGES_BACKEND=postgres
+    change_feed_tasks = asyncio.create_task(changes.run())
+    metrics.startup_seconds["lifespan"] = time.perf_counter() - started
+    logger.info(
+        "startup: import %.1fms, lifespan %.1fms",
+        metrics.startup_seconds["import"] * 1000, metrics.startup_seconds["lifespan"] * 1000,
+    )
+    yield
+    for background in (revocation_sync, change_feed_tasks):
+        background.cancel()
+        with suppress(asyncio.CancelledError):
+            await background
+    await jobs.worker.stop()
+    await database.dispose_engines()
 
 #Creates a FastAPI application instance called app.
 #This object will be used to define API routes.
-app = FastAPI()
-
-# Dependency to get DB session
-#Creates a new DB session with SessionLocal().
-#yields the session to the caller (e.g., an API route).
-#Ensures the DB session is closed after the request is done, no matter what (with finally).
-#This pattern helps manage DB connections cleanly and efficiently per request.
-
-#Using yield in this context allows FastAPI to:
-#Inject the dependency: FastAPI can provide the database session to path operations and other dependencies.
-#Handle cleanup: After the request is completed, FastAPI ensures that the code following the yield statement is executed, which is essential for closing the database session.
-#This pattern is particularly useful for managing resources that need to be cleaned up after use, such as database connections.
-def get_db():
-    #This creates a new SQLAlchemy session. It's configured in database.py.
-    db = SessionLocal()
-    try:
-        #Instead of returning the session, we yield it. This allows FastAPI to handle the session as a dependency, ensuring that the code after the yield runs after the request is completed
-        yield db
-    #This ensures that the database session is properly closed after the request is handled, preventing potential database connection leaks    
-    finally:
-        db.close()
+#default_response_class: orjson-encoded responses when FAST_JSON=true (see app/responses.py).
+app = FastAPI(lifespan=lifespan, default_response_class=responses.DEFAULT_RESPONSE_CLASS)
+
+#Response compression (app/compression.py): gzip, or Brotli when available, for bodies above COMPRESSION_MIN_SIZE.
+#Registered first, so it sits inside the metrics middleware and its CPU time shows up in the request timings.
+if compression.COMPRESSION_ENABLED:
+    app.add_middleware(compression.CompressionMiddleware)
+
+#Performance instrumentation (app/metrics.py)
+#Every SQL statement on the app's engines is timed and counted against the current request,
+#and every request is timed per route. Read it all at GET /metrics.
+#The engines don't exist yet: database.init_engines() runs the hook on each one it builds.
+database.ENGINE_HOOKS.append(metrics.instrument_engine)
+app.middleware("http")(metrics.timing_middleware)
+
+#Admission control (app/ratelimit.py): per-client token buckets (429) and a cap on requests in flight (503).
+#Registered last so it runs first: rejected requests never reach the routes, the DB or bcrypt.
+app.middleware("http")(ratelimit.admission_middleware)
+
+#The password hashing pool is full (see utils.PasswordHasherPool): shed the request with a 503
+#and ask the client to retry shortly, instead of queueing it behind every other login.
+@app.exception_handler(utils.PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: utils.PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again"}, headers={"Retry-After": "1"})
+
+#Task routes
+#All /tasks routes require a valid JWT (Depends(auth.get_current_user)) and only ever see
+#the current user's tasks: every crud call is scoped with owner_id=current_user.id.
+#A task that belongs to someone else behaves exactly like a missing one (404).
 
 #Defines a POST API endpoint at /tasks/.
 #Expects a request body of type schemas.TaskCreate (a Pydantic model validating input).
+#Optional Idempotency-Key header: a client that retries a create (e.g. after a timeout) with the same key
+#gets the task of the first request back instead of a duplicate, marked with "Idempotent-Replayed: true".
+#Reusing a key for a different body is a client bug: 422. See crud.create_task_idempotent.
 @app.post("/tasks/", response_model=schemas.TaskResponse)
-def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db)):
+async def create_task(
+    task: schemas.TaskCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+):
     #Automatically gets a DB session injected via Depends(get_db).
-    #Calls the crud.create_task function passing DB session and task data.
+    #Calls the crud.create_task function passing DB session, task data and the owner.
     #Returns the created task serialized by schemas.TaskResponse.
-    return crud.create_task(db, task)
+    if idempotency_key is None:
+        return await async_crud.create_task(db, task, current_user.id)
+    try:
+        result, replayed = await async_crud.create_task_idempotent(db, task, current_user.id, idempotency_key)
+    except crud.IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+#HTTP caching for task collections (GET /tasks/, /tasks/stats, /tasks/export)
+#Their content only changes when one of the user's tasks does, and every task write adds a row to the change log
+#(crud.record_task_changes). So the newest change-log seq of the user (crud.get_change_marker, one index lookup)
+#is a version number for all of them:
+# -> ETag: W/"<seq>-<hash of path and query>": different pages and filters get different ETags,
+#    weak because the compressed and plain bodies differ byte for byte.
+# -> Last-Modified: when that change was made.
+# -> Cache-Control: private, no-cache: only the user's own browser may store it, and must revalidate every time.
+#A matching If-None-Match (or, without one, If-Modified-Since) gets a 304 before any task is read or serialized.
+async def collection_cache(request: Request, db, owner_id: int):
+    seq, changed_at = await async_crud.get_change_marker(db, owner_id)
+    digest = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode()).hexdigest()[:12]
+    headers = {"ETag": f'W/"{seq}-{digest}"', "Cache-Control": "private, no-cache"}
+    not_modified = utils.etag_matches(request.headers.get("if-none-match"), headers["ETag"])
+    if changed_at is not None:
+        #HTTP dates have one-second resolution: rounded up, and only sent once that second is over,
+        #so a later change can never fall within the Last-Modified a client already has.
+        last_modified = changed_at.replace(microsecond=0) + timedelta(seconds=1 if changed_at.microsecond else 0)
+        if last_modified <= utils.utcnow():
+            headers["Last-Modified"] = utils.http_date(last_modified)
+            if "if-none-match" not in request.headers:
+                since = utils.parse_http_date(request.headers.get("if-modified-since"))
+                not_modified = since is not None and last_modified <= since
+    return headers, not_modified
 
-#Defines a GET API endpoint at /tasks/ to fetch all tasks.
-@app.get("/tasks/", response_model=list[schemas.TaskResponse])
+#The 304 answer, carrying the same validators as the full response.
+def not_modified_response(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+#Add headers to an endpoint's result: a ready Response (e.g. responses.fast_json) or FastAPI's response parameter.
+def with_headers(result, response: Response, headers: dict):
+    (result if isinstance(result, Response) else response).headers.update(headers)
+    return result
+
+#Defines a GET API endpoint at /tasks/ to fetch tasks one page at a time.
+@app.get("/tasks/", response_model=schemas.TaskPage)
 #Injects a DB session.
-#Calls crud.get_tasks to query all tasks from DB.
-#Returns a list of tasks, serialized with schemas.TaskResponse.
-def read_tasks(db: Session = Depends(get_db)):
-    return crud.get_tasks(db)
+#Query parameters (all optional):
+#limit: page size, bounded by crud.MAX_PAGE_SIZE.
+#cursor: the next_cursor from the previous page.
+#sort / order: sort by id or due_date, ascending or descending.
+#status, due_from, due_to, title_prefix: server-side filters.
+#include_archived: also list archived tasks (marked "archived": true); by default only the active ones.
+#Calls crud.get_tasks to query a single page from the DB.
+#Returns {"items": [...], "next_cursor": "..."}; an invalid cursor is a 400.
+#The items are plain row dicts; with FAST_JSON=true they're encoded directly, without per-item validation.
+#Conditional requests: see collection_cache above (304 while none of the user's tasks changed).
+async def read_tasks(
+    request: Request,
+    response: Response,
+    limit: int = Query(crud.DEFAULT_PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: Literal["id", "due_date"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    status: Optional[str] = None,
+    due_from: Optional[date] = None,
+    due_to: Optional[date] = None,
+    title_prefix: Optional[str] = None,
+    include_archived: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+):
+    headers, not_modified = await collection_cache(request, db, current_user.id)
+    if not_modified:
+        return not_modified_response(headers)
+    try:
+        tasks, next_cursor = await async_crud.get_tasks(
+            db, current_user.id, limit=limit, cursor=cursor, sort=sort, order=order, status=status,
+            due_from=due_from, due_to=due_to, title_prefix=title_prefix, include_archived=include_archived,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return with_headers(responses.fast_json({"items": tasks, "next_cursor": next_cursor}), response, headers)
+
+#Full-text search over the user's tasks (title and description).
+#q: the search text. On PostgreSQL it accepts web-search syntax ("exact phrase", or, -exclude).
+#limit / offset: pagination over the ranked results; offset is capped because deep offsets
+#still have to rank and skip every earlier match.
+#Returns {"items": [...tasks with a "score"...], "next_offset": ...}, best matches first.
+MAX_SEARCH_OFFSET = 10_000
+
+@app.get("/tasks/search", response_model=schemas.TaskSearchPage)
+async def search_tasks(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(crud.DEFAULT_PAGE_SIZE, ge=1, le=crud.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+):
+    tasks, next_offset = await async_crud.search_tasks(db, current_user.id, q, limit, offset)
+    return responses.fast_json({"items": tasks, "next_offset": next_offset})
+
+#Dashboard numbers for the user's tasks: counts by status, overdue count, due-date and per-month histograms.
+#Read from the task_stats summary table that every task write keeps up to date (see crud.get_task_stats),
+#so the cost doesn't grow with the number of tasks.
+#Cached like GET /tasks/ (collection_cache). The overdue/due-today buckets also move with the date,
+#so the ETag includes today's date.
+@app.get("/tasks/stats", response_model=schemas.TaskStats)
+async def task_stats(request: Request, response: Response, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    headers, not_modified = await collection_cache(request, db, current_user.id)
+    headers["ETag"] = headers["ETag"][:-1] + f'-{date.today().isoformat()}"'
+    headers.pop("Last-Modified", None)
+    if utils.etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return not_modified_response(headers)
+    return with_headers(await async_crud.get_task_stats(db, current_user.id), response, headers)
+
+#Real-time change feed (app/changes.py)
+#Instead of polling GET /tasks/, a client keeps one of these open and receives every create/update/delete
+#of its tasks as it is committed: {"type": "change", "seq": ..., "op": ..., "task_id": ..., "task": {...}}.
+#Resume after a disconnect with ?since=<last seq seen> (SSE: the browser sends Last-Event-ID by itself).
+#A "reset" event means the changes since then are gone (CHANGES_RETENTION_HOURS): reload GET /tasks/ first.
+#The session is only used for short reads, each ending its transaction, so an idle feed holds no DB connection.
+def change_feed(db, owner_id: int, since):
+    return changes.follow(
+        owner_id, since,
+        fetch=lambda after, limit: async_crud.get_task_changes(db, owner_id, after, limit),
+        bounds=lambda: async_crud.get_change_bounds(db),
+    )
+
+#Server-Sent Events: GET /tasks/changes with Accept: text/event-stream (e.g. the browser's EventSource).
+@app.get("/tasks/changes")
+async def task_changes(
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[int] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+):
+    since = last_event_id if last_event_id is not None else since
+    async def events():
+        async for event in change_feed(db, current_user.id, since):
+            yield changes.format_sse(event)
+    #X-Accel-Buffering: tells nginx not to buffer the stream
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+#WebSocket: ws://.../tasks/changes/ws?token=<access token>[&since=N]. Browsers can't set headers on a
+#WebSocket, so the token comes in the query string (an Authorization header works too). Events are JSON messages.
+@app.websocket("/tasks/changes/ws")
+async def task_changes_ws(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None),
+    since: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_db),
+):
+    authorization = websocket.headers.get("authorization", "")
+    token = token or (authorization[7:] if authorization.lower().startswith("bearer ") else None)
+    try:
+        payload = await auth.get_token_payload(token or "")
+        current_user = await auth.get_current_user(payload, db)
+    except HTTPException:
+        #1008: policy violation, the WebSocket equivalent of a 401
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    async def send_events():
+        async for event in change_feed(db, current_user.id, since):
+            if event is not None:
+                await websocket.send_text(json.dumps(event, default=str))
+    sender = asyncio.create_task(send_events())
+    try:
+        #Nothing is expected from the client; receiving is how we notice it went away
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        with suppress(asyncio.CancelledError):
+            await sender
+
+#Turn batches of exported rows into text chunks.
+#Each batch becomes one chunk, so the client receives data as soon as the first batch is read.
+#Rows are plain tuples from crud.stream_tasks: no per-row Pydantic validation.
+async def ndjson_chunks(batches):
+    async for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(crud.EXPORT_COLUMNS, row)), default=str) + "\n" for row in batch
+        )
+
+async def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(crud.EXPORT_COLUMNS)
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        #Reuse the buffer for the next batch
+        buffer.seek(0)
+        buffer.truncate()
+    #Header only, when there are no rows at all
+    if buffer.tell():
+        yield buffer.getvalue()
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_chunks, "application/x-ndjson"),
+    "csv": (csv_chunks, "text/csv"),
+}
+
+#Defines a GET endpoint at /tasks/export to download every task.
+#format: "ndjson" (one JSON object per line) or "csv".
+#Accepts the same filters as GET /tasks/.
+#The response is streamed: rows are read from the DB batch by batch and written out immediately,
+#so memory use stays constant even for millions of tasks.
+#Declared before /tasks/{task_id} so "export" isn't parsed as a task id.
+@app.get("/tasks/export")
+async def export_tasks(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    status: Optional[str] = None,
+    due_from: Optional[date] = None,
+    due_to: Optional[date] = None,
+    title_prefix: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+):
+    #Re-downloading an unchanged export is a 304 (see collection_cache)
+    headers, not_modified = await collection_cache(request, db, current_user.id)
+    if not_modified:
+        return not_modified_response(headers)
+    to_chunks, media_type = EXPORT_FORMATS[format]
+    batches = async_crud.stream_tasks(db, current_user.id, status=status, due_from=due_from, due_to=due_to, title_prefix=title_prefix)
+    return StreamingResponse(
+        to_chunks(batches),
+        media_type=media_type,
+        headers={**headers, "Content-Disposition": f'attachment; filename="tasks.{format}"'},
+    )
+
+#Bulk endpoints
+#Each one accepts a JSON array (at most MAX_BULK_ITEMS items) and returns a schemas.BulkResult.
+#Items are validated one by one, so a single invalid item is reported in "errors"
+#instead of rejecting the whole request with a 422.
+MAX_BULK_ITEMS = 10_000
+
+#Validate raw JSON items against a schema.
+#Returns ([(index, parsed item)], [schemas.BulkItemError]).
+def validate_bulk_items(items: list, schema):
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    valid, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, schema(**item)))
+        except (ValidationError, TypeError) as exc:
+            item_id = item.get("id") if isinstance(item, dict) else None
+            errors.append(schemas.BulkItemError(index=index, id=item_id if isinstance(item_id, int) else None, detail=str(exc)))
+    return valid, errors
+
+#POST /tasks/bulk: create many tasks in chunked multi-row INSERTs.
+@app.post("/tasks/bulk", response_model=schemas.BulkResult)
+async def bulk_create_tasks(items: list[dict] = Body(...), db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    valid, errors = await run_in_threadpool(validate_bulk_items, items, schemas.TaskCreate)
+    ids, db_errors = await async_crud.bulk_create_tasks(db, valid, current_user.id)
+    return {"ids": ids, "errors": sorted(errors + db_errors, key=lambda error: error.index)}
+
+#PATCH /tasks/bulk: update many tasks; each item is {"id": ..., <only the fields to change>}.
+@app.patch("/tasks/bulk", response_model=schemas.BulkResult)
+async def bulk_update_tasks(items: list[dict] = Body(...), db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    valid, errors = await run_in_threadpool(validate_bulk_items, items, schemas.TaskBulkUpdate)
+    ids, db_errors = await async_crud.bulk_update_tasks(db, valid, current_user.id)
+    return {"ids": ids, "errors": sorted(errors + db_errors, key=lambda error: error.index)}
+
+#DELETE /tasks/bulk: delete many tasks; body is {"ids": [1, 2, 3]}.
+@app.delete("/tasks/bulk", response_model=schemas.BulkResult)
+async def bulk_delete_tasks(body: schemas.TaskBulkDelete, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    if len(body.ids) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    ids, errors = await async_crud.bulk_delete_tasks(db, body.ids, current_user.id)
+    return {"ids": ids, "errors": errors}
 
 #Defines a GET endpoint at /tasks/{task_id} where task_id is a path parameter.
 @app.get("/tasks/{task_id}", response_model=schemas.TaskResponse)
-def read_task(task_id: int, db: Session = Depends(get_db)):
-    #Gets a single task by its ID.
+async def read_task(
+    task_id: int,
+    response: Response,
+    include_archived: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+):
+    #Gets a single task by its ID, from cache.task_cache when possible (no DB hit).
+    #include_archived: if it isn't an active task, look in the archive too.
     #If task not found, raises a 404 HTTP error with a message.
+    #Every response carries an ETag. A client that sends it back in If-None-Match gets an empty
+    #304 Not Modified while the task is unchanged.
     #Otherwise, returns the task serialized as TaskResponse.
-    task = crud.get_task(db, task_id)
-    if not task:
+    entry = await async_crud.get_task_cached(db, task_id, current_user.id)
+    if not entry and include_archived:
+        archived = await async_crud.get_archived_task(db, task_id, current_user.id)
+        if archived:
+            entry = {"task": archived, "etag": crud.task_etag(archived)}
+    if not entry:
         raise HTTPException(status_code=404, detail="Task not found")
-    return task
+    if utils.etag_matches(if_none_match, entry["etag"]):
+        return Response(status_code=304, headers={"ETag": entry["etag"]})
+    response.headers["ETag"] = entry["etag"]
+    return entry["task"]
 
 #Defines a PUT endpoint at /tasks/{task_id} to update an existing task.
 @app.put("/tasks/{task_id}", response_model=schemas.TaskResponse)
 #Receives the task ID in the URL, the new task data in the request body, and the DB session.
 #Calls the crud.update_task function to perform the update.
 #Returns the updated task serialized.
-def update_task(task_id: int, task: schemas.TaskUpdate, db: Session = Depends(get_db)):
-    return crud.update_task(db, task_id, task)
+async def update_task(task_id: int, task: schemas.TaskUpdate, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    db_task = await async_crud.update_task(db, task_id, task, current_user.id)
+    if not db_task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return db_task
+
+#Defines a PATCH endpoint at /tasks/{task_id} for partial updates.
+#Send only the fields to change, e.g. {"status": "done"}, optionally with the "version" you last read.
+#Runs a single UPDATE ... RETURNING (see crud.patch_task).
+#Returns 404 if the task doesn't exist, 409 if it was changed by someone else since that version.
+@app.patch("/tasks/{task_id}", response_model=schemas.TaskResponse)
+async def patch_task(task_id: int, patch: schemas.TaskPatch, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    try:
+        task = await async_crud.patch_task(db, task_id, patch, current_user.id)
+    except crud.VersionConflict:
+        raise HTTPException(status_code=409, detail="Task was modified by another request")
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
 
 #Defines a DELETE endpoint at /tasks/{task_id}.
 #Deletes the task with the given ID from the database.
-#Returns the deleted task (or nothing) as confirmation.
-@app.delete("/tasks/{task_id}")
-def delete_task(task_id: int, db: Session = Depends(get_db)):
-    return crud.delete_task(db, task_id)
+#Returns the deleted task as confirmation, or 404 if there is no such task (like GET/PUT/PATCH).
+@app.delete("/tasks/{task_id}", response_model=schemas.TaskResponse)
+async def delete_task(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    db_task = await async_crud.delete_task(db, task_id, current_user.id)
+    if not db_task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return db_task
 
 #User Registration Endpoint
 #@app.post("/register") → This defines a POST route at /register.
@@ -93,13 +460,13 @@ def delete_task(task_id: int, db: Session = Depends(get_db)):
 #user: UserCreate → FastAPI expects a JSON body with username and password (validated using the UserCreate schema).
 #crud.create_user(user) → Calls your DB logic to hash the password and store the new user in the database.
 @app.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    return crud.create_user(user, db)
+async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    return await async_crud.create_user(user, db)
 
 # Login Endpoint (JWT)
 #POST request to /login.
 #Expects a JSON body with username and password.
-#Calls auth.authenticate_user() to:
+#Calls auth.authenticate_user() with a DB session to:
 #Fetch the user from the database.
 #Verify the password using bcrypt.
 #If valid, return a JWT access token like:
@@ -107,9 +474,28 @@ def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
 #  "access_token": "eyJhbGciOi...",
 #  "token_type": "bearer"
 #}
-@app.post("/login")
-def login(user: UserCreate):
-    return auth.authenticate_user(user.username, user.password)
+@app.post("/login", response_model=schemas.TokenPair)
+async def login(user: UserCreate, db: Session = Depends(get_db)):
+    return await auth.authenticate_user(user.username, user.password, db)
+
+#Token refresh
+#Trades a refresh token for a new access + refresh token pair; the old refresh token stops working.
+#401 if it is invalid, expired or was already used.
+@app.post("/token/refresh", response_model=schemas.TokenPair)
+async def refresh_token(body: schemas.RefreshRequest, db: Session = Depends(get_db)):
+    return await auth.refresh_tokens(body.refresh_token, db)
+
+#Logout
+#Revokes the access token of this request, and the refresh token if one is sent in the body.
+@app.post("/logout", status_code=204)
+async def logout(body: Optional[schemas.LogoutRequest] = None, payload: dict = Depends(auth.get_token_payload), db: Session = Depends(get_db)):
+    if body is not None and body.refresh_token:
+        refresh_payload = auth.decode_token(body.refresh_token, "refresh")
+        if refresh_payload["sub"] != payload["sub"]:
+            raise HTTPException(status_code=403, detail="Not your token")
+        await auth.revoke(refresh_payload, db)
+    await auth.revoke(payload, db)
+    return Response(status_code=204)
 
 #Protected Route (JWT Required)
 #GET request to /protected.
@@ -121,5 +507,42 @@ def login(user: UserCreate):
 #Raises 401 if invalid.
 #If token is valid, it returns a greeting with the current username.
 @app.get("/protected")
-def protected(current_user: User = Depends(auth.get_current_user)):
-    return {"message": f"Hello, {current_user.username}"}
\ No newline at end of file
+async def protected(current_user: User = Depends(auth.get_current_user)):
+    return {"message": f"Hello, {current_user.username}"}
+
+#Connection pool readout
+#GET /metrics/db returns the pool size, connections in use, and how many checkouts happened and how
+#long they waited for a free connection. Use it to size DB_POOL_SIZE / DB_MAX_OVERFLOW per worker.
+#In async mode the sync engine's pool is listed separately under "engines".
+@app.get("/metrics/db")
+async def db_metrics():
+    return database.pool_metrics()
+
+#Cache readout
+#GET /metrics/cache returns hit/miss counters (and size, for the in-process backend) of each cache.
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return {"tasks": cache.task_cache.stats(), "users": cache.user_cache.stats()}
+
+#Prometheus endpoint
+#GET /metrics returns request latency histograms per route, SQL queries and DB time per request,
+#slow request counts, plus the connection pool and cache counters, in the Prometheus text format.
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    #One sample per engine (engine="sync" / "async"), each from its own pool
+    engines = database.pool_metrics()["engines"]
+    extra = []
+    for key in ("checkouts", "timeouts", "wait_seconds_total", "wait_seconds_max", "size", "checked_out", "overflow"):
+        values = {label: pool[key] for label, pool in engines.items() if key in pool}
+        if values:
+            extra.extend(metrics.render_labelled_gauge(f"db_pool_{key}", f"Connection pool {key.replace('_', ' ')}.", "engine", values))
+    extra.extend(metrics.render_gauge("change_feed_subscribers", "Open task change feeds (SSE and WebSocket).", changes.broker.count()))
+    for phase, seconds in metrics.startup_seconds.items():
+        extra.extend(metrics.render_gauge(f"app_startup_{phase}_seconds", f"Time spent in the {phase} phase of startup.", round(seconds, 6)))
+    for name, stats in (("task", cache.task_cache.stats()), ("user", cache.user_cache.stats())):
+        extra.extend(metrics.render_gauge(f"{name}_cache_hits", f"{name.title()} cache hits.", stats["hits"]))
+        extra.extend(metrics.render_gauge(f"{name}_cache_misses", f"{name.title()} cache misses.", stats["misses"]))
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+#Everything above ran while importing the app: the "import" phase of startup, timed from app/__init__.py.
+metrics.startup_seconds["import"] = time.perf_counter() - IMPORT_STARTED
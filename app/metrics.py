@@ -0,0 +1,186 @@
+#Request-level performance instrumentation.
+#Collects, per route:
+# -> request latency (histogram) and request count by status code,
+# -> SQL queries and DB time per request, from SQLAlchemy engine events,
+#and renders everything in the Prometheus text format for GET /metrics.
+#Requests slower than SLOW_REQUEST_MS and statements slower than SLOW_QUERY_MS are logged.
+from contextvars import ContextVar
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger("app.metrics")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+
+#Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+#Queries per request: 1-2 is normal; a request in the high buckets usually means an N+1 pattern
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+#Escapes a label value for the Prometheus text format.
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+#A counter with labels, e.g. http_requests_total{method="GET",route="/tasks/",status="200"}.
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+#A histogram with labels: cumulative bucket counts plus _sum and _count, like prometheus_client.
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        #label values -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            series = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': '+Inf'})} {series[len(self.buckets)]}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {series[-1]}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {series[len(self.buckets)]}")
+        return lines
+
+REQUEST_LABELS = ("method", "route", "status")
+
+http_requests_total = Counter("http_requests_total", "HTTP requests handled.", REQUEST_LABELS)
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency.", REQUEST_LABELS)
+db_queries_per_request = Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request.", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+db_time_per_request = Histogram("db_time_per_request_seconds", "Time spent in SQL per HTTP request.", ("method", "route"))
+db_query_duration = Histogram("db_query_duration_seconds", "SQL statement latency.", ())
+slow_requests_total = Counter("slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("method", "route"))
+
+REGISTRY = [
+    http_requests_total,
+    http_request_duration,
+    db_queries_per_request,
+    db_time_per_request,
+    db_query_duration,
+    slow_requests_total,
+]
+
+#Startup timings in seconds, by phase, set by main.py: "import" (importing the app) and "lifespan" (the startup hook).
+#Exported at GET /metrics as app_startup_<phase>_seconds gauges.
+startup_seconds = {}
+
+#Per-request SQL counters. The middleware puts a fresh dict in the context for each request;
+#the engine hooks add to it. Context variables follow the request into the threadpool and into
+#AsyncSession.run_sync(), so queries are attributed to the right request in both DB modes.
+request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+#SQLAlchemy engine hooks: time every statement on this engine.
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    db_query_duration.observe(elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db_seconds"] += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("slow query %.1fms: %s", elapsed * 1000, " ".join(statement.split())[:500])
+
+#Attach the statement timers to an engine (a sync Engine, or AsyncEngine.sync_engine).
+def instrument_engine(engine):
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+#HTTP middleware body (registered in main.py with @app.middleware("http")).
+#Times the request, counts its SQL statements and records everything under the route template
+#("/tasks/{task_id}", not "/tasks/42") so the number of series stays small.
+#Adds a Server-Timing header (app and db time) so the numbers also show up in browser dev tools.
+async def timing_middleware(request, call_next):
+    stats = {"queries": 0, "db_seconds": 0.0}
+    token = request_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        request_stats.reset(token)
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        method = request.method
+        http_requests_total.inc(method=method, route=route_path, status=status)
+        http_request_duration.observe(elapsed, method=method, route=route_path, status=status)
+        db_queries_per_request.observe(stats["queries"], method=method, route=route_path)
+        db_time_per_request.observe(stats["db_seconds"], method=method, route=route_path)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            slow_requests_total.inc(method=method, route=route_path)
+            logger.warning(
+                "slow request %s %s -> %s in %.1fms (%d queries, %.1fms in DB)",
+                method, request.url.path, status, elapsed * 1000, stats["queries"], stats["db_seconds"] * 1000,
+            )
+    response.headers["Server-Timing"] = f"app;dur={elapsed * 1000:.1f}, db;dur={stats['db_seconds'] * 1000:.1f}"
+    response.headers["X-DB-Queries"] = str(stats["queries"])
+    return response
+
+#A single unlabelled gauge, for values read at scrape time (pool and cache state).
+def render_gauge(name: str, help: str, value) -> list:
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+#A gauge with one sample per label value, e.g. render_labelled_gauge("db_pool_size", "...", "engine", {"sync": 5}).
+def render_labelled_gauge(name: str, help: str, label: str, values: dict) -> list:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    lines.extend(f'{name}{{{label}="{key}"}} {value}' for key, value in values.items())
+    return lines
+
+#Everything in the Prometheus text exposition format.
+#extra_lines: additional, already formatted lines (pool and cache gauges from main.py).
+def render(extra_lines: list = ()) -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
@@ -4,10 +4,21 @@
 #String: For text fields.
 #Date: For storing date values.
 #Boolean: For storing True/False.
-from sqlalchemy import Column, Integer, String, Date, Boolean
+#DateTime: For storing timestamps. JSON: For storing structured data (stored as text on SQLite).
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey, Index, JSON, DDL, event, text
 
 #Import the Base Class: This Base is the base class all ORM models will inherit from so SQLAlchemy can recognize them and map them to tables.
 from .database import Base
+
+#Rows of the tasks table that haven't been deleted (see Task.deleted_at).
+ACTIVE_TASKS = "deleted_at IS NULL"
+
+#WHERE clause of a partial index over active tasks, plus an optional extra condition.
+#Queries only use such an index if their own WHERE contains the same terms, so every task query filters
+#on Task.deleted_at.is_(None) (crud.ACTIVE).
+def active_only(condition: str = None) -> dict:
+    where = f"{condition} AND {ACTIVE_TASKS}" if condition else ACTIVE_TASKS
+    return {"postgresql_where": text(where), "sqlite_where": text(where)}
 #Class will map to a database table. 
 #By inheriting from Base, it tells SQLAlchemy this is a model
 class Task(Base):
@@ -28,6 +39,185 @@ class Task(Base):
     #status: Tracks whether a task is "pending" or "done".
     # -> default="pending": New tasks default to "pending" status.
     status = Column(String, default="pending")  # pending / done
+    #version: incremented on every update (crud.update_task / patch_task / bulk_update_tasks).
+    #Clients send it back with a PATCH to make sure they aren't overwriting someone else's change.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    #owner_id: the user this task belongs to. Every task query filters on it.
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    #deleted_at: set when the task is deleted (soft delete). A deleted task is gone for every query
+    #(they all filter on "deleted_at IS NULL"); the row itself is removed later by crud.sweep_tasks.
+    deleted_at = Column(DateTime)
+    #Rows of this table are never archived ones (see ArchivedTask); schemas.TaskResponse reads this attribute.
+    archived = False
+
+    #Composite indexes backing the paginated task list (crud.get_tasks).
+    #All of them start with owner_id: a query only ever reads one user's slice of the index,
+    #so its cost depends on that user's task count, not on the size of the whole table.
+    #Each one matches a "WHERE owner_id = ? AND <filter> AND (sort key) > :cursor ORDER BY <sort key>" query shape,
+    #so the DB can jump straight to the cursor position instead of scanning/sorting the table.
+    #They are partial indexes over active rows only (WHERE deleted_at IS NULL, see ACTIVE_TASKS):
+    #deleted tasks waiting for the sweep don't take up space in them.
+    # -> (owner_id, id): a user's tasks ordered by id (also single-task lookups by id + owner).
+    # -> (owner_id, status, id): list tasks by status, ordered by id.
+    # -> (owner_id, due_date, id): list/range-filter by due date, ordered by due date.
+    # -> (owner_id, status, due_date, id): both at once, e.g. "pending tasks due this week".
+    # -> (owner_id, title) with text_pattern_ops: lets PostgreSQL use a B-tree for "title LIKE 'prefix%'" in any locale.
+    #And the indexes that aren't per user, each one small because of its WHERE:
+    # -> (due_date) of open tasks only: the reminder scheduler (jobs.schedule_reminders) finds
+    #    "not done, due in the next days" across all users without reading done tasks or the rest of the table.
+    # -> (due_date) of done tasks only: the archive sweep (crud.sweep_tasks) finds done tasks due before its cutoff.
+    # -> (id) of deleted tasks only: the sweep finds the rows it has to remove.
+    __table_args__ = (
+        Index("ix_tasks_owner_id_id", "owner_id", "id", **active_only()),
+        Index("ix_tasks_owner_id_status_id", "owner_id", "status", "id", **active_only()),
+        Index("ix_tasks_owner_id_due_date_id", "owner_id", "due_date", "id", **active_only()),
+        Index("ix_tasks_owner_id_status_due_date_id", "owner_id", "status", "due_date", "id", **active_only()),
+        Index(
+            "ix_tasks_owner_id_title_pattern", "owner_id", "title",
+            postgresql_ops={"title": "text_pattern_ops"}, **active_only(),
+        ),
+        Index("ix_tasks_open_due_date", "due_date", **active_only("status <> 'done'")),
+        Index("ix_tasks_done_due_date", "due_date", **active_only("status = 'done'")),
+        Index(
+            "ix_tasks_deleted", "id",
+            postgresql_where=text("deleted_at IS NOT NULL"), sqlite_where=text("deleted_at IS NOT NULL"),
+        ),
+    )
+
+#Full-text search index over title + description (used by crud.search_tasks).
+#The index is dialect specific, so it is created with raw DDL right after the tasks table:
+# -> PostgreSQL: a generated tsvector column (title weighted above description) with a GIN index.
+#    The DB keeps it up to date on every INSERT/UPDATE, no application code involved.
+# -> SQLite: an FTS5 virtual table that mirrors tasks (external content, so text isn't stored twice),
+#    kept in sync by triggers.
+TASK_SEARCH_DDL = {
+    "postgresql": [
+        "ALTER TABLE tasks ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+        "CREATE INDEX ix_tasks_search_vector ON tasks USING GIN (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE tasks_fts USING fts5(title, description, content='tasks', content_rowid='id')",
+        "CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+        "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+        "CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+        "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+        "CREATE TRIGGER tasks_fts_update AFTER UPDATE OF title, description ON tasks BEGIN "
+        "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    ],
+}
+for dialect, statements in TASK_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(Task.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
+#The FTS5 table isn't part of the metadata, so drop it together with tasks
+event.listen(Task.__table__, "before_drop", DDL("DROP TABLE IF EXISTS tasks_fts").execute_if(dialect="sqlite"))
+
+#Summary table behind GET /tasks/stats: how many of a user's tasks have a given (status, due_date).
+#Kept up to date by every crud function that writes tasks, in the same transaction as the write
+#(crud.apply_stats_deltas), so the stats never need a scan of the tasks table.
+#A user has one row per distinct (status, due_date) pair, however many tasks they have.
+#NULL status / due_date are stored as crud.NO_STATUS / crud.NO_DUE_DATE so they can be part of the primary key.
+class TaskStat(Base):
+    __tablename__ = "task_stats"
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, primary_key=True)
+    due_date = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+#Background jobs (app/jobs.py), stored in the DB so queued work survives restarts.
+#kind: which handler runs it, e.g. "task_reminder". payload: its JSON arguments.
+#status: queued -> running -> done, or back to queued for a retry, or failed after max_attempts.
+#run_at: not before this time (UTC); retries are pushed back with exponential backoff.
+#locked_until: while running, the worker's lease. A job still "running" after that (worker crashed) is queued again.
+#dedupe_key: optional unique key, so the same job can't be enqueued twice (e.g. one reminder per task and due date).
+#Index (status, run_at): the worker's "next queued jobs that are due" query.
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False)
+    locked_until = Column(DateTime)
+    last_error = Column(String)
+    dedupe_key = Column(String, unique=True)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
+
+#Tokens revoked before they expire (logout, used refresh tokens), identified by their "jti" claim.
+#token_type "access": checked against an in-memory copy (auth.revoked_tokens) that each process re-reads
+#from here periodically, by revoked_at. token_type "refresh": checked here directly (refreshes are rare).
+#Rows are useless once the token has expired anyway (expires_at), and are purged then.
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    jti = Column(String, primary_key=True)
+    token_type = Column(String, nullable=False, default="access")
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, nullable=False, index=True)
+
+#Change log behind the real-time feed (GET /tasks/changes, WebSocket /tasks/changes/ws, see app/changes.py).
+#crud adds one row per created/updated/deleted/archived task, in the same transaction as the change itself.
+#seq: global, increasing change number. Clients resume from the last seq they saw and get everything after it.
+#sqlite_autoincrement: SQLite would otherwise reuse numbers after the newest rows are purged.
+#The task's data isn't copied here: the feed joins the task's current state when it reads the log.
+#Old rows are purged after CHANGES_RETENTION_HOURS (changes.purge_task_changes).
+#Index (owner_id, seq): "this user's changes after seq N", the feed's only query.
+class TaskChange(Base):
+    __tablename__ = "task_changes"
+    seq = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # created / updated / deleted / archived
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_task_changes_owner_id_seq", "owner_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+#Idempotency keys for POST /tasks/ (crud.create_task_idempotent).
+#A client sends the same Idempotency-Key header with every retry of one create; the first request stores
+#the task it created here, in the same transaction, and retries get that stored response back.
+#Primary key (owner_id, key): keys are per user, and two concurrent requests with the same key can't both insert.
+#request_hash: hash of the request body, so reusing a key for a different task is refused.
+#Rows expire after IDEMPOTENCY_TTL_HOURS (index on expires_at, for the purge).
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    response = Column(JSON)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+#Archive of old finished tasks, so the tasks table (and its indexes) only holds the working set.
+#crud.sweep_tasks moves done tasks whose due date is more than ARCHIVE_AFTER_DAYS in the past here, in batches.
+#Rows keep their id, so GET /tasks/{id}?include_archived=true still finds them. Archived tasks are read-only
+#and still count in /tasks/stats (their task_stats counts are left as they were).
+#Indexes mirror the task list's: (owner_id, id) and (owner_id, due_date, id), for ?include_archived=true.
+class ArchivedTask(Base):
+    __tablename__ = "archived_tasks"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String)
+    description = Column(String)
+    due_date = Column(Date)
+    status = Column(String)
+    version = Column(Integer, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    archived_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_archived_tasks_owner_id_id", "owner_id", "id"),
+        Index("ix_archived_tasks_owner_id_due_date_id", "owner_id", "due_date", "id"),
+    )
 
 class User(Base):
     #table name in the database
@@ -0,0 +1,166 @@
+#Admission control: per-client rate limits and a global cap on requests in flight.
+#Registered in main.py with @app.middleware("http"), in front of everything else, so a rejected request
+#costs a dict lookup instead of a DB query or a bcrypt hash.
+# -> Rate limits: a token bucket per client (the user of a valid access token, otherwise the client IP) and route.
+#    Each bucket holds up to `burst` requests and refills at `rate` requests per second. Empty bucket: 429.
+# -> In-flight cap: at most MAX_IN_FLIGHT requests are handled at once per process. Beyond that: 503.
+#    Latency stays bounded under overload: excess requests are refused right away instead of queueing.
+#Both answers carry Retry-After (seconds).
+#RATE_LIMIT_BACKEND=memory (default, per process) or redis (buckets shared by all processes, via REDIS_URL).
+from collections import OrderedDict, namedtuple
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from . import auth, database, metrics
+from .cache import REDIS_URL
+
+RATE_LIMIT_ENABLED = database.env_bool("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+#Requests handled at once by this process before new ones get a 503; 0 = no cap
+MAX_IN_FLIGHT = database.env_int("MAX_IN_FLIGHT", 256)
+#Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+TRUST_FORWARDED_FOR = database.env_bool("TRUST_FORWARDED_FOR", False)
+
+#rate: requests per second refilled; burst: bucket size (requests allowed back to back).
+Limit = namedtuple("Limit", "rate burst")
+
+#Limit for every route without its own entry in ROUTE_LIMITS. These routes share one bucket per client.
+DEFAULT_LIMIT = Limit(float(os.getenv("RATE_LIMIT_RATE", 20)), database.env_int("RATE_LIMIT_BURST", 40))
+
+#Tighter limits for expensive routes, by (method, path). Each gets its own bucket per client.
+ROUTE_LIMITS = {
+    #bcrypt: ~12 attempts a minute per client
+    ("POST", "/login"): Limit(0.2, 10),
+    ("POST", "/register"): Limit(0.1, 5),
+    ("POST", "/token/refresh"): Limit(1, 10),
+    #Full exports and bulk writes touch many rows per request
+    ("GET", "/tasks/export"): Limit(0.2, 2),
+    ("POST", "/tasks/bulk"): Limit(1, 5),
+    ("PATCH", "/tasks/bulk"): Limit(1, 5),
+    ("DELETE", "/tasks/bulk"): Limit(1, 5),
+    ("GET", "/tasks/search"): Limit(5, 20),
+    #Reconnect storms: a feed should connect once and then stay open
+    ("GET", "/tasks/changes"): Limit(0.5, 5),
+}
+
+#Never limited, so monitoring keeps working while the service sheds load
+EXEMPT_PREFIXES = ("/metrics",)
+
+rate_limited_total = metrics.Counter("rate_limited_total", "Requests rejected by admission control.", ("route", "reason"))
+metrics.REGISTRY.append(rate_limited_total)
+
+#In-process token buckets: key -> (tokens, last update). Bounded like cache.TTLCache: the least recently
+#used buckets are dropped first (a dropped bucket just starts full again).
+class MemoryBuckets:
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    #Take one token from the bucket. Returns 0 if the request may proceed, else the seconds until a token is available.
+    def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - last) * limit.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / limit.rate
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+#Token buckets on a Redis-compatible server, shared by every process.
+#client: anything with eval(script, numkeys, *keys_and_args), e.g. redis.Redis.
+#The refill-and-take runs as one Lua script, so it is atomic across processes.
+#Buckets expire on the server once they would be full again.
+class RedisBuckets:
+    SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key: str, limit: Limit) -> float:
+        return float(self.client.eval(self.SCRIPT, 1, f"{self.prefix}{key}", limit.rate, limit.burst, time.time()))
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+#Creates the bucket store for the configured backend.
+def make_buckets():
+    if RATE_LIMIT_BACKEND == "redis":
+        #redis is optional (only needed with RATE_LIMIT_BACKEND=redis), so it is only imported here
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+        return RedisBuckets(redis.Redis.from_url(REDIS_URL))
+    return MemoryBuckets()
+
+buckets = make_buckets()
+in_flight = 0
+
+#Who is asking: "user:<name>" for a valid access token, else "ip:<address>".
+#The token is verified (an HMAC check, no DB), so nobody can spend another user's budget.
+def client_key(request) -> str:
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            return f"user:{auth.decode_token(authorization[7:], 'access')['sub']}"
+        except HTTPException:
+            pass
+    if TRUST_FORWARDED_FOR and request.headers.get("x-forwarded-for"):
+        return f"ip:{request.headers['x-forwarded-for'].split(',')[0].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def reject(status_code: int, detail: str, retry_after: float, route: str, reason: str):
+    rate_limited_total.inc(route=route, reason=reason)
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+    return JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+
+#HTTP middleware body (registered in main.py with @app.middleware("http")).
+async def admission_middleware(request, call_next):
+    global in_flight
+    path = request.url.path
+    if path.startswith(EXEMPT_PREFIXES):
+        return await call_next(request)
+    route = (request.method, path)
+    route_name = f"{request.method} {path}" if route in ROUTE_LIMITS else "default"
+    if MAX_IN_FLIGHT and in_flight >= MAX_IN_FLIGHT:
+        return reject(503, "Server busy, try again", 1, route_name, "in_flight")
+    if RATE_LIMIT_ENABLED:
+        limit = ROUTE_LIMITS.get(route, DEFAULT_LIMIT)
+        wait = buckets.take(f"{route_name}:{client_key(request)}", limit)
+        if wait > 0:
+            return reject(429, "Too many requests", wait, route_name, "rate")
+    in_flight += 1
+    try:
+        return await call_next(request)
+    finally:
+        in_flight -= 1
@@ -0,0 +1,37 @@
+#Fast JSON response path (opt-in with FAST_JSON=true).
+#The normal path for a list page is: rows -> one Pydantic model per item (response_model validation) -> JSON.
+#For data that comes straight from our own DB columns that validation only costs time, so with FAST_JSON on:
+# -> ORJSONResponse is the app's default response class (orjson encodes dates and ints natively, in C),
+# -> list endpoints hand their row dicts to fast_json(), which skips the response_model validation entirely.
+#The response_model declarations stay, so the OpenAPI docs don't change.
+from fastapi.responses import JSONResponse
+
+from .database import env_bool
+
+#orjson is optional: only needed with FAST_JSON=true
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON = env_bool("FAST_JSON", False)
+if FAST_JSON and orjson is None:
+    raise RuntimeError("FAST_JSON=true requires the 'orjson' package")
+
+#JSONResponse encoded with orjson.
+#OPT_NON_STR_KEYS: allows dicts with non-string keys, like the stdlib encoder does.
+#default=str: anything orjson doesn't know natively (e.g. Decimal) is sent as a string.
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+#Response class for FastAPI(default_response_class=...)
+DEFAULT_RESPONSE_CLASS = ORJSONResponse if FAST_JSON else JSONResponse
+
+#Return value for an endpoint whose content is already plain dicts/lists built from DB rows.
+#FAST_JSON on: a ready ORJSONResponse, so FastAPI skips validating it against the response_model.
+#FAST_JSON off: the content itself, validated and serialized by FastAPI as usual.
+def fast_json(content):
+    if FAST_JSON:
+        return ORJSONResponse(content)
+    return content
@@ -1,8 +1,9 @@
 #Imports BaseModel from Pydantic.
 #BaseModel is used to define data schemas with validation for request/response bodies.
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, field_validator
 #Imports the date type from Python's datetime module. Used to validate and represent date fields, like due_date
 from datetime import date
+from typing import Optional
 
 #Defines a base schema for a task. All other schemas will inherit from this
 #fields expected in a task:
@@ -33,8 +34,103 @@ class TaskUpdate(TaskBase):
 #But when sending a response from your API (e.g., after creating or reading a task), the task will also include the id that the database generated.
 
 #When returning this task as a response, you want to include the id, so the client knows which task it is referring to. That's why TaskResponse adds id: int to extend TaskBase
+#version is the optimistic concurrency counter (see TaskPatch).
+#archived: the task was moved to the archive (only listed with ?include_archived=true); archived tasks are read-only.
+#from_attributes=True tells Pydantic to read data not just from dicts, but also from ORM objects like
+#SQLAlchemy models (task.title instead of task["title"]). Necessary when returning a models.Task from a route.
 class TaskResponse(TaskBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
+    version: int = 1
+    archived: bool = False
+
+#Partial updates may leave a task field out, but not set it to null:
+#a task always has a title, description, due date and status (TaskResponse requires them).
+def reject_null(value):
+    if value is None:
+        raise ValueError("may be omitted, but not null")
+    return value
+
+#Used for partial updates (PATCH /tasks/{task_id}).
+#Every field is optional: only the fields present in the JSON are changed.
+#An explicit null is a 422 (reject_null); leave the field out instead.
+#version: optional, the version the client last read. If the task changed since, the PATCH fails with 409.
+class TaskPatch(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    due_date: Optional[date] = None
+    status: Optional[str] = None
+    version: Optional[int] = None
+
+    @field_validator("title", "description", "due_date", "status")
+    @classmethod
+    def not_null(cls, value):
+        return reject_null(value)
+
+#One page of a task list.
+#items: the tasks on this page.
+#next_cursor: opaque string to pass back as ?cursor=... to get the next page; null on the last page.
+class TaskPage(BaseModel):
+    items: list[TaskResponse]
+    next_cursor: Optional[str] = None
+
+#One hit of GET /tasks/search: the task plus its relevance score (higher is a better match).
+class TaskSearchResult(TaskResponse):
+    score: float
+
+#One page of search results, best matches first.
+#next_offset: pass back as ?offset=... to get the next page; null on the last page.
+class TaskSearchPage(BaseModel):
+    items: list[TaskSearchResult]
+    next_offset: Optional[int] = None
+
+#GET /tasks/stats
+#total: number of tasks.
+#by_status: task count per status.
+#overdue: open (not done) tasks whose due date has passed.
+#due: open tasks by due date: overdue, today, next_7_days, later, no_due_date.
+#by_due_month: all tasks by month of their due date, e.g. {"2025-05": 12}.
+class TaskStats(BaseModel):
+    total: int
+    by_status: dict[str, int]
+    overdue: int
+    due: dict[str, int]
+    by_due_month: dict[str, int]
+
+#Bulk endpoints
+#One item of PATCH /tasks/bulk: the id of the task plus only the fields to change.
+#Fields left out of the JSON are not touched; an explicit null makes the item an error (see TaskPatch).
+class TaskBulkUpdate(BaseModel):
+    id: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    due_date: Optional[date] = None
+    status: Optional[str] = None
+
+    @field_validator("title", "description", "due_date", "status")
+    @classmethod
+    def not_null(cls, value):
+        return reject_null(value)
+
+#Body of DELETE /tasks/bulk.
+class TaskBulkDelete(BaseModel):
+    ids: list[int]
+
+#A single item that failed inside a bulk request.
+#index: position of the item in the request array.
+#id: the task id, when the item had one.
+#detail: what went wrong.
+class BulkItemError(BaseModel):
+    index: int
+    id: Optional[int] = None
+    detail: str
+
+#Result of a bulk request: ids of the tasks that were created/updated/deleted, and per-item errors.
+#A bulk request never fails as a whole because of a single bad item.
+class BulkResult(BaseModel):
+    ids: list[int] = []
+    errors: list[BulkItemError] = []
 
 #Input Schema (for registration/login)
 #used for incoming requests — when a client sends user registration or login data.
@@ -49,10 +145,25 @@ class UserCreate(BaseModel):
 #ending user data back to the client (e.g., after registering or fetching a profile).
 #Includes the user's id and username
 #Excludes the password for security reasons
+#from_attributes=True: can be built from a models.User (see TaskResponse).
 class User(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     username: str
 
-#This tells Pydantic to read data not just from dicts, but also from ORM objects like SQLAlchemy models.Necessary when returning SQLAlchemy model instances (e.g., Task) in responses.
-class Config:
-    orm_mode = True
\ No newline at end of file
+#Tokens returned by /login and /token/refresh.
+#access_token: send as "Authorization: Bearer ..." on every request; expires after expires_in seconds.
+#refresh_token: send to /token/refresh for a new pair. Works only once.
+class TokenPair(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+#Body of /token/refresh, and optionally of /logout (to revoke the refresh token too).
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
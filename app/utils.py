@@ -1,12 +1,24 @@
 #Imports CryptContext from the passlib library.
 #CryptContext lets you configure how passwords are hashed and verified — it abstracts away hashing algorithms like bcrypt, argon2, etc.
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import asyncio
+import base64
+import json
+import os
+import threading
 
 #Password Hasher Configuration
+#BCRYPT_ROUNDS: bcrypt cost factor. Each +1 doubles the CPU time per hash/verify (12 ≈ 200-300 ms on a typical core).
+#Size it together with PASSWORD_HASH_WORKERS against the hardware.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
 #Creates a password hashing context using the bcrypt algorithm.
 #"bcrypt" is a secure and well-tested algorithm ideal for storing passwords.
 #"deprecated='auto'" ensures old algorithms (if used) can be flagged or migrated automatically.
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+#Existing hashes keep working when the rounds change: the cost is stored inside each hash.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 #Securely Hashes Plain Text Passwords
 #Takes a plain-text password (e.g., from registration).
@@ -21,4 +33,93 @@ def hash_password(password: str) -> str:
 #Verifies if the input matches the hash.
 #Returns True if they match, False otherwise.
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+#Password hashing pool
+#bcrypt burns CPU for hundreds of milliseconds per call. Running it inline (or in the shared threadpool)
+#lets a burst of logins starve every other endpoint.
+#Instead, hashes run in a dedicated, fixed-size thread pool (bcrypt releases the GIL, so threads run in parallel):
+#PASSWORD_HASH_WORKERS: how many hashes run at the same time (default: number of CPUs).
+#PASSWORD_HASH_MAX_PENDING: how many calls may be running or queued; beyond that we fail fast with
+#PasswordHasherBusy (a 503 for the client) instead of letting the queue, and everyone's latency, grow.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 4))
+
+#Raised when the password hashing pool is saturated.
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasherPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    #Runs fn(*args) in the pool and awaits the result.
+    #Raises PasswordHasherBusy right away if max_pending calls are already running or waiting.
+    async def run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+password_hasher = PasswordHasherPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+#Async versions of hash_password / verify_password for request handlers.
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
+
+#Opaque pagination cursors
+#A cursor remembers where the previous page stopped (the sort key of its last row).
+#It is JSON encoded with base64 so clients treat it as an opaque string and just send it back.
+#Example: {"s": "due_date", "o": "asc", "k": ["2025-05-17", 42]} -> "eyJzIjogImR1ZV9kYXRlIi..."
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+#Reverses encode_cursor.
+#Raises ValueError if the cursor was tampered with or is not one of ours.
+def decode_cursor(cursor: str) -> dict:
+    try:
+        #Restores the "=" padding stripped by encode_cursor
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor")
+    return data
+
+
+#HTTP conditional requests
+#True if an If-None-Match header value matches the current ETag.
+#Handles lists ('"a", "b"'), weak validators (W/"a") and "*".
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or any(value.removeprefix("W/") == etag.removeprefix("W/") for value in candidates)
+
+#HTTP dates (Last-Modified / If-Modified-Since) <-> naive UTC datetimes.
+def http_date(value: datetime) -> str:
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+#None for a missing or malformed header
+def parse_http_date(value: str):
+    try:
+        return parsedate_to_datetime(value).astimezone(timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+#Timestamps stored in the DB (jobs, revoked tokens) are naive UTC, the same on every DB
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,53 @@
+#Helpers shared by the benchmark scripts.
+import os
+import sys
+import tempfile
+
+#Makes "import app" work when a script is run as python benchmarks/<script>.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+#In-process benchmarks default to a throwaway SQLite file.
+#Must run before app.database is imported (it reads DATABASE_URL at import time).
+#The benchmark clients all share one IP and a few users, so the rate limiter is off unless asked for.
+#The schema comes from the migrations (the app no longer creates tables itself), so they are applied here.
+def use_scratch_database():
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    from app import database
+    database.migrate()
+
+#Nearest-rank percentile (pct in 0-100) of a list of numbers.
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+#Summary of one scenario: latency percentiles in milliseconds, throughput and status code counts.
+#ok_*: the same percentiles over accepted requests (status < 400) only. Rejections (429/503) return
+#in microseconds, so when many requests are shed the overall percentiles say little about the real work.
+def summarize(latencies: list, statuses: list, elapsed: float) -> dict:
+    ms = [value * 1000 for value in latencies]
+    ok = [value for value, status in zip(ms, statuses) if status < 400]
+    return {
+        "requests": len(ms),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "ok_requests": len(ok),
+        "ok_p50_ms": round(percentile(ok, 50), 3),
+        "ok_p99_ms": round(percentile(ok, 99), 3),
+        "req_per_s": round(len(ms) / elapsed, 1) if elapsed else 0.0,
+        "statuses": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+    }
+
+def format_summary(name: str, summary: dict) -> str:
+    line = (f"{name:<14} n={summary['requests']:<6} p50={summary['p50_ms']:8.2f}ms p95={summary['p95_ms']:8.2f}ms "
+            f"p99={summary['p99_ms']:8.2f}ms {summary['req_per_s']:9.1f} req/s statuses={summary['statuses']}")
+    if summary["ok_requests"] != summary["requests"]:
+        line += (f"\n{'':<14} accepted only: n={summary['ok_requests']} p50={summary['ok_p50_ms']:.2f}ms "
+                 f"p99={summary['ok_p99_ms']:.2f}ms")
+    return line
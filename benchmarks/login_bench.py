@@ -0,0 +1,67 @@
+#Login latency under concurrent load.
+#Fires CONCURRENCY simultaneous /login requests (bcrypt verify) while another client hits a cheap
+#endpoint, and prints p50/p95/p99 for both. Shows that login latency is bounded by the password hashing pool
+#and that the rest of the API keeps responding meanwhile.
+#The pool is sized explicitly (--workers, --max-pending) instead of by the machine's CPU count: by default
+#every login is admitted (max pending = concurrency), so the login percentiles are those of real bcrypt work.
+#Lower --max-pending to see load shedding; the 503s are then reported apart from the accepted logins.
+#
+#Usage:
+#   python benchmarks/login_bench.py --logins 200 --concurrency 50 --workers 4
+#   BCRYPT_ROUNDS=10 python benchmarks/login_bench.py --max-pending 8
+import argparse
+import asyncio
+import os
+import time
+
+from common import format_summary, summarize, use_scratch_database
+
+#Use a throwaway SQLite file unless DATABASE_URL is given explicitly
+use_scratch_database()
+
+import httpx
+from app import utils
+from app.main import app
+
+async def timed(client, method, url, results, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    results.append((time.perf_counter() - start, response.status_code))
+
+async def main(logins: int, concurrency: int, workers: int, max_pending: int):
+    utils.password_hasher = utils.PasswordHasherPool(workers, max_pending)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"username": "bench", "password": "bench-password"}
+        await client.post("/register", json=credentials)
+
+        login_results, other_results = [], []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def login():
+            async with semaphore:
+                await timed(client, "POST", "/login", login_results, json=credentials)
+
+        async def other():
+            for _ in range(logins // 2):
+                await timed(client, "GET", "/metrics/db", other_results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)), other())
+        elapsed = time.perf_counter() - start
+
+    print(f"{logins} logins, concurrency {concurrency}, {workers} hash workers, max pending {max_pending}, "
+          f"{elapsed:.2f}s total")
+    for name, results in (("login", login_results), ("GET /metrics/db", other_results)):
+        latencies, statuses = zip(*results)
+        print(format_summary(name, summarize(list(latencies), list(statuses), elapsed)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    #Default: room for every concurrent login, so none is shed
+    parser.add_argument("--max-pending", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.concurrency, args.workers, args.max_pending or args.concurrency))
@@ -0,0 +1,208 @@
+#Benchmark suite for the task API.
+#Seeds users and tasks, then drives the main routes with concurrent clients and reports
+#p50/p95/p99 latency and req/s per scenario. Results can be saved as a JSON baseline and later runs
+#compared against it, so regressions in crud, auth or serialization show up before deployment.
+#
+#By default everything runs in-process (httpx + ASGI transport) against a scratch SQLite file:
+#no server or network, so the numbers measure the app itself (routing, auth, crud, DB, serialization).
+#Use --base-url to benchmark a running server instead, e.g. uvicorn with the docker-compose PostgreSQL.
+#
+#Usage:
+#   python benchmarks/run.py --tasks 10000 --requests 500 --concurrency 20 --save benchmarks/baseline.json
+#   python benchmarks/run.py --compare benchmarks/baseline.json          # exits 1 on regression
+#   python benchmarks/run.py --base-url http://localhost:8000 --scenarios list get patch
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import time
+
+from common import format_summary, summarize, use_scratch_database
+
+import httpx
+
+PASSWORD = "bench-password"
+SEED_CHUNK = 5000
+
+#Creates the benchmark users and their tasks through the API itself (POST /tasks/bulk),
+#so seeding works the same in-process and against a remote server.
+#Returns {"headers": [...auth headers per user], "task_ids": {user index: [ids]}}.
+async def seed(client, users: int, tasks: int) -> dict:
+    run_id = random.randrange(1 << 30)
+    headers, task_ids = [], {}
+    for user_index in range(users):
+        credentials = {"username": f"bench-{run_id}-{user_index}", "password": PASSWORD}
+        await client.post("/register", json=credentials)
+        token = (await client.post("/login", json=credentials)).json()["access_token"]
+        headers.append({"Authorization": f"Bearer {token}"})
+        task_ids[user_index] = []
+
+    #Spread tasks evenly over the users
+    for start in range(0, tasks, SEED_CHUNK):
+        count = min(SEED_CHUNK, tasks - start)
+        for user_index in range(users):
+            items = [
+                {
+                    "title": f"Task {start + i}",
+                    "description": "Seeded by benchmarks/run.py",
+                    "due_date": f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}",
+                    "status": "done" if i % 3 == 0 else "pending",
+                }
+                for i in range(user_index, count, users)
+            ]
+            if items:
+                response = await client.post("/tasks/bulk", json=items, headers=headers[user_index])
+                task_ids[user_index].extend(response.json()["ids"])
+    return {"headers": headers, "task_ids": task_ids}
+
+#Each scenario is a function (client, data, n) -> (method, url, kwargs) for the n-th request.
+def scenario_create(data, n):
+    user = n % len(data["headers"])
+    body = {"title": f"Bench {n}", "description": "created", "due_date": "2025-06-01"}
+    return "POST", "/tasks/", {"json": body, "headers": data["headers"][user]}
+
+def scenario_list(data, n):
+    user = n % len(data["headers"])
+    return "GET", "/tasks/", {"params": {"limit": 50}, "headers": data["headers"][user]}
+
+def scenario_list_filtered(data, n):
+    user = n % len(data["headers"])
+    params = {"limit": 50, "status": "pending", "sort": "due_date", "due_from": "2025-03-01"}
+    return "GET", "/tasks/", {"params": params, "headers": data["headers"][user]}
+
+def scenario_search(data, n):
+    user = n % len(data["headers"])
+    params = {"q": f"task {n % 100}", "limit": 20}
+    return "GET", "/tasks/search", {"params": params, "headers": data["headers"][user]}
+
+def scenario_stats(data, n):
+    return "GET", "/tasks/stats", {"headers": data["headers"][n % len(data["headers"])]}
+
+def scenario_get(data, n):
+    user = n % len(data["headers"])
+    ids = data["task_ids"][user]
+    return "GET", f"/tasks/{ids[n % len(ids)]}", {"headers": data["headers"][user]}
+
+def scenario_patch(data, n):
+    user = n % len(data["headers"])
+    ids = data["task_ids"][user]
+    body = {"status": "done" if n % 2 else "pending"}
+    return "PATCH", f"/tasks/{ids[n % len(ids)]}", {"json": body, "headers": data["headers"][user]}
+
+def scenario_put(data, n):
+    user = n % len(data["headers"])
+    ids = data["task_ids"][user]
+    body = {"title": f"Updated {n}", "description": "put", "due_date": "2025-07-01", "status": "pending"}
+    return "PUT", f"/tasks/{ids[n % len(ids)]}", {"json": body, "headers": data["headers"][user]}
+
+def scenario_protected(data, n):
+    return "GET", "/protected", {"headers": data["headers"][n % len(data["headers"])]}
+
+def scenario_login(data, n):
+    return "POST", "/login", {"json": {"username": data["login_username"], "password": PASSWORD}}
+
+SCENARIOS = {
+    "create": scenario_create,
+    "list": scenario_list,
+    "list_filtered": scenario_list_filtered,
+    "search": scenario_search,
+    "stats": scenario_stats,
+    "get": scenario_get,
+    "patch": scenario_patch,
+    "put": scenario_put,
+    "protected": scenario_protected,
+    "login": scenario_login,
+}
+
+#Runs `requests` requests of one scenario with `concurrency` workers pulling from a shared counter.
+async def run_scenario(client, scenario, data, requests: int, concurrency: int) -> dict:
+    counter = itertools.count()
+    latencies, statuses = [], []
+
+    async def worker():
+        while (n := next(counter)) < requests:
+            method, url, kwargs = scenario(data, n)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+#Compares results with a saved baseline.
+#A scenario regresses when its p95 grew, or its req/s dropped, by more than `tolerance` (0.2 = 20%).
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["req_per_s"] < previous["req_per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: req/s {previous['req_per_s']} -> {current['req_per_s']}")
+    return regressions
+
+async def main(args) -> int:
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        use_scratch_database()
+        from app.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+    async with client:
+        start = time.perf_counter()
+        data = await seed(client, args.users, args.tasks)
+        print(f"seeded {args.users} users / {args.tasks} tasks in {time.perf_counter() - start:.1f}s")
+        #Login scenario user: its own account so the password is known
+        data["login_username"] = f"bench-login-{random.randrange(1 << 30)}"
+        await client.post("/register", json={"username": data["login_username"], "password": PASSWORD})
+
+        results = {}
+        for name in args.scenarios:
+            results[name] = await run_scenario(client, SCENARIOS[name], data, args.requests, args.concurrency)
+            print(format_summary(name, results[name]))
+
+    report = {
+        "meta": {
+            "target": args.base_url or "in-process",
+            "users": args.users,
+            "tasks": args.tasks,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"saved {args.save}")
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"no regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--tasks", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
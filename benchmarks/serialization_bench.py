@@ -0,0 +1,90 @@
+#Serialization cost of a task list page, with and without the fast JSON path (app/responses.py).
+#Part 1 times only the encoding of one page of tasks, three ways:
+# -> orm+validate:  ORM objects -> TaskPage validation (from_attributes) -> JSON  (the old list path)
+# -> rows+validate: row dicts -> TaskPage validation -> JSON                        (FAST_JSON off)
+# -> rows+orjson:   row dicts -> orjson                                             (FAST_JSON on)
+#Part 2 times GET /tasks/ end to end in-process, with FAST_JSON off and on.
+#
+#Usage:
+#   python benchmarks/serialization_bench.py --page 200 --rounds 500
+import argparse
+import asyncio
+import time
+
+from common import format_summary, summarize, use_scratch_database
+
+#Use a throwaway SQLite file unless DATABASE_URL is given explicitly
+use_scratch_database()
+
+import httpx
+from pydantic import TypeAdapter
+from app import crud, database, models, responses, schemas
+from app.main import app
+
+PASSWORD = "bench-password"
+
+#Mean microseconds per call of fn over `rounds` calls.
+def time_per_call(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1_000_000
+
+def encoding_benchmark(owner_id: int, page: int, rounds: int):
+    page_adapter = TypeAdapter(schemas.TaskPage)
+    with database.SessionLocal() as db:
+        orm_tasks = db.query(models.Task).filter(models.Task.owner_id == owner_id, crud.ACTIVE).order_by(models.Task.id).limit(page).all()
+        rows, _ = crud.get_tasks(db, owner_id, limit=page)
+    cases = {
+        "orm+validate": lambda: page_adapter.dump_json(
+            page_adapter.validate_python({"items": orm_tasks, "next_cursor": None}, from_attributes=True)
+        ),
+        "rows+validate": lambda: page_adapter.dump_json(page_adapter.validate_python({"items": rows, "next_cursor": None})),
+    }
+    if responses.orjson is not None:
+        cases["rows+orjson"] = lambda: responses.ORJSONResponse({"items": rows, "next_cursor": None}).body
+    baseline = None
+    for name, fn in cases.items():
+        micros = time_per_call(fn, rounds)
+        baseline = baseline or micros
+        print(f"{name:<14} {micros:9.1f} us/page  x{baseline / micros:.1f}")
+
+async def endpoint_benchmark(headers: dict, page: int, rounds: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        modes = [False, True] if responses.orjson is not None else [False]
+        for fast in modes:
+            responses.FAST_JSON = fast
+            latencies, statuses = [], []
+            start = time.perf_counter()
+            for _ in range(rounds):
+                request_start = time.perf_counter()
+                response = await client.get("/tasks/", params={"limit": page}, headers=headers)
+                latencies.append(time.perf_counter() - request_start)
+                statuses.append(response.status_code)
+            print(format_summary(f"FAST_JSON={'on' if fast else 'off'}", summarize(latencies, statuses, time.perf_counter() - start)))
+
+async def main(args):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"username": f"bench-serialization-{time.time_ns()}", "password": PASSWORD}
+        await client.post("/register", json=credentials)
+        token = (await client.post("/login", json=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        items = [{"title": f"Task {i}", "description": "x" * 80, "due_date": "2025-06-01"} for i in range(args.page)]
+        await client.post("/tasks/bulk", json=items, headers=headers)
+    with database.SessionLocal() as db:
+        owner_id = crud.get_user_by_username(credentials["username"], db).id
+
+    if responses.orjson is None:
+        print("orjson is not installed: skipping the FAST_JSON cases")
+    print(f"encoding one page of {args.page} tasks ({args.rounds} rounds)")
+    encoding_benchmark(owner_id, args.page, args.rounds)
+    print(f"GET /tasks/?limit={args.page} ({args.rounds} requests)")
+    await endpoint_benchmark(headers, args.page, args.rounds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page", type=int, default=crud.MAX_PAGE_SIZE, help="tasks per page")
+    parser.add_argument("--rounds", type=int, default=300)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+#Cold-start cost of the app: how fast a new worker is ready to serve.
+#Part 1 imports app.main in a fresh Python process, `rounds` times, and reports the import time
+#(what every uvicorn worker pays before it can do anything).
+#Part 2 starts uvicorn in a subprocess, `rounds` times, and reports the time until the first
+#GET /metrics answers, plus the import/lifespan split the app itself exports (app_startup_*_seconds).
+#Both run against a scratch SQLite file that is migrated once up front, as a deploy would.
+#
+#Usage:
+#   python benchmarks/startup_bench.py --rounds 5
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from common import ROOT, percentile, use_scratch_database
+
+#Use a throwaway SQLite file unless DATABASE_URL is given explicitly
+use_scratch_database()
+
+import httpx
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def child_env() -> dict:
+    #The worker would only add noise to the measurement
+    return {**os.environ, "JOBS_ENABLED": "false", "PYTHONPATH": ROOT}
+
+def import_times(rounds: int) -> list:
+    return [
+        float(subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=child_env(), cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout)
+        for _ in range(rounds)
+    ]
+
+#Seconds from spawning uvicorn until GET /metrics answers, and the app's own startup gauges.
+def time_to_first_response(timeout: float = 30) -> tuple:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=child_env(), cwd=ROOT,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                response = httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            except httpx.TransportError:
+                time.sleep(0.005)
+                continue
+            elapsed = time.perf_counter() - start
+            gauges = {
+                line.split()[0]: float(line.split()[1])
+                for line in response.text.splitlines() if line.startswith("app_startup_")
+            }
+            return elapsed, gauges
+        raise RuntimeError("uvicorn did not answer in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+def describe(name: str, seconds: list) -> str:
+    ms = [value * 1000 for value in seconds]
+    return f"{name:<24} p50={percentile(ms, 50):8.1f}ms  max={max(ms):8.1f}ms  (n={len(ms)})"
+
+def main(args):
+    print(describe("import app.main", import_times(args.rounds)))
+    ready, imports, lifespans = [], [], []
+    for _ in range(args.rounds):
+        elapsed, gauges = time_to_first_response()
+        ready.append(elapsed)
+        imports.append(gauges.get("app_startup_import_seconds", 0.0))
+        lifespans.append(gauges.get("app_startup_lifespan_seconds", 0.0))
+    print(describe("uvicorn first response", ready))
+    print(describe("  of which app import", imports))
+    print(describe("  of which lifespan", lifespans))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    main(parser.parse_args())
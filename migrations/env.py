@@ -0,0 +1,51 @@
+#Alembic environment: how "alembic upgrade" / "alembic revision --autogenerate" reach the database.
+#The URL comes from sqlalchemy.url when set (database.migrate() passes one), else from DATABASE_URL, like the app.
+#target_metadata is the app's models, which --autogenerate compares against the database.
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from app import database, models  # noqa: F401 (models registers the tables on Base.metadata)
+
+config = context.config
+#Only configure logging when run from the alembic command line, not when the app migrates itself
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = database.Base.metadata
+
+#Schema objects created with raw DDL (models.TASK_SEARCH_DDL) aren't in the metadata:
+#leave them out of --autogenerate, or every new migration would try to drop them.
+def include_object(obj, name, type_, reflected, compare_to):
+    if type_ == "table" and name.startswith("tasks_fts"):
+        return False
+    if type_ in ("column", "index") and name in ("search_vector", "ix_tasks_search_vector"):
+        return False
+    return True
+
+def database_url() -> str:
+    return config.get_main_option("sqlalchemy.url") or database.DATABASE_URL
+
+#Offline mode (alembic upgrade head --sql): print the SQL instead of running it
+def run_migrations_offline():
+    context.configure(url=database_url(), target_metadata=target_metadata, literal_binds=True, render_as_batch=True,
+                      include_object=include_object)
+    with context.begin_transaction():
+        context.run_migrations()
+
+#Online mode: run the migrations over a short-lived connection (NullPool: nothing stays open afterwards).
+#render_as_batch: ALTER TABLE on SQLite is done by copying the table, which batch mode handles.
+def run_migrations_online():
+    connectable = create_engine(database_url(), poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True,
+                          include_object=include_object)
+        with context.begin_transaction():
+            context.run_migrations()
+    connectable.dispose()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
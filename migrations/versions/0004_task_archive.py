@@ -0,0 +1,74 @@
+"""soft delete and task archive
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+Adds tasks.deleted_at, rebuilds the per-user task indexes as partial indexes over active rows,
+and creates archived_tasks. On a big PostgreSQL table, consider building the new indexes by hand
+with CREATE INDEX CONCURRENTLY first: this migration locks tasks while it runs.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+ACTIVE = "deleted_at IS NULL"
+
+#name, columns, WHERE of the partial version (None: active rows only), extra options
+TASK_INDEXES = [
+    ("ix_tasks_owner_id_id", ["owner_id", "id"], None, {}),
+    ("ix_tasks_owner_id_status_id", ["owner_id", "status", "id"], None, {}),
+    ("ix_tasks_owner_id_due_date_id", ["owner_id", "due_date", "id"], None, {}),
+    ("ix_tasks_owner_id_status_due_date_id", ["owner_id", "status", "due_date", "id"], None, {}),
+    ("ix_tasks_owner_id_title_pattern", ["owner_id", "title"], None, {"postgresql_ops": {"title": "text_pattern_ops"}}),
+    ("ix_tasks_open_due_date", ["due_date"], "status <> 'done'", {}),
+]
+
+TASK_COLUMNS = "id, title, description, due_date, status, version, owner_id"
+
+
+def where(condition):
+    return {"postgresql_where": sa.text(condition), "sqlite_where": sa.text(condition)}
+
+
+def upgrade():
+    op.add_column("tasks", sa.Column("deleted_at", sa.DateTime(), nullable=True))
+    for name, columns, condition, options in TASK_INDEXES:
+        op.drop_index(name, table_name="tasks")
+        op.create_index(name, "tasks", columns, **options, **where(f"{condition} AND {ACTIVE}" if condition else ACTIVE))
+    op.create_index("ix_tasks_done_due_date", "tasks", ["due_date"], **where(f"status = 'done' AND {ACTIVE}"))
+    op.create_index("ix_tasks_deleted", "tasks", ["id"], **where("deleted_at IS NOT NULL"))
+
+    op.create_table(
+        "archived_tasks",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("due_date", sa.Date(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("owner_id", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["owner_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_archived_tasks_owner_id_id", "archived_tasks", ["owner_id", "id"])
+    op.create_index("ix_archived_tasks_owner_id_due_date_id", "archived_tasks", ["owner_id", "due_date", "id"])
+
+
+def downgrade():
+    #Archived tasks go back into tasks; soft-deleted ones are deleted for good
+    op.execute(f"INSERT INTO tasks ({TASK_COLUMNS}) SELECT {TASK_COLUMNS} FROM archived_tasks")
+    op.drop_table("archived_tasks")
+    op.execute("DELETE FROM tasks WHERE deleted_at IS NOT NULL")
+    op.drop_index("ix_tasks_deleted", table_name="tasks")
+    op.drop_index("ix_tasks_done_due_date", table_name="tasks")
+    for name, columns, condition, options in TASK_INDEXES:
+        op.drop_index(name, table_name="tasks")
+        op.create_index(name, "tasks", columns, **options, **(where(condition) if condition else {}))
+    #Not batch mode: recreating tasks would drop the SQLite full-text triggers (SQLite >= 3.35 can drop columns)
+    op.drop_column("tasks", "deleted_at")
@@ -1,8 +1,16 @@
+import asyncio
+import os
 import pytest
+
+# Cheap bcrypt rounds keep the auth tests fast; must be set before app.utils is imported
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Tests fire requests back to back; test_rate_limiting turns the limiter on where it is tested
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.database import Base, get_db
 from app.main import app
+from app import auth, cache, metrics
 from fastapi.testclient import TestClient
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -10,6 +18,7 @@ SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+metrics.instrument_engine(engine)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Create a new session for each test
@@ -39,9 +48,44 @@ def client(db_session):
     app.dependency_overrides[get_db] = override_get_db
     return TestClient(app)
 
-# Clear all tables before each test
+
+# For tests that run the app's real lifespan (with TestClient(app) as ...):
+# the engines point at a scratch SQLite file whatever DATABASE_URL (.env) says,
+# and the background loops (job worker, revocation sync, change feed purge) stay off.
+@pytest.fixture()
+def lifespan_database(tmp_path, monkeypatch):
+    from app import changes, database, jobs
+
+    async def idle(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    url = f"sqlite:///{tmp_path / 'lifespan.db'}"
+    monkeypatch.setattr(database, "DATABASE_URL", url)
+    monkeypatch.setattr(database, "MIGRATE_ON_STARTUP", False)
+    monkeypatch.setattr(database, "ASYNC_DB", False)
+    monkeypatch.setattr(jobs, "JOBS_ENABLED", False)
+    monkeypatch.setattr(auth.revoked_tokens, "run", idle)
+    monkeypatch.setattr(changes, "run", idle)
+    return url
+
+
+# A client logged in as a fresh user; the task routes require authentication
+@pytest.fixture()
+def auth_client(client):
+    credentials = {"username": "owner", "password": "owner-password"}
+    client.post("/register", json=credentials)
+    token = client.post("/login", json=credentials).json()["access_token"]
+    client.headers["Authorization"] = f"Bearer {token}"
+    return client
+
+
+# Clear all tables (and the caches in front of them) before each test
 @pytest.fixture(autouse=True)
 def clear_tables(db_session):
+    cache.user_cache.clear()
+    cache.task_cache.clear()
+    cache.idempotency_cache.clear()
+    auth.revoked_tokens.clear()
     for table in reversed(Base.metadata.sorted_tables):
         db_session.execute(table.delete())
     db_session.commit()
\ No newline at end of file
@@ -14,4 +14,154 @@ def test_register_user(client):
     assert response.status_code == 200
     data = response.json()
     assert data["username"] == "testuser_3"
-    assert "id" in data
\ No newline at end of file
+    assert "id" in data
+
+
+def test_login_and_protected_route(client):
+    client.post("/register", json={"username": "alice", "password": "secret"})
+    response = client.post("/login", json={"username": "alice", "password": "secret"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    response = client.get("/protected", headers={"Authorization": f"Bearer {token}"})
+    assert response.json() == {"message": "Hello, alice"}
+    assert client.post("/login", json={"username": "alice", "password": "wrong"}).status_code == 401
+
+
+def test_password_pool_sheds_load_when_saturated(client, monkeypatch):
+    from app import utils
+
+    monkeypatch.setattr(utils.password_hasher, "pending", utils.password_hasher.max_pending)
+    response = client.post("/login", json={"username": "nobody", "password": "x"})
+    # Unknown users never reach bcrypt
+    assert response.status_code == 401
+    response = client.post("/register", json={"username": "bob", "password": "secret"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_current_user_is_served_from_cache(client, monkeypatch):
+    from app import async_crud, cache
+
+    cache.user_cache.clear()
+    client.post("/register", json={"username": "carol", "password": "secret"})
+    token = client.post("/login", json={"username": "carol", "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/protected", headers=headers).status_code == 200
+
+    async def no_db(*args, **kwargs):
+        raise AssertionError("get_current_user should not query the DB on a cache hit")
+
+    monkeypatch.setattr(async_crud, "get_user_by_username", no_db)
+    assert client.get("/protected", headers=headers).json() == {"message": "Hello, carol"}
+
+
+def test_cache_backends():
+    from app.cache import RedisCache, TTLCache
+
+    lru = TTLCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    assert lru.get("b") is None and lru.get("a") == 1 and lru.get("c") == 3
+    assert TTLCache(ttl=-1).get("x") is None
+
+    class FakeRedis:
+        def __init__(self):
+            self.store = {}
+
+        def get(self, key):
+            return self.store.get(key)
+
+        def set(self, key, value, ex=None):
+            self.store[key] = value
+
+        def delete(self, key):
+            self.store.pop(key, None)
+
+    client = FakeRedis()
+    shared = RedisCache(client, prefix="user:")
+    shared.set("dave", {"id": 1, "username": "dave"})
+    assert "user:dave" in client.store
+    assert RedisCache(client, prefix="user:").get("dave") == {"id": 1, "username": "dave"}
+    shared.delete("dave")
+    assert shared.get("dave") is None
+
+
+def test_refresh_tokens_rotate_and_logout_revokes(client, db_session):
+    from app import auth
+    client.post("/register", json={"username": "dave", "password": "secret"})
+    tokens = client.post("/login", json={"username": "dave", "password": "secret"}).json()
+    assert tokens["expires_in"] == auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    # Access and refresh tokens can't stand in for each other
+    assert client.get("/protected", headers={"Authorization": f"Bearer {tokens['refresh_token']}"}).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": tokens["access_token"]}).status_code == 401
+
+    # A refresh token works exactly once
+    new_tokens = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]}).json()
+    assert client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    headers = {"Authorization": f"Bearer {new_tokens['access_token']}"}
+    assert client.get("/protected", headers=headers).status_code == 200
+
+    # Logout revokes the access token (no DB lookup needed) and the refresh token
+    assert client.post("/logout", json={"refresh_token": new_tokens["refresh_token"]}, headers=headers).status_code == 204
+    assert client.get("/protected", headers=headers).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": new_tokens["refresh_token"]}).status_code == 401
+
+    # Other processes learn about the revocation from the periodic sync
+    other_process = auth.RevocationList()
+    other_process.sync(db_session)
+    jti = auth.decode_token(new_tokens["access_token"], "access")["jti"]
+    assert jti in other_process
+    assert other_process.sync(db_session) == 1  # only re-reads the recent overlap window
+
+
+def test_signing_keys_rotate_by_kid(client, monkeypatch):
+    from app import auth
+    client.post("/register", json={"username": "erin", "password": "secret"})
+    monkeypatch.setattr(auth, "SIGNING_KEYS", {"old": "old-secret"})
+    monkeypatch.setattr(auth, "ACTIVE_KID", "old")
+    old_token = client.post("/login", json={"username": "erin", "password": "secret"}).json()["access_token"]
+
+    # New key becomes active: tokens signed with the old one stay valid while it is still listed
+    monkeypatch.setattr(auth, "SIGNING_KEYS", {"old": "old-secret", "new": "new-secret"})
+    monkeypatch.setattr(auth, "ACTIVE_KID", "new")
+    new_token = client.post("/login", json={"username": "erin", "password": "secret"}).json()["access_token"]
+    assert auth.jwt.get_unverified_header(new_token)["kid"] == "new"
+    for token in (old_token, new_token):
+        assert client.get("/protected", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+    # Once the old key is dropped, its tokens are rejected
+    monkeypatch.setattr(auth, "SIGNING_KEYS", {"new": "new-secret"})
+    assert client.get("/protected", headers={"Authorization": f"Bearer {old_token}"}).status_code == 401
+    assert client.get("/protected", headers={"Authorization": f"Bearer {new_token}"}).status_code == 200
+
+
+def test_rate_limiting_and_in_flight_cap(client, monkeypatch):
+    from app import ratelimit
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "buckets", ratelimit.MemoryBuckets())
+    monkeypatch.setitem(ratelimit.ROUTE_LIMITS, ("POST", "/login"), ratelimit.Limit(0.01, 2))
+    credentials = {"username": "nobody", "password": "x"}
+    assert [client.post("/login", json=credentials).status_code for _ in range(3)] == [401, 401, 429]
+    response = client.post("/login", json=credentials)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 1
+    # Other routes have their own bucket, and monitoring is never limited
+    assert client.get("/protected").status_code == 401
+    assert client.get("/metrics").status_code == 200
+
+    # Users are limited by their verified token, not by IP
+    monkeypatch.setattr(ratelimit, "DEFAULT_LIMIT", ratelimit.Limit(0.01, 1))
+    monkeypatch.setattr(ratelimit, "buckets", ratelimit.MemoryBuckets())
+    client.post("/register", json={"username": "frank", "password": "secret"})
+    token = client.post("/login", json={"username": "frank", "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/protected", headers=headers).status_code == 200
+    assert client.get("/protected", headers=headers).status_code == 429
+
+    # Over the in-flight cap everything is shed with a 503
+    monkeypatch.setattr(ratelimit, "in_flight", ratelimit.MAX_IN_FLIGHT)
+    response = client.post("/login", json=credentials)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
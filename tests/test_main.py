@@ -1,3 +1,4 @@
+import json
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -5,4 +6,616 @@ client = TestClient(app)
 
 def test_root_returns_404():
     response = client.get("/")
-    assert response.status_code == 404  # adjust based on your route behavior
\ No newline at end of file
+    assert response.status_code == 404  # adjust based on your route behavior
+
+
+def create_tasks(client, count, **overrides):
+    for i in range(count):
+        task = {
+            "title": f"Task {i}",
+            "description": "desc",
+            "due_date": f"2025-05-{(i % 28) + 1:02d}",
+            "status": "done" if i % 2 else "pending",
+        }
+        task.update(overrides)
+        assert client.post("/tasks/", json=task).status_code == 200
+
+
+def test_list_tasks_paginates_with_cursor(auth_client):
+    create_tasks(auth_client, 5)
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = auth_client.get("/tasks/", params=params).json()
+        seen.extend(task["id"] for task in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == 5
+    assert seen == sorted(seen)
+
+
+def test_list_tasks_filters_and_sorts_by_due_date(auth_client):
+    create_tasks(auth_client, 6)
+    page = auth_client.get("/tasks/", params={
+        "status": "pending", "sort": "due_date", "order": "desc", "due_to": "2025-05-03",
+    }).json()
+    assert [task["due_date"] for task in page["items"]] == ["2025-05-03", "2025-05-01"]
+    assert all(task["status"] == "pending" for task in page["items"])
+
+    page = auth_client.get("/tasks/", params={"title_prefix": "Task 4"}).json()
+    assert [task["title"] for task in page["items"]] == ["Task 4"]
+
+
+def test_list_tasks_rejects_bad_cursor_and_page_size(auth_client):
+    assert auth_client.get("/tasks/", params={"cursor": "not-a-cursor"}).status_code == 400
+    #Well-formed JSON of the wrong shape is just as invalid
+    from app import utils
+    for data in ({"s": "id", "o": "asc", "k": {"0": 1}}, {"s": "id", "o": "asc", "k": "1"}, {"s": "id", "o": "asc", "k": [None]}):
+        assert auth_client.get("/tasks/", params={"cursor": utils.encode_cursor(data)}).status_code == 400
+    assert auth_client.get("/tasks/", params={"limit": 10_000}).status_code == 422
+
+
+def test_export_tasks_streams_ndjson_and_csv(auth_client):
+    create_tasks(auth_client, 3)
+    response = auth_client.get("/tasks/export", params={"status": "pending"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["title"] for row in rows] == ["Task 0", "Task 2"]
+
+    response = auth_client.get("/tasks/export", params={"format": "csv"})
+    lines = response.text.splitlines()
+    assert lines[0] == "id,title,description,due_date,status"
+    assert len(lines) == 4
+
+
+def test_bulk_create_update_delete(auth_client, db_session):
+    from app import models
+
+    response = auth_client.post("/tasks/bulk", json=[
+        {"title": "A", "description": "a", "due_date": "2025-05-01"},
+        {"title": "B", "description": "b"},
+        {"title": "C", "description": "c", "due_date": "2025-05-03", "status": "done"},
+    ])
+    assert response.status_code == 200
+    result = response.json()
+    assert len(result["ids"]) == 2
+    assert [error["index"] for error in result["errors"]] == [1]
+    first, second = result["ids"]
+
+    result = auth_client.patch("/tasks/bulk", json=[
+        {"id": first, "status": "done"},
+        {"id": 999_999, "status": "done"},
+    ]).json()
+    assert result["ids"] == [first]
+    assert result["errors"][0]["detail"] == "Task not found"
+    assert auth_client.get(f"/tasks/{first}").json()["status"] == "done"
+    assert auth_client.get(f"/tasks/{first}").json()["title"] == "A"
+    assert auth_client.get(f"/tasks/{first}").json()["version"] == 2
+    #Bulk writes queue the same notifications as single ones
+    events = [(job.payload["task_id"], job.payload["event"]) for job in db_session.query(models.Job).order_by(models.Job.id)]
+    assert events == [(first, "created"), (second, "created"), (first, "status changed to done")]
+
+    result = auth_client.request("DELETE", "/tasks/bulk", json={"ids": [second, 999_999]}).json()
+    assert result["ids"] == [second]
+    assert result["errors"][0]["id"] == 999_999
+    assert auth_client.get(f"/tasks/{second}").status_code == 404
+
+
+def test_bulk_update_reports_explicit_null_as_item_error(auth_client):
+    task_ids = auth_client.post("/tasks/bulk", json=[
+        {"title": "A", "description": "d", "due_date": "2025-05-01"},
+        {"title": "B", "description": "d", "due_date": "2025-05-02"},
+    ]).json()["ids"]
+    result = auth_client.patch("/tasks/bulk", json=[
+        {"id": task_ids[0], "title": None},
+        {"id": task_ids[1], "status": "done"},
+    ]).json()
+    assert result["ids"] == [task_ids[1]]
+    assert [(error["index"], error["id"]) for error in result["errors"]] == [(0, task_ids[0])]
+    assert auth_client.get(f"/tasks/{task_ids[0]}").json()["title"] == "A"
+
+
+def test_bulk_update_applies_repeated_ids_in_request_order(auth_client):
+    task_id = auth_client.post("/tasks/", json={"title": "A", "description": "d", "due_date": "2025-05-01"}).json()["id"]
+    result = auth_client.patch("/tasks/bulk", json=[
+        {"id": task_id, "status": "a", "title": "x"},
+        {"id": task_id, "status": "b"},
+        {"id": task_id, "status": "c", "title": "y"},
+    ]).json()
+    assert result["errors"] == []
+    task = auth_client.get(f"/tasks/{task_id}").json()
+    assert (task["status"], task["title"], task["version"]) == ("c", "y", 4)
+    assert auth_client.get("/tasks/stats").json()["by_status"] == {"c": 1}
+
+    #An item with nothing to change is a no-op: same version, same collection ETag
+    etag = auth_client.get("/tasks/").headers["etag"]
+    result = auth_client.patch("/tasks/bulk", json=[{"id": task_id}]).json()
+    assert result == {"ids": [task_id], "errors": []}
+    assert auth_client.get(f"/tasks/{task_id}").json()["version"] == 4
+    assert auth_client.get("/tasks/").headers["etag"] == etag
+
+
+def test_task_routes_with_async_session(lifespan_database):
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from app.database import Base, get_db
+
+    url = lifespan_database
+    Base.metadata.create_all(bind=create_engine(url))
+    async_engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://"))
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def override_get_db():
+        async with AsyncSessionLocal() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        with TestClient(app) as async_client:
+            credentials = {"username": "async-owner", "password": "secret"}
+            async_client.post("/register", json=credentials)
+            token = async_client.post("/login", json=credentials).json()["access_token"]
+            async_client.headers["Authorization"] = f"Bearer {token}"
+            create_tasks(async_client, 3)
+            page = async_client.get("/tasks/", params={"limit": 2}).json()
+            assert len(page["items"]) == 2 and page["next_cursor"]
+            task_id = page["items"][0]["id"]
+            assert async_client.get(f"/tasks/{task_id}").json()["title"] == "Task 0"
+            assert len(async_client.get("/tasks/export").text.splitlines()) == 3
+            assert async_client.delete(f"/tasks/{task_id}").status_code == 200
+            assert async_client.get(f"/tasks/{task_id}").status_code == 404
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+
+def test_engine_options_and_pool_metrics(client, tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from app import database
+
+    options = database.engine_options("postgresql://u:p@localhost/db")
+    assert options["poolclass"] is database.TimedQueuePool
+    assert options["pool_pre_ping"] is True
+    assert "poolclass" not in database.engine_options("sqlite://")
+    assert database.engine_options("sqlite:///tasks.db")["poolclass"] is database.TimedQueuePool
+
+    metrics = client.get("/metrics/db").json()
+    assert {"checkouts", "timeouts", "wait_seconds_avg", "wait_seconds_max"} <= metrics.keys()
+
+    #Each engine's pool is reported on its own, labelled by engine
+    monkeypatch.setitem(database.pool_stats, "sync", database.PoolStats())
+    monkeypatch.setitem(database.pool_stats, "async", database.PoolStats())
+    sync_engine = create_engine(f"sqlite:///{tmp_path}/pool.db", poolclass=database.TimedQueuePool, pool_size=3)
+    with sync_engine.connect():
+        pass
+    monkeypatch.setattr(database, "engine", sync_engine)
+    monkeypatch.setattr(database, "ASYNC_DB", False)
+    metrics = client.get("/metrics/db").json()
+    assert (metrics["checkouts"], metrics["size"]) == (1, 3)
+    assert list(metrics["engines"]) == ["sync"]
+    monkeypatch.setattr(database, "ASYNC_DB", True)
+    metrics = client.get("/metrics/db").json()
+    assert metrics["checkouts"] == 0 and metrics["engines"]["sync"]["checkouts"] == 1
+    body = client.get("/metrics").text
+    assert 'db_pool_checkouts{engine="sync"} 1' in body and 'db_pool_checkouts{engine="async"} 0' in body
+    assert 'db_pool_size{engine="sync"} 3' in body
+    sync_engine.dispose()
+
+
+def test_read_task_uses_cache_and_etag(auth_client):
+    from app import cache
+
+    task_id = auth_client.post("/tasks/", json={"title": "Hot", "description": "d", "due_date": "2025-05-01"}).json()["id"]
+    first = auth_client.get(f"/tasks/{task_id}")
+    etag = first.headers["ETag"]
+    before = cache.task_cache.stats()
+    not_modified = auth_client.get(f"/tasks/{task_id}", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert cache.task_cache.stats()["hits"] == before["hits"] + 1
+
+    auth_client.put(f"/tasks/{task_id}", json={"title": "Hot", "description": "d", "due_date": "2025-05-01", "status": "done"})
+    before = cache.task_cache.stats()
+    changed = auth_client.get(f"/tasks/{task_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    #A cold read is one miss, not one per cache layer
+    assert cache.task_cache.stats()["misses"] == before["misses"] + 1
+    assert changed.json()["status"] == "done"
+    assert changed.headers["ETag"] != etag
+
+    metrics = auth_client.get("/metrics/cache").json()
+    assert metrics["tasks"]["hits"] >= 1 and metrics["tasks"]["misses"] >= 1
+
+
+def test_patch_task_updates_only_sent_fields_with_version_check(auth_client):
+    task = auth_client.post("/tasks/", json={"title": "T", "description": "d", "due_date": "2025-05-01"}).json()
+    assert task["version"] == 1
+
+    response = auth_client.patch(f"/tasks/{task['id']}", json={"status": "done", "version": 1})
+    assert response.status_code == 200
+    patched = response.json()
+    assert patched["status"] == "done" and patched["title"] == "T" and patched["version"] == 2
+
+    stale = auth_client.patch(f"/tasks/{task['id']}", json={"title": "Other", "version": 1})
+    assert stale.status_code == 409
+    assert auth_client.get(f"/tasks/{task['id']}").json()["title"] == "T"
+
+    assert auth_client.patch("/tasks/999999", json={"status": "done"}).status_code == 404
+    put = auth_client.put(f"/tasks/{task['id']}", json={"title": "T2", "description": "d", "due_date": "2025-05-01"})
+    assert put.json()["version"] == 3
+
+
+def test_patch_task_rejects_explicit_null(auth_client):
+    task = auth_client.post("/tasks/", json={"title": "T", "description": "d", "due_date": "2025-05-01"}).json()
+    for field in ("title", "description", "due_date", "status"):
+        assert auth_client.patch(f"/tasks/{task['id']}", json={field: None}).status_code == 422
+    #The task was left alone and can still be read; a null version just skips the version check
+    assert auth_client.get(f"/tasks/{task['id']}").json()["version"] == 1
+    assert auth_client.patch(f"/tasks/{task['id']}", json={"status": "done", "version": None}).status_code == 200
+
+
+def test_tasks_are_scoped_to_their_owner(auth_client):
+    task_id = auth_client.post("/tasks/", json={"title": "Mine", "description": "d", "due_date": "2025-05-01"}).json()["id"]
+    assert auth_client.get(f"/tasks/{task_id}").status_code == 200
+
+    credentials = {"username": "intruder", "password": "secret"}
+    auth_client.post("/register", json=credentials)
+    token = auth_client.post("/login", json=credentials).json()["access_token"]
+    other = {"Authorization": f"Bearer {token}"}
+    assert auth_client.get("/tasks/", headers=other).json()["items"] == []
+    assert auth_client.get(f"/tasks/{task_id}", headers=other).status_code == 404
+    assert auth_client.patch(f"/tasks/{task_id}", json={"status": "done"}, headers=other).status_code == 404
+    assert auth_client.request("DELETE", "/tasks/bulk", json={"ids": [task_id]}, headers=other).json()["ids"] == []
+    assert auth_client.delete(f"/tasks/{task_id}", headers=other).status_code == 404
+    assert auth_client.get(f"/tasks/{task_id}").json()["status"] == "pending"
+
+    #Deleting returns the deleted task; after that it is missing for its owner too
+    response = auth_client.delete(f"/tasks/{task_id}")
+    assert response.status_code == 200
+    assert response.json()["id"] == task_id and response.json()["title"] == "Mine"
+    assert auth_client.delete(f"/tasks/{task_id}").status_code == 404
+    assert auth_client.delete("/tasks/999999").status_code == 404
+
+    assert auth_client.get("/tasks/", headers={"Authorization": ""}).status_code == 401
+
+
+def test_metrics_count_queries_per_route(auth_client):
+    task_id = auth_client.post("/tasks/", json={"title": "M", "description": "d", "due_date": "2025-05-01"}).json()["id"]
+    response = auth_client.get(f"/tasks/{task_id}")
+    assert "db;dur=" in response.headers["Server-Timing"]
+    # First read misses the task cache (one SELECT), the second one is served from it
+    assert response.headers["X-DB-Queries"] == "1"
+    assert auth_client.get(f"/tasks/{task_id}").headers["X-DB-Queries"] == "0"
+
+    body = auth_client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/tasks/{task_id}",status="200"}' in body
+    assert 'db_queries_per_request_count{method="POST",route="/tasks/"}' in body
+    assert "# TYPE db_pool_checkouts gauge" in body
+
+
+def test_search_tasks_ranks_and_paginates(auth_client):
+    create_tasks(auth_client, 3)
+    auth_client.post("/tasks/", json={"title": "Write report", "description": "quarterly numbers", "due_date": "2025-06-01"})
+    auth_client.post("/tasks/", json={"title": "Call Bob", "description": "about the report", "due_date": "2025-06-02"})
+    page = auth_client.get("/tasks/search", params={"q": "report", "limit": 1}).json()
+    #Title matches rank above description matches
+    assert [task["title"] for task in page["items"]] == ["Write report"]
+    assert page["next_offset"] == 1
+    page = auth_client.get("/tasks/search", params={"q": "report", "offset": 1}).json()
+    assert [task["title"] for task in page["items"]] == ["Call Bob"]
+    assert page["next_offset"] is None
+    #Edits are picked up by the index; FTS syntax characters are taken literally
+    task_id = page["items"][0]["id"]
+    auth_client.patch(f"/tasks/{task_id}", json={"description": "lunch"})
+    assert auth_client.get("/tasks/search", params={"q": "report"}).json()["items"][0]["title"] == "Write report"
+    assert auth_client.get("/tasks/search", params={"q": 'lunch"(*'}).json()["items"][0]["id"] == task_id
+    assert auth_client.get("/tasks/search", params={"q": "report"}).json()["next_offset"] is None
+
+
+def test_task_stats_follow_every_write(auth_client, db_session):
+    from datetime import date, timedelta
+    from app import crud
+    today = date.today()
+    create_tasks(auth_client, 4, due_date=str(today - timedelta(days=1)))
+    ids = auth_client.post("/tasks/bulk", json=[
+        {"title": "soon", "description": "d", "due_date": str(today + timedelta(days=3))},
+        {"title": "later", "description": "d", "due_date": "2999-01-01"},
+    ]).json()["ids"]
+    stats = auth_client.get("/tasks/stats").json()
+    assert stats["total"] == 6
+    assert stats["by_status"] == {"pending": 4, "done": 2}
+    assert stats["overdue"] == 2
+    assert stats["due"] == {"overdue": 2, "today": 0, "next_7_days": 1, "later": 1, "no_due_date": 0}
+    assert stats["by_due_month"]["2999-01"] == 1
+
+    #Every kind of write moves the counters
+    auth_client.patch(f"/tasks/{ids[0]}", json={"status": "done"})
+    auth_client.put(f"/tasks/{ids[1]}", json={"title": "t", "description": "d", "due_date": str(today)})
+    auth_client.patch("/tasks/bulk", json=[{"id": ids[1], "status": "done"}, {"id": ids[1], "due_date": "2999-02-01"}])
+    auth_client.delete(f"/tasks/{ids[0]}")
+    first = auth_client.get("/tasks/", params={"limit": 1}).json()["items"][0]["id"]
+    auth_client.request("DELETE", "/tasks/bulk", json={"ids": [first]})
+    stats = auth_client.get("/tasks/stats").json()
+    assert stats["total"] == 4
+    assert stats["by_status"] == {"pending": 1, "done": 3}
+    assert stats["by_due_month"]["2999-02"] == 1
+
+    #The counters match a full recount
+    user = crud.get_user_by_username("owner", db_session)
+    crud.rebuild_task_stats(db_session, user.id)
+    assert auth_client.get("/tasks/stats").json() == stats
+
+
+def test_fast_json_list_matches_validated_response(auth_client, monkeypatch):
+    from app import models, responses, schemas
+    create_tasks(auth_client, 3)
+    validated = auth_client.get("/tasks/").json()
+    monkeypatch.setattr(responses, "FAST_JSON", True)
+    fast = auth_client.get("/tasks/")
+    assert fast.json() == validated
+    assert fast.content.startswith(b'{"items":[{"id":')
+    #Response schemas can be built straight from ORM objects
+    task = schemas.TaskResponse.model_validate(models.Task(**validated["items"][0]))
+    assert task.id == validated["items"][0]["id"]
+
+
+def test_jobs_are_queued_by_writes_and_run_by_the_worker(auth_client, db_session, monkeypatch):
+    import asyncio
+    from datetime import date, timedelta
+    from app import jobs, models
+    monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 0)
+    sent = []
+
+    async def fake_send(owner_id, message):
+        sent.append(message)
+    monkeypatch.setattr(jobs, "send_notification", fake_send)
+
+    tomorrow = str(date.today() + timedelta(days=1))
+    create_tasks(auth_client, 1, due_date=tomorrow)
+    create_tasks(auth_client, 1, due_date="2999-01-01")
+    #The request only queued the notifications
+    assert [job.kind for job in db_session.query(models.Job)] == ["task_notification", "task_notification"]
+    assert sent == []
+
+    #One worker round: the scheduler adds a reminder for the task due tomorrow, then everything runs
+    worker = jobs.JobWorker(session_factory=lambda: db_session)
+    assert asyncio.run(worker.run_once()) == 3
+    assert [message for message in sent if message.endswith(f"is due {tomorrow}")]
+    assert {job.status for job in db_session.query(models.Job)} == {"done"}
+    #Reminders are not queued twice for the same due date
+    assert jobs.schedule_reminders(db_session) == 1
+    assert db_session.query(models.Job).count() == 3
+
+    #Failing jobs are retried, then marked failed
+    async def broken(payload, run_db):
+        raise RuntimeError("smtp down")
+    monkeypatch.setitem(jobs.HANDLERS, "broken", broken)
+    job = jobs.enqueue(db_session, "broken", {})
+    job.max_attempts = 2
+    db_session.commit()
+    job_id = job.id
+    asyncio.run(worker.run_once())
+    job = db_session.get(models.Job, job_id)
+    assert (job.status, job.attempts) == ("queued", 1)
+    asyncio.run(worker.run_once())
+    job = db_session.get(models.Job, job_id, populate_existing=True)
+    assert (job.status, job.attempts, job.last_error) == ("failed", 2, "RuntimeError('smtp down')")
+
+
+def test_migrations_create_the_models_schema(tmp_path):
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from sqlalchemy import create_engine
+    from app import database
+
+    url = f"sqlite:///{tmp_path / 'migrated.db'}"
+    database.migrate(url)
+    migrated = create_engine(url)
+    with migrated.connect() as connection:
+        diffs = compare_metadata(MigrationContext.configure(connection), database.Base.metadata)
+        #Only the FTS5 tables (raw DDL, not in the metadata) may differ
+        assert [diff for diff in diffs if not diff[1].name.startswith("tasks_fts")] == []
+    migrated.dispose()
+
+
+def test_lifespan_builds_engines_and_reports_startup(lifespan_database):
+    from app import database
+
+    #The lifespan builds the engines, and disposes of them on shutdown
+    with TestClient(app) as client:
+        assert str(database.engine.url) == lifespan_database
+        assert database.SessionLocal.kw["bind"] is database.engine
+        text = client.get("/metrics").text
+        assert "app_startup_import_seconds" in text and "app_startup_lifespan_seconds" in text
+    assert database.engine is None
+
+
+def test_change_feed_pushes_writes_and_resumes(auth_client, db_session, monkeypatch):
+    import pytest
+    from starlette.websockets import WebSocketDisconnect
+    from app import changes
+
+    token = auth_client.headers["Authorization"][7:]
+    with pytest.raises(WebSocketDisconnect):
+        with auth_client.websocket_connect("/tasks/changes/ws", headers={"Authorization": "Bearer invalid"}):
+            pass
+    assert auth_client.get("/tasks/changes", headers={"Authorization": ""}).status_code == 401
+
+    with auth_client.websocket_connect(f"/tasks/changes/ws?token={token}") as feed:
+        start = feed.receive_json()
+        assert start["type"] == "ready"
+        task_id = auth_client.post("/tasks/", json={"title": "Live", "description": "d", "due_date": "2025-05-01"}).json()["id"]
+        created = feed.receive_json()
+        assert (created["op"], created["task"]["title"]) == ("created", "Live")
+        auth_client.patch(f"/tasks/{task_id}", json={"status": "done"})
+        assert feed.receive_json()["task"]["status"] == "done"
+        auth_client.delete(f"/tasks/{task_id}")
+        deleted = feed.receive_json()
+        assert (deleted["op"], deleted["task_id"], deleted["task"]) == ("deleted", task_id, None)
+
+    #Resuming replays everything after the given seq, in order
+    with auth_client.websocket_connect(f"/tasks/changes/ws?token={token}&since={start['seq']}") as feed:
+        assert feed.receive_json() == {"type": "ready", "seq": start["seq"]}
+        assert [feed.receive_json()["op"] for _ in range(3)] == ["created", "updated", "deleted"]
+
+    #Once the changes after `since` are purged, the feed asks the client to reload instead
+    monkeypatch.setattr(changes, "CHANGES_RETENTION_HOURS", -1)
+    assert changes.purge_task_changes(db_session) == 2
+    with auth_client.websocket_connect(f"/tasks/changes/ws?token={token}&since={start['seq']}") as feed:
+        assert feed.receive_json() == {"type": "reset", "seq": deleted["seq"]}
+
+    assert changes.format_sse(deleted).startswith(f"id: {deleted['seq']}\nevent: deleted\ndata: ")
+    assert changes.format_sse(None) == ": keep-alive\n\n"
+
+
+def test_task_list_conditional_requests_and_compression(auth_client, monkeypatch):
+    from app import compression
+
+    create_tasks(auth_client, 30)
+    first = auth_client.get("/tasks/", headers={"Accept-Encoding": "gzip"})
+    etag = first.headers["etag"]
+    assert first.headers["content-encoding"] == "gzip"
+    assert first.headers["cache-control"] == "private, no-cache"
+    assert len(first.json()["items"]) == 30
+
+    #Unchanged tasks: 304, for the list, the export and the stats
+    assert auth_client.get("/tasks/", headers={"If-None-Match": etag}).status_code == 304
+    export = auth_client.get("/tasks/export")
+    assert auth_client.get("/tasks/export", headers={"If-None-Match": export.headers["etag"]}).status_code == 304
+    stats = auth_client.get("/tasks/stats")
+    assert auth_client.get("/tasks/stats", headers={"If-None-Match": stats.headers["etag"]}).status_code == 304
+    #Another page or filter is another representation
+    assert auth_client.get("/tasks/", params={"limit": 5}, headers={"If-None-Match": etag}).status_code == 200
+
+    #Any write changes the marker
+    create_tasks(auth_client, 1)
+    second = auth_client.get("/tasks/", headers={"If-None-Match": etag})
+    assert second.status_code == 200 and second.headers["etag"] != etag
+
+    #Streamed bodies are compressed chunk by chunk
+    streamed = auth_client.get("/tasks/export", headers={"Accept-Encoding": "gzip"})
+    assert streamed.headers["content-encoding"] == "gzip" and "content-length" not in streamed.headers
+    assert len(streamed.text.splitlines()) == 31
+
+    #Small bodies are sent as is; q=0 refuses an encoding
+    assert "content-encoding" not in auth_client.get("/tasks/", params={"limit": 1}, headers={"Accept-Encoding": "gzip"}).headers
+    assert compression.choose_encoding("gzip;q=0, identity") is None
+    assert compression.choose_encoding("deflate, *;q=0.5") == "gzip"
+    monkeypatch.setattr(compression, "brotli", object())
+    assert compression.choose_encoding("gzip, br") == "br"
+    assert compression.choose_encoding("gzip;q=1, br;q=0.5") == "gzip"
+
+    #A compressed task keeps its ETag, made weak: the gzip body differs from the identity one
+    task_id = auth_client.post("/tasks/", json={"title": "Big", "description": "x" * 2000, "due_date": "2025-05-01"}).json()["id"]
+    plain = auth_client.get(f"/tasks/{task_id}", headers={"Accept-Encoding": "identity"})
+    gzipped = auth_client.get(f"/tasks/{task_id}", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert not plain.headers["etag"].startswith("W/") and gzipped.headers["etag"] == "W/" + plain.headers["etag"]
+    assert auth_client.get(f"/tasks/{task_id}", headers={"If-None-Match": gzipped.headers["etag"]}).status_code == 304
+
+
+def test_create_task_with_idempotency_key(auth_client, db_session, monkeypatch):
+    from app import cache, crud, models
+
+    body = {"title": "Pay rent", "description": "d", "due_date": "2025-05-01"}
+    headers = {"Idempotency-Key": "create-1"}
+    first = auth_client.post("/tasks/", json=body, headers=headers)
+    assert first.status_code == 200 and "idempotent-replayed" not in first.headers
+
+    #A retry, from the cache and then from the table, gets the same task back
+    retry = auth_client.post("/tasks/", json=body, headers=headers)
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    cache.idempotency_cache.clear()
+    assert auth_client.post("/tasks/", json=body, headers=headers).json() == first.json()
+    assert db_session.query(models.Task).count() == 1
+
+    #Same key, different request
+    assert auth_client.post("/tasks/", json={**body, "title": "Other"}, headers=headers).status_code == 422
+    #No key: a plain create
+    assert auth_client.post("/tasks/", json=body).json()["id"] != first.json()["id"]
+
+    #Expired keys can be used again, and housekeeping deletes them
+    monkeypatch.setattr(crud, "IDEMPOTENCY_TTL_HOURS", -1)
+    again = auth_client.post("/tasks/", json=body, headers={"Idempotency-Key": "create-2"})
+    cache.idempotency_cache.clear()
+    assert auth_client.post("/tasks/", json=body, headers={"Idempotency-Key": "create-2"}).json()["id"] != again.json()["id"]
+    crud.purge_idempotency_keys(db_session)
+    assert db_session.query(models.IdempotencyKey).count() == 1
+
+
+def test_deleted_and_old_done_tasks_are_swept_to_the_archive(auth_client, db_session):
+    from app import crud, models
+
+    def create(status):
+        task = {"title": status, "description": "d", "due_date": "2020-01-01", "status": status}
+        return auth_client.post("/tasks/", json=task).json()["id"]
+
+    old_done = [create("done") for _ in range(3)]
+    deleted, pending, newest = create("pending"), create("pending"), create("done")
+    assert auth_client.delete(f"/tasks/{deleted}").status_code == 200
+    #Soft delete: gone for the API right away, the row stays until the sweep
+    assert auth_client.get(f"/tasks/{deleted}").status_code == 404
+    assert db_session.query(models.Task).count() == 6
+    etag = auth_client.get("/tasks/").headers["etag"]
+    stats = auth_client.get("/tasks/stats").json()
+
+    #Batches of 2: the three old done tasks are archived, the deleted one removed.
+    #The newest task is kept (its id must not be reused), although it is old and done too.
+    assert crud.sweep_tasks(db_session, batch_size=2) == (3, 1)
+    assert crud.sweep_tasks(db_session) == (0, 0)
+    assert db_session.query(models.Task).count() == 2
+    assert db_session.query(models.ArchivedTask).count() == 3
+
+    #Archiving is a change: new ETag, and the feed reports the tasks as gone
+    page = auth_client.get("/tasks/", headers={"If-None-Match": etag})
+    assert page.status_code == 200
+    assert [(task["id"], task["archived"]) for task in page.json()["items"]] == [(pending, False), (newest, False)]
+    owner_id = db_session.get(models.Task, pending).owner_id
+    archived_changes = [change for change in crud.get_task_changes(db_session, owner_id, 0) if change["op"] == "archived"]
+    assert [(change["task_id"], change["task"]) for change in archived_changes] == [(task_id, None) for task_id in old_done]
+    #Archived tasks still count in the stats
+    assert auth_client.get("/tasks/stats").json() == stats
+    crud.rebuild_task_stats(db_session)
+    assert auth_client.get("/tasks/stats").json() == stats
+
+    #include_archived merges both tables, in order, across pages
+    ids, cursor = [], None
+    while True:
+        params = {"include_archived": True, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        body = auth_client.get("/tasks/", params=params).json()
+        ids += [(task["id"], task["archived"]) for task in body["items"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    assert ids == [(task_id, True) for task_id in old_done] + [(pending, False), (newest, False)]
+
+    assert auth_client.get(f"/tasks/{old_done[0]}").status_code == 404
+    archived = auth_client.get(f"/tasks/{old_done[0]}", params={"include_archived": True})
+    assert archived.json()["archived"] is True and archived.headers["etag"]
+    #Archived tasks are read-only
+    assert auth_client.patch(f"/tasks/{old_done[0]}", json={"status": "pending"}).status_code == 404
+
+
+def test_collection_etag_survives_change_log_purge(auth_client, db_session, monkeypatch):
+    from app import changes
+
+    empty = auth_client.get("/tasks/").headers["etag"]
+    create_tasks(auth_client, 2)
+    #Another user's write is now the newest row of the whole log
+    credentials = {"username": "other", "password": "other-password"}
+    auth_client.post("/register", json=credentials)
+    token = auth_client.post("/login", json=credentials).json()["access_token"]
+    auth_client.post(
+        "/tasks/", json={"title": "B", "description": "d", "due_date": "2025-05-01"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    monkeypatch.setattr(changes, "CHANGES_RETENTION_HOURS", -1)
+    assert changes.purge_task_changes(db_session) == 1
+    #Each user keeps their newest change, so the ETag from before the first task can't match again
+    assert auth_client.get("/tasks/", headers={"If-None-Match": empty}).status_code == 200